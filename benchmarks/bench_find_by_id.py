@@ -0,0 +1,35 @@
+"""Measures NodeTree.find_by_id() and find_by_path() cost as the tree grows.
+
+Run from the package root folder:
+
+    $ python -m benchmarks.bench_find_by_id
+"""
+from benchmarks import synthetic
+import random
+import timeit
+
+LOOKUPS = 10000
+
+
+def run(component_count, signals_per_component):
+    connection = synthetic.create_connection()
+    structure = synthetic.create_structure(component_count, signals_per_component)
+    node_tree = synthetic.create_node_tree(connection, structure)
+    nodes = list(synthetic.walk(structure))
+    random.seed(0)
+    ids = [random.choice(nodes)[0] for _ in range(LOOKUPS)]
+    lookup_paths = [random.choice(nodes)[1] for _ in range(LOOKUPS)]
+    by_id = min(timeit.repeat(lambda: [node_tree.find_by_id(i) for i in ids], number=1, repeat=5))
+    by_path = min(timeit.repeat(lambda: [node_tree.find_by_path(p) for p in lookup_paths], number=1, repeat=5))
+    return len(nodes), by_id / LOOKUPS, by_path / LOOKUPS
+
+
+def main():
+    print('{:>8} {:>16} {:>18}'.format('nodes', 'find_by_id [us]', 'find_by_path [us]'))
+    for component_count, signals_per_component in ((10, 10), (100, 10), (100, 100), (400, 100)):
+        nodes, by_id, by_path = run(component_count, signals_per_component)
+        print('{:>8} {:>16.3f} {:>18.3f}'.format(nodes, by_id * 1e6, by_path * 1e6))
+
+
+if __name__ == '__main__':
+    main()
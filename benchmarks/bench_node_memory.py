@@ -0,0 +1,48 @@
+"""Measures Python heap bytes held per Node, with children built on access and with all children built.
+
+Memory of the protobuf messages themselves is not traced, only the Node objects built from them.
+
+Run from the package root folder:
+
+    $ python -m benchmarks.bench_node_memory
+"""
+from benchmarks import synthetic
+from cdp_client import cdp
+import gc
+import tracemalloc
+
+
+def build_all(root_node):
+    nodes = [root_node]
+    count = 0
+    while nodes:
+        node = nodes.pop()
+        count += 1
+        nodes.extend(node._children)
+    return count
+
+
+def run(component_count, signals_per_component):
+    connection = synthetic.create_connection()
+    structure = synthetic.create_structure(component_count, signals_per_component)
+    node_count = sum(1 for _ in synthetic.walk(structure))
+    gc.collect()
+    tracemalloc.start()
+    root_node = cdp.Node(None, connection, structure)
+    root_only = tracemalloc.get_traced_memory()[0]
+    build_all(root_node)
+    gc.collect()
+    all_built = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return node_count, root_only, all_built / node_count
+
+
+def main():
+    print('{:>8} {:>16} {:>20}'.format('nodes', 'root only [B]', 'all built [B/node]'))
+    for component_count, signals_per_component in ((10, 10), (100, 100), (2000, 100)):
+        nodes, root_only, per_node = run(component_count, signals_per_component)
+        print('{:>8} {:>16} {:>20.1f}'.format(nodes, root_only, per_node))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""Measures Node._update_structure() cost for components with many children.
+
+Every round removes one child, renumbers one child and adds one child, like a typical structure change.
+
+Run from the package root folder:
+
+    $ python -m benchmarks.bench_update_structure
+"""
+from benchmarks import synthetic
+from cdp_client import cdp
+from copy import copy
+import timeit
+
+
+def run(child_count):
+    connection = synthetic.create_connection()
+    structure = synthetic.create_structure(1, child_count).node[0]
+    node_tree = connection.node_tree()
+    node_tree._root_node = cdp.Node(None, connection, structure)
+    node_tree.find_by_id(0)  # builds the index so that it is maintained during updates
+    changed = copy(structure)
+    del changed.node[0]
+    changed.node[0].info.node_id += 10 * child_count
+    added = changed.node.add()
+    added.CopyFrom(structure.node[0])
+    added.info.node_id += 20 * child_count
+    added.info.name = 'Added'
+    structures = [changed, structure]
+
+    def update():
+        node_tree._root_node._update_structure(structures[0])
+        structures.reverse()
+
+    return min(timeit.repeat(update, number=1, repeat=7))
+
+
+def main():
+    print('{:>8} {:>12} {:>16}'.format('children', 'update [ms]', 'per child [us]'))
+    for child_count in (1000, 10000, 100000):
+        duration = run(child_count)
+        print('{:>8} {:>12.2f} {:>16.3f}'.format(child_count, duration * 1e3, duration / child_count * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+from cdp_client import cdp
+from cdp_client import cdp_pb2 as proto
+
+
+def create_connection():
+    return cdp.Connection('127.0.0.1', 7689, False)
+
+
+def create_structure(component_count, signals_per_component, first_node_id=1):
+    """Creates an application proto.Node with component_count components holding signals_per_component signals."""
+    node_id = first_node_id
+    app = proto.Node()
+    app.info.node_id = node_id
+    app.info.name = 'App'
+    app.info.node_type = proto.CDP_APPLICATION
+    app.info.is_local = True
+    for c in range(component_count):
+        node_id += 1
+        component = app.node.add()
+        component.info.node_id = node_id
+        component.info.name = 'Comp' + str(c)
+        component.info.node_type = proto.CDP_COMPONENT
+        for s in range(signals_per_component):
+            node_id += 1
+            signal = component.node.add()
+            signal.info.node_id = node_id
+            signal.info.name = 'Signal' + str(s)
+            signal.info.node_type = proto.CDP_OBJECT
+            signal.info.value_type = proto.eDOUBLE
+            signal.info.flags = proto.Info.eNodeIsLeaf
+    return app
+
+
+def create_node_tree(connection, structure):
+    """Creates a NodeTree on connection with root node built from structure and returns it."""
+    node_tree = connection.node_tree()
+    node_tree._root_node = cdp.Node(None, connection, structure)
+    return node_tree
+
+
+def walk(structure, path=''):
+    """Yields (node_id, path) for every node in structure, path including the root node name."""
+    path = path + '.' + structure.info.name if path else structure.info.name
+    yield structure.info.node_id, path
+    for child in structure.node:
+        for item in walk(child, path):
+            yield item
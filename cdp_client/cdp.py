@@ -1,13 +1,52 @@
 from promise import Promise
 from time import sleep
-from collections import namedtuple
+from collections import namedtuple, deque
+from functools import partial
+from operator import attrgetter, itemgetter
 from hashlib import sha256
+from google.protobuf.message import DecodeError
 import cdp_client.cdp_pb2 as proto
 import websocket
+import asyncio
 import logging
+import math
+import mmap
+import os
+import random
+import re
+import ssl
+import sys
+import threading
 import time
+try:
+    import numpy
+except ImportError:  # numpy is optional, used only for vectorized bulk operations when available
+    numpy = None
+try:
+    import websockets
+except ImportError:  # websockets is optional, used only by AsyncClient
+    websockets = None
 
 nanoseconds_in_second = 1000000000.0
+empty_value = proto.VariantValue()  # last value of nodes that have not received one, shared to save memory
+message_writer_drain_timeout = 5  # seconds close() waits for the message writer to send queued messages
+default_max_message_size = 64 * 1024  # bytes, batched requests are split into several messages above this size
+default_stream_size = 1024  # unread items an AsyncStream holds before dropping some
+client_threads = threading.local()  # is_internal is set while the client itself runs in a thread, see run_internally()
+
+def run_internally(function, *args):
+    """Calls function as the client itself, so that its sends wait for room in a full MessageWriter queue.
+
+    OverflowPolicy.RAISE is meant for the application, an error raised in the event loop or a timer would stop that
+    work for good instead.
+    """
+    was_internal = getattr(client_threads, 'is_internal', False)
+    client_threads.is_internal = True
+    try:
+        return function(*args)
+    finally:
+        client_threads.is_internal = was_internal
+
 
 def enum(**enums):
     return type('Enum', (), enums)
@@ -27,6 +66,29 @@ NodeType = enum(
     NODE=10,
     USER_TYPE=100)
 
+OverflowPolicy = enum(
+    BLOCK=0,  # receiving waits until a queued callback call is made, not supported by AsyncStream
+    DROP_OLDEST=1,  # the oldest queued call is dropped
+    CONFLATE=2,  # all queued calls are dropped, so that the latest value is passed next
+    RAISE=3)  # QueueFullError is raised to the caller, not supported by CallbackDispatcher and AsyncStream
+
+Aggregation = enum(
+    LAST=0,  # the last sample of each interval
+    MEAN=1,  # the mean of the samples of each interval
+    MIN=2,  # the smallest sample of each interval
+    MAX=3)  # the largest sample of each interval
+
+DeadbandMode = enum(
+    ABSOLUTE=0,  # the value must change by more than threshold
+    PERCENT=1,  # the value must change by more than threshold percent of the previous passed value
+    CHANGES=2)  # any change passes, threshold is not used
+
+HandshakeState = enum(
+    CONNECTING=0,  # waiting for the websocket to open and the hello message of the application
+    AUTHENTICATING=1,  # waiting for the application to be accepted and the credentials to be granted
+    SYNCING=2,  # clock sampling and queued structure requests sent, waiting for the first structure response
+    READY=3)  # the first structure response has been received
+
 
 class ConnectionError(Exception):
     pass
@@ -48,6 +110,79 @@ class UnknownError(Exception):
     pass
 
 
+class QueueFullError(Exception):
+    pass
+
+
+class ValueCodec:
+    """Converts and validates Python values of one CDPValueType for the matching VariantValue field.
+
+    Nodes bind the codec of their value type when their structure is received, so decoding a sample is a single
+    attribute lookup instead of a branch per value type.
+    """
+    def __init__(self, field, convert, minimum=None, maximum=None, dtype=None):
+        self.field = field
+        self.convert = convert
+        self.minimum = minimum
+        self.maximum = maximum
+        self.dtype = dtype
+        self.decode = attrgetter(field) if field is not None else lambda variant: None
+
+    def to_variant(self, value):
+        variant = proto.VariantValue()
+        if self.field is not None:
+            setattr(variant, self.field, self.encode(value))
+        return variant
+
+    def encode(self, value):
+        converted = self.convert(value)
+        if self.minimum is not None and (converted < self.minimum or converted > self.maximum) \
+                and not (isinstance(converted, float) and math.isinf(converted)):  # infinity fits float types
+            raise ValueError("Value " + str(value) + " is out of range [" + str(self.minimum) + ", " + str(self.maximum) + "]")
+        return converted
+
+    def encode_many(self, values):
+        if numpy is not None and isinstance(values, numpy.ndarray) and self.dtype is not None:
+            converted = self._encode_array(values)
+            if converted is not None:
+                return converted
+        return [self.encode(value) for value in values]
+
+    def decode_many(self, variants):
+        """Returns values of variants as a NumPy array of this value type."""
+        return numpy.fromiter(map(attrgetter(self.field), variants), self.dtype, len(variants))
+
+    def _encode_array(self, values):
+        # fast path that converts the whole array at once, returns None to fall back to per-value encoding
+        # which then reports the exact offending value
+        if values.dtype.kind not in 'biuf' or not values.size or self.dtype is numpy.object_:
+            return None  # object arrays, such as those of strings, are converted value by value
+        if self.minimum is not None:
+            if values.dtype.kind == 'f' and not numpy.isfinite(values).all():
+                return None
+            if values.min() < self.minimum or values.max() > self.maximum:
+                return None
+        return values.astype(self.dtype).tolist()
+
+
+float32_max = 3.4028234663852886e38  # largest finite float value, larger values would be sent as infinity
+value_codecs = {
+    proto.eDOUBLE: ValueCodec('d_value', float, dtype=numpy and numpy.float64),
+    proto.eUINT64: ValueCodec('ui64_value', int, 0, 2 ** 64 - 1, numpy and numpy.uint64),
+    proto.eINT64: ValueCodec('i64_value', int, -2 ** 63, 2 ** 63 - 1, numpy and numpy.int64),
+    proto.eFLOAT: ValueCodec('f_value', float, -float32_max, float32_max, numpy and numpy.float32),
+    proto.eUINT: ValueCodec('ui_value', int, 0, 2 ** 32 - 1, numpy and numpy.uint32),
+    proto.eINT: ValueCodec('i_value', int, -2 ** 31, 2 ** 31 - 1, numpy and numpy.int32),
+    proto.eUSHORT: ValueCodec('us_value', int, 0, 2 ** 16 - 1, numpy and numpy.uint16),
+    proto.eSHORT: ValueCodec('s_value', int, -2 ** 15, 2 ** 15 - 1, numpy and numpy.int16),
+    proto.eUCHAR: ValueCodec('uc_value', int, 0, 2 ** 8 - 1, numpy and numpy.uint8),
+    proto.eCHAR: ValueCodec('c_value', int, -2 ** 7, 2 ** 7 - 1, numpy and numpy.int8),
+    proto.eBOOL: ValueCodec('b_value', bool, dtype=numpy and numpy.bool_),
+    proto.eSTRING: ValueCodec('str_value', str, dtype=numpy and numpy.object_),
+}
+undefined_value_codec = ValueCodec(None, lambda value: None)  # for nodes that do not hold a value
+
+
 AuthResultCode = enum(
     CREDENTIALS_REQUIRED=0,
     # OK results:
@@ -121,6 +256,18 @@ class AuthRequest(Promise):
         self.do_reject(UnknownError('Authentication rejected'))
 
 
+StructureCacheStats = namedtuple('StructureCacheStats', 'hits, misses')
+PrefetchProgress = namedtuple('PrefetchProgress', 'nodes_fetched, nodes_queued, requests_sent, requests_in_flight')
+CallbackDispatcherStats = namedtuple('CallbackDispatcherStats', 'queue_depth, dropped')
+MessageWriterStats = namedtuple('MessageWriterStats', 'queue_depth, dropped, high_water_reached')
+ThrottlingStats = namedtuple('ThrottlingStats', 'is_throttling, occurrences, by_node')
+Deadband = namedtuple('Deadband', 'threshold, mode')
+ReconnectStats = namedtuple('ReconnectStats', 'reconnects, last_delay, first_value_latency')
+ClockOffset = namedtuple('ClockOffset', 'offset, drift, uncertainty')
+HandshakeTimings = namedtuple('HandshakeTimings', 'hello, auth, first_structure, first_value')
+OutboundStats = namedtuple('OutboundStats', 'messages, frames, frames_per_second, bytes_per_frame')
+
+
 class NotificationListener:
     def application_acceptance_requested(self, request=AuthRequest()):
         request.accept()
@@ -128,11 +275,18 @@ class NotificationListener:
     def credentials_requested(self, request=AuthRequest()):
         raise NotImplementedError("NotificationListener credentials_requested() not implemented!")
 
+    def value_throttling_changed(self, is_throttling, node=None):
+        pass
+
 
 class Client:
     def __init__(self, host='127.0.0.1', port=7689, auto_reconnect=True, notification_listener=NotificationListener(),
-                 encryption_parameters=dict()):
-        self._connection = Connection(host, port, auto_reconnect, notification_listener, encryption_parameters)
+                 encryption_parameters=dict(), structure_cache=None, callback_dispatcher=None, throttling_policy=None,
+                 structure_change_window=0, reconnect_backoff=None, clock_estimator=None, message_coalescer=None,
+                 message_writer=None):
+        self._connection = Connection(host, port, auto_reconnect, notification_listener, encryption_parameters,
+                                      structure_cache, callback_dispatcher, throttling_policy, structure_change_window,
+                                      reconnect_backoff, clock_estimator, message_coalescer, message_writer)
 
     def run_event_loop(self):
         self._connection.run_event_loop()
@@ -143,6 +297,59 @@ class Client:
     def root_node(self):
         return self._connection.node_tree().root_node()
 
+    def structure_cache_stats(self):
+        """Returns StructureCacheStats(hits, misses) counting how often child structure was known without a request."""
+        return self._connection.node_tree().structure_cache_stats()
+
+    def save_structure_cache(self):
+        """Stores the currently known structure to the structure cache given to the Client, if any."""
+        self._connection.node_tree().store_cache()
+
+    def throttling_stats(self):
+        """Returns ThrottlingStats(is_throttling, occurrences, by_node) of value throttling reported by the server."""
+        return self._connection.throttling_stats()
+
+    def reconnect_stats(self):
+        """Returns ReconnectStats(reconnects, last_delay, first_value_latency) of automatic reconnects."""
+        return self._connection.reconnect_stats()
+
+    def clock_offset(self):
+        """Returns ClockOffset(offset, drift, uncertainty) of the local clock compared to the application clock."""
+        return self._connection.clock_offset()
+
+    def handshake_timings(self):
+        """Returns HandshakeTimings(hello, auth, first_structure, first_value) of the latest connection attempt."""
+        return self._connection.handshake_timings()
+
+    def outbound_stats(self):
+        """Returns OutboundStats(messages, frames, frames_per_second, bytes_per_frame) of sent messages."""
+        return self._connection.outbound_stats()
+
+    def flush(self):
+        """Sends the requests held by the message coalescer given to the Client right away."""
+        self._connection.flush()
+
+    def drain_changed(self):
+        """Returns the values received since the previous call for nodes subscribed with subscribe_to_latest_value().
+
+        Returns:
+            Dict of Node to (value, timestamp) tuple with the latest value, only for nodes that received values.
+        """
+        return self._connection._latest_values.drain()
+
+    def subscribe_to_latest_values(self, callback, interval=0.1):
+        """Starts calling callback with changed latest values instead of draining them with drain_changed().
+
+        Args:
+            callback: Function(changed) where changed is the dict drain_changed() would return, called from a timer
+                      thread at most once per interval when values have changed
+            interval: Minimum time between calls in seconds
+        """
+        self._connection._latest_values.add_callback(callback, interval)
+
+    def unsubscribe_from_latest_values(self, callback):
+        self._connection._latest_values.remove_callback(callback)
+
     def find_node(self, path):
         def scan_node(node):
             tokens.pop(0)
@@ -153,31 +360,173 @@ class Client:
         tokens = path.split('.')
         return self.root_node().then(scan_node)
 
+    def set_values(self, nodes, values, timestamps=None):
+        """Sets values of many nodes at once using as few messages as possible.
+
+        All values are validated before anything is sent, so either all or none of the values are sent.
+
+        Args:
+            nodes: List of Node objects
+            values: List or NumPy array of new values, one per node
+            timestamps: Optional list or NumPy array of UTC times in nanoseconds since Epoch, one per node
+
+        Raises:
+            ValueError: When argument lengths differ, a node has no value or a value can not be converted
+        """
+        if len(values) != len(nodes) or (timestamps is not None and len(timestamps) != len(nodes)):
+            raise ValueError("nodes, values and timestamps must have the same length")
+        if timestamps is None:
+            timestamps = [0] * len(nodes)
+        elif numpy is not None and isinstance(timestamps, numpy.ndarray):
+            timestamps = timestamps.astype(numpy.uint64).tolist()
+
+        indices_by_codec = {}
+        for index, node in enumerate(nodes):
+            indices_by_codec.setdefault(node._codec, []).append(index)
+
+        variants = []
+        for codec, indices in indices_by_codec.items():
+            if codec is undefined_value_codec:
+                raise ValueError("Node '" + nodes[indices[0]].path() + "' does not have a value")
+            if numpy is not None and isinstance(values, numpy.ndarray):
+                group_values = values[indices]
+            else:
+                group_values = [values[i] for i in indices]
+            try:
+                encoded = codec.encode_many(group_values)
+            except (TypeError, ValueError):
+                for i in indices:
+                    try:
+                        codec.encode(values[i])
+                    except (TypeError, ValueError) as e:
+                        raise ValueError("Invalid value for node '" + nodes[i].path() + "': " + str(e))
+                raise
+            for i, value in zip(indices, encoded):
+                variant = proto.VariantValue()
+                variant.node_id = nodes[i]._id()
+                setattr(variant, codec.field, value)
+                variant.timestamp = timestamps[i]
+                variants.append(variant)
+        if variants:
+            self._connection.send_values(variants)
+
+    def subscribe_values(self, nodes, callback, fs=5, sample_rate=0, failure_callback=None, aggregation=None,
+                         deadband=None):
+        """Subscribes to value changes of many nodes using as few messages as possible.
+
+        Args:
+            nodes: Iterable of Node objects or a dict of path to Node object as returned by find_nodes()
+            callback: Function(node, value, timestamp) to call when values are received
+            fs: Maximum frequency that value updates are expected
+            sample_rate: Maximum amount of value updates sent per second, zero means all samples
+            failure_callback: Optional Function(path, error) to call when subscribing a node fails
+            aggregation: Optional Aggregation to pass one aggregated value per interval, see
+                         Node.subscribe_to_value_changes()
+            deadband: Optional threshold or Deadband to pass only significant changes, see
+                      Node.subscribe_to_value_changes()
+
+        Returns:
+            SubscriptionGroup object that can be used to unsubscribe all nodes at once.
+        """
+        return SubscriptionGroup(self._connection, nodes, callback, fs, sample_rate, failure_callback, aggregation,
+                                 deadband)
+
+    def find_nodes(self, paths):
+        """Searches for many nodes at once, resolving each shared path prefix only once.
+
+        Args:
+            paths: Iterable of dot separated paths, see find_node()
+
+        Returns:
+            Promise containing a dict of path to Node object when fulfilled. Paths that could not be found
+            are mapped to a NotFoundError instead.
+        """
+        Branch = namedtuple('Branch', 'paths, children')
+        trie = Branch([], {})
+        results = {}
+
+        def add_to_trie(path):
+            branch = trie
+            for token in path.split('.')[1:]:  # root node is not matched, same as in find_node()
+                branch = branch.children.setdefault(token, Branch([], {}))
+            branch.paths.append(path)
+
+        def reject_branch(branch, error):
+            for path in branch.paths:
+                results[path] = error
+            for child_branch in branch.children.values():
+                reject_branch(child_branch, error)
+
+        def scan_level(level):
+            nodes_to_fetch = []
+            next_level = []
+            for node, branch in level:
+                children_by_name = dict((child.name(), child) for child in node._children)
+                for name, child_branch in branch.children.items():
+                    child = children_by_name.get(name)
+                    if child is None:
+                        reject_branch(child_branch, NotFoundError("Could not find any children with name '" + name + "'"))
+                        continue
+                    for path in child_branch.paths:
+                        results[path] = child
+                    if not child._has_known_structure():
+                        nodes_to_fetch.append(child)
+                    if child_branch.children:
+                        next_level.append((child, child_branch))
+            if not nodes_to_fetch:
+                return Promise(lambda resolve, reject: resolve(results))
+            promises = self._connection.send_structure_requests([(n._id(), n.path()) for n in nodes_to_fetch])
+            return Promise.all(promises).then(lambda structures: update_level(nodes_to_fetch, structures, next_level))
+
+        def update_level(nodes, structures, next_level):
+            for node, structure in zip(nodes, structures):
+                node._update_structure(structure)
+            return scan_level(next_level)
+
+        def scan_root(root):
+            for path in trie.paths:
+                results[path] = root
+            return scan_level([(root, trie)])
+
+        for path in paths:
+            add_to_trie(path)
+        return self.root_node().then(scan_root)
+
 
 class Node:
+    # Nodes of large systems number in hundreds of thousands, so keep only the Info fields that are needed and
+    # build children from the retained proto.Node list only when they are first accessed (see _children)
+    __slots__ = ('_connection', '_parent', '_node_id', '_name', '_node_type', '_value_type', '_type_name', '_flags',
+                 '_codec', '_child_structures', '_child_nodes', '_structure_subscriptions', '_value_subscriptions',
+                 '_value_batch_subscriptions', '_event_subscriptions', '_rates', '_value', '_is_cached',
+                 '_is_structure_valid', '__weakref__')
+
     def __init__(self, parent, connection, structure):
         self._connection = connection
-        self._structure = structure
-        self._children = []
-        self._structure_subscriptions = []
-        self._value_subscriptions = []
-        self._event_subscriptions = []
-        self._value = proto.VariantValue()
         self._parent = parent
-        for child in self._structure.node:
-            self._children.append(Node(self, connection, child))
+        self._set_structure(structure)
+        self._child_structures = structure.node if structure.node else ()  # empty field would keep message alive
+        self._child_nodes = None
+        self._structure_subscriptions = ()  # subscription containers are shared until the first subscription
+        self._value_subscriptions = ()
+        self._value_batch_subscriptions = ()
+        self._event_subscriptions = ()
+        self._rates = None  # SubscriptionRates, created on the first value subscription
+        self._value = empty_value
+        self._is_cached = False  # structure was loaded from StructureCache and is not yet confirmed by the server
+        self._is_structure_valid = False  # children are known and not invalidated by the server since
 
     def last_value(self):
         return self._value
 
     def set_value(self, value, timestamp=0):
-        variant = self._value_to_variant(self._structure.info.value_type, value)
+        variant = self._codec.to_variant(value)
         variant.node_id = self._id()
         variant.timestamp = timestamp
         self._connection.send_value(variant)
 
     def name(self):
-        return self._structure.info.name
+        return self._name
 
     def path(self):
         return self.name() if self._parent is None else self._parent.path() + '.' + self.name()
@@ -186,55 +535,222 @@ class Node:
         return self._parent
 
     def type(self):
-        return self._translate_type(self._structure.info.node_type)
+        return self._translate_type(self._node_type)
 
     def class_name(self):
-        return self._structure.info.type_name
+        return self._type_name
 
     def is_read_only(self):
-        return self._structure.info.flags & proto.Info.eValueIsReadOnly != 0
+        return self._flags & proto.Info.eValueIsReadOnly != 0
 
     def is_leaf(self):
-        return self._structure.info.flags & proto.Info.eNodeIsLeaf != 0
+        return self._flags & proto.Info.eNodeIsLeaf != 0
 
     def child(self, name):
-        def update_node(node, structure):
-            node._update_structure(structure)
-            return Promise(lambda resolve, reject: resolve(node))
-
-        for child in self._children:
-            if child.name() == name:
-                if child.is_leaf():
-                    return Promise(lambda resolve, reject: resolve(child))
-                return self._connection.send_structure_request(child._id(), child.path()).then(lambda structure: update_node(child, structure))
+        child = self._find_child(name)
+        if child is not None:
+            return self._child(child)
         return Promise(lambda resolve, reject: reject(NotFoundError("Could not find any children with name '" + name + "'")))
 
     def children(self):
         promises = []
-        for child in self._children:
-            promises.append(self.child(child.name()))
+        for child in list(self._children):
+            promises.append(self._child(child))
         return Promise.all(promises)
 
     def for_each_child(self, callback):
-        for child in self._children:
-            self.child(child.name()).done(callback)
+        for child in list(self._children):
+            self._child(child).done(callback)
+
+    def refresh(self):
+        """Fetches the structure of this node from the server even if it is already known.
+
+        Returns:
+            Promise containing this Node object when fulfilled.
+        """
+        def update_structure(structure):
+            self._update_structure(structure)
+            return Promise(lambda resolve, reject: resolve(self))
+
+        return self._connection.send_structure_request(self._id(), self.path()).then(update_structure)
+
+    def prefetch(self, depth=None, max_in_flight=4, batch_size=256, progress_callback=None):
+        """Fetches the structure of the whole subtree breadth-first, many nodes per structure request.
+
+        At most max_in_flight requests are outstanding at any time and a new one is only sent when a response
+        arrives, so the crawl paces itself to the speed the application answers.
+
+        Args:
+            depth: Optional number of levels below this node to fetch, None fetches the whole subtree
+            max_in_flight: Maximum number of structure requests waiting for a response
+            batch_size: Maximum number of nodes requested in one structure request
+            progress_callback: Optional Function(progress) called after every response, where progress is a
+                               PrefetchProgress(nodes_fetched, nodes_queued, requests_sent, requests_in_flight)
+
+        Returns:
+            Promise containing this Node object when the subtree is fully fetched.
+        """
+        queue = deque()
+        nodes_fetched = 0
+        requests_sent = 0
+        requests_in_flight = 0
+        result = Promise()
+
+        def progress():
+            return PrefetchProgress(nodes_fetched, len(queue), requests_sent, requests_in_flight)
+
+        def enqueue(node, level):
+            if node.is_leaf():
+                return
+            if not node._has_known_structure():
+                queue.append((node, level))
+            elif depth is None or level < depth:
+                for child in node._children:
+                    enqueue(child, level + 1)
+
+        def send_requests():
+            nonlocal requests_sent, requests_in_flight
+            while queue and requests_in_flight < max_in_flight:
+                batch = [queue.popleft() for _ in range(min(batch_size, len(queue)))]
+                requests_sent += 1
+                requests_in_flight += 1
+                promises = self._connection.send_structure_requests([(n._id(), n.path()) for n, level in batch])
+                Promise.all(promises).then(lambda structures, batch=batch: update_batch(batch, structures)) \
+                                     .catch(result.do_reject)
+            if not queue and not requests_in_flight:
+                result.do_resolve(self)
+
+        def update_batch(batch, structures):
+            nonlocal nodes_fetched, requests_in_flight
+            requests_in_flight -= 1
+            for (node, level), structure in zip(batch, structures):
+                node._update_structure(structure)
+                nodes_fetched += 1
+                if depth is None or level < depth:
+                    for child in node._children:
+                        enqueue(child, level + 1)
+            if progress_callback is not None:
+                progress_callback(progress())
+            send_requests()
+
+        enqueue(self, 0)
+        send_requests()
+        return result
 
     def subscribe_to_structure_changes(self, callback):
-        self._structure_subscriptions.append(callback)
+        with self._connection._subscription_lock:
+            self._structure_subscriptions += (callback,)
 
-    def subscribe_to_value_changes(self, callback, fs=5, sample_rate=0):
-        self._value_subscriptions.append((callback, fs, sample_rate))
-        self._send_value_request()
+    def subscribe_to_value_changes(self, callback, fs=5, sample_rate=0, aggregation=None, deadband=None):
+        """Starts listening value changes.
+
+        Values are requested at the highest rate of all subscriptions of this node. When that is above the
+        non-zero sample_rate of this subscription, only the first sample of every 1 / sample_rate seconds, by
+        sample timestamps, is passed to callback.
+
+        Args:
+            callback: Function(value, timestamp) to call when values are received
+            fs: Maximum frequency that value updates are expected
+            sample_rate: Maximum amount of value updates sent per second, zero means all samples
+            aggregation: Optional Aggregation to pass one value per 1 / sample_rate seconds (1 / fs seconds when
+                         sample_rate is zero) aggregated from all samples of that interval. The value of an
+                         interval is passed when the first sample of a later interval is received.
+            deadband: Optional threshold, or Deadband(threshold, mode), by which a value must differ from the
+                      previous passed value to be passed. A plain threshold is absolute. Values of bool and string
+                      nodes are passed whenever they change.
+        """
+        with self._connection._subscription_lock:
+            sampler = ValueSampler.create(fs, sample_rate, aggregation, self._deadband(deadband))
+            subscription = (callback, fs, sample_rate, sampler)
+            self._value_subscriptions += (subscription,)
+            self._subscription_rates().add(fs, sample_rate)
+            try:
+                self._send_value_request()
+            except QueueFullError:
+                self._value_subscriptions = tuple(s for s in self._value_subscriptions if s is not subscription)
+                self._rates.remove(fs, sample_rate)
+                raise
 
     def unsubscribe_from_structure_changes(self, callback):
-        self._structure_subscriptions.remove(callback)
+        with self._connection._subscription_lock:
+            subscriptions = list(self._structure_subscriptions)
+            subscriptions.remove(callback)
+            self._structure_subscriptions = tuple(subscriptions)
 
     def unsubscribe_from_value_changes(self, callback):
-        self._value_subscriptions = [i for i in self._value_subscriptions if i[0] != callback]
-        if self._value_subscriptions:
-            self._send_value_request()
-        else:
-            self._connection.send_value_unrequest(self._id())
+        with self._connection._subscription_lock:
+            self._value_subscriptions = self._remove_value_subscription(self._value_subscriptions, callback)
+            self._send_value_request_or_unrequest()
+
+    def subscribe_to_value_batches(self, callback, fs=5, sample_rate=0, deadband=None):
+        """Starts listening value changes, passing all samples of this node received in one message at once.
+
+        Args:
+            callback: Function(values, timestamps) where values is a NumPy array with dtype of the node value type
+                      and timestamps is a NumPy int64 array of UTC times in nanoseconds since Epoch
+            fs: Maximum frequency that value updates are expected
+            sample_rate: Maximum amount of value updates sent per second, zero means all samples. Samples above
+                         this rate requested for other subscriptions of this node are left out of the batches.
+            deadband: Optional threshold or Deadband, see subscribe_to_value_changes()
+        """
+        with self._connection._subscription_lock:
+            if numpy is None:
+                raise ImportError("NumPy is required for value batches")
+            sampler = ValueSampler.create(fs, sample_rate, deadband=self._deadband(deadband))
+            subscription = (callback, fs, sample_rate, sampler)
+            self._value_batch_subscriptions += (subscription,)
+            self._subscription_rates().add(fs, sample_rate)
+            try:
+                self._send_value_request()
+            except QueueFullError:
+                self._value_batch_subscriptions = tuple(s for s in self._value_batch_subscriptions
+                                                        if s is not subscription)
+                self._rates.remove(fs, sample_rate)
+                raise
+
+    def unsubscribe_from_value_batches(self, callback):
+        """Stops listening previously subscribed value batches.
+
+        Args:
+            callback: Function(values, timestamps) that was previously subscribed
+        """
+        with self._connection._subscription_lock:
+            self._value_batch_subscriptions = self._remove_value_subscription(self._value_batch_subscriptions, callback)
+            self._send_value_request_or_unrequest()
+
+    def subscribe_to_latest_value(self, fs=5, sample_rate=0):
+        """Starts keeping only the latest value of this node, to be read with client.drain_changed().
+
+        Values received in between are not decoded or passed anywhere, which keeps CPU use at the rate the values
+        are read. Other value subscriptions of the node still get every value.
+
+        Args:
+            fs: Maximum frequency that value updates are expected
+            sample_rate: Maximum amount of value updates sent per second, zero means all samples
+        """
+        with self._connection._subscription_lock:
+            previous = self._connection._latest_values.subscribe(self, fs, sample_rate)
+            if previous is not None:
+                self._rates.remove(*previous)
+            self._subscription_rates().add(fs, sample_rate)
+            try:
+                self._send_value_request()
+            except QueueFullError:
+                self._rates.remove(fs, sample_rate)
+                if previous is not None:
+                    self._connection._latest_values.subscribe(self, *previous)
+                    self._rates.add(*previous)
+                else:
+                    self._connection._latest_values.unsubscribe(self)
+                raise
+
+    def unsubscribe_from_latest_value(self):
+        """Stops keeping the latest value of this node, a value not read yet is discarded."""
+        with self._connection._subscription_lock:
+            previous = self._connection._latest_values.unsubscribe(self)
+            if previous is not None:
+                self._rates.remove(*previous)
+            self._send_value_request_or_unrequest()
 
     def subscribe_to_events(self, callback, starting_from=None):
         """Starts listening to events from this node and its children.
@@ -243,8 +759,13 @@ class Node:
             callback: Function(event_info) to call when events are received
             starting_from: Optional timestamp to start receiving events from (nanoseconds since Epoch)
         """
-        self._event_subscriptions.append(callback)
-        self._connection.send_event_request(self._id(), starting_from)
+        with self._connection._subscription_lock:
+            self._event_subscriptions += (callback,)
+            try:
+                self._connection.send_event_request(self._id(), starting_from)
+            except QueueFullError:
+                self._event_subscriptions = self._event_subscriptions[:-1]
+                raise
 
     def unsubscribe_from_events(self, callback):
         """Stops listening to previously subscribed events.
@@ -252,13 +773,79 @@ class Node:
         Args:
             callback: Function(event_info) that was previously subscribed
         """
-        if callback in self._event_subscriptions:
-            self._event_subscriptions.remove(callback)
-            if not self._event_subscriptions:
-                self._connection.send_event_unrequest(self._id())
+        with self._connection._subscription_lock:
+            if callback in self._event_subscriptions:
+                subscriptions = list(self._event_subscriptions)
+                subscriptions.remove(callback)
+                self._event_subscriptions = tuple(subscriptions)
+                if not self._event_subscriptions:
+                    self._connection.send_event_unrequest(self._id())
+
+    @property
+    def _children(self):
+        """Child nodes, built from the structure received for this node when first accessed."""
+        if self._child_nodes is None:
+            self._child_nodes = [Node(self, self._connection, structure) for structure in self._child_structures]
+            self._child_structures = ()
+            if self._is_cached:
+                for child in self._child_nodes:
+                    child._is_cached = True
+            node_tree = self._connection.node_tree()
+            if node_tree._is_indexed(self):
+                for child in self._child_nodes:
+                    node_tree._add_to_index(child)
+        return self._child_nodes
+
+    def _has_children(self):
+        return bool(self._child_nodes if self._child_nodes is not None else self._child_structures)
 
     def _id(self):
-        return self._structure.info.node_id
+        return self._node_id
+
+    def _info(self):
+        info = proto.Info()
+        info.node_id = self._node_id
+        info.name = self._name
+        info.node_type = self._node_type
+        info.value_type = self._value_type
+        if self._type_name:
+            info.type_name = self._type_name
+        info.flags = self._flags
+        return info
+
+    def _set_structure(self, structure):
+        info = structure.info
+        self._node_id = info.node_id
+        self._name = sys.intern(info.name)  # names repeat across components, share one string per name
+        self._node_type = info.node_type
+        self._value_type = info.value_type
+        self._type_name = sys.intern(info.type_name)
+        self._flags = info.flags
+        self._codec = value_codecs.get(info.value_type, undefined_value_codec)
+
+    def _child(self, child):
+        def update_node(node, structure):
+            node._update_structure(structure)
+            return Promise(lambda resolve, reject: resolve(node))
+
+        if child.is_leaf():
+            return Promise(lambda resolve, reject: resolve(child))
+        node_tree = self._connection.node_tree()  # only navigation by the user is counted, not internal traversals
+        if child._has_known_structure():
+            node_tree._structure_cache_hits += 1
+            return Promise(lambda resolve, reject: resolve(child))
+        node_tree._structure_cache_misses += 1
+        return self._connection.send_structure_request(child._id(), child.path()).then(lambda structure: update_node(child, structure))
+
+    def _has_known_structure(self):
+        # cached nodes are revalidated by NodeTree
+        return self.is_leaf() or self._is_structure_valid or (self._is_cached and self._has_children())
+
+    def _find_child(self, name):
+        for child in self._children:
+            if child.name() == name:
+                return child
+        return None
 
     def _update(self):
         def update_structure(structure):
@@ -269,70 +856,187 @@ class Node:
             return self._connection.send_structure_request(self._id(), self.path())
 
         def fetch_value(node):
-            if self._value_subscriptions:
-                self._send_value_request()
+            if self._has_value_subscriptions():
+                self._send_value_request(force=True)
             return Promise(lambda resolve, reject: resolve(node))
 
         return fetch_structure().then(update_structure).then(fetch_value)
 
-    def _send_value_request(self):
-        max_fs = max(self._value_subscriptions, key=lambda e: e[1])[1]
-        max_sample_rate = max(self._value_subscriptions, key=lambda e: e[2])[2]
-        #by studio api protocol 0 is the highest sample rate (all samples), so override maxSampleRate if 0 is found
-        for s in self._value_subscriptions:
-            if s[2] == 0:
-                max_sample_rate = 0
-                break
-        self._connection.send_value_request(self._id(), max_fs, max_sample_rate)
-
-    def _update_structure(self, structure):
-        self._structure = structure
-        new_children = list(self._structure.node)
-        lost_children = list(self._children)
-        removed_children = []
+    def _send_value_request(self, force=False):
+        requested = self._rates.requested
+        request = self._value_request(force)
+        if request is not None:
+            try:
+                self._connection.send_value_request(*request)
+            except QueueFullError:
+                self._rates.requested = requested  # so that the request is sent again on the next change
+                raise
+
+    def _send_value_request_or_unrequest(self):
+        if self._has_value_subscriptions():
+            self._send_value_request()
+            return
+        requested = self._rates.requested if self._rates is not None else None
+        if self._value_unrequest() is not None:
+            try:
+                self._connection.send_value_unrequest(self._id())
+            except QueueFullError:
+                self._rates.requested = requested
+                raise
+
+    def _value_request(self, force=False):
+        """Returns (node_id, fs, sample_rate) to request, or None when that rate is already requested."""
+        with self._connection._subscription_lock:
+            parameters = self._value_request_parameters()
+            if parameters == self._rates.requested and not force:
+                return None
+            self._rates.requested = parameters
+            return (self._id(),) + parameters
+
+    def _value_unrequest(self):
+        """Returns node_id to unrequest, or None when no values are requested."""
+        with self._connection._subscription_lock:
+            if self._rates is None or self._rates.requested is None:
+                return None
+            self._rates.requested = None
+            return self._id()
+
+    def _deadband(self, deadband):
+        if deadband is None:
+            return None
+        if self._codec.convert not in (int, float):
+            return Deadband(0, DeadbandMode.CHANGES)  # differences of bools and strings have no magnitude
+        if not isinstance(deadband, Deadband):
+            return Deadband(deadband, DeadbandMode.ABSOLUTE)
+        return deadband
+
+    def _subscription_rates(self):
+        if self._rates is None:
+            self._rates = SubscriptionRates()
+        return self._rates
+
+    def _remove_value_subscription(self, subscriptions, callback):
+        remaining = []
+        for subscription in subscriptions:
+            if subscription[0] == callback:
+                self._rates.remove(subscription[1], subscription[2])
+            else:
+                remaining.append(subscription)
+        return tuple(remaining)
+
+    def _has_value_subscriptions(self):
+        return bool(self._value_subscriptions or self._value_batch_subscriptions
+                    or self in self._connection._latest_values._subscriptions)
+
+    def _value_request_parameters(self):
+        max_fs, max_sample_rate = self._rates.max_fs, self._rates.max_sample_rate
+        policy = self._connection._throttling_policy
+        if policy is not None:
+            return policy._apply(self, max_fs, max_sample_rate)
+        return max_fs, max_sample_rate
+
+    def _update_structure(self, structure, remap=False):
+        """Applies structure received for this node.
+
+        With remap, children are matched by name instead of id, for when the application has renumbered its nodes.
+        """
+        self._is_cached = False
+        self._is_structure_valid = True
+        node_tree = self._connection.node_tree()
+        is_indexed = node_tree._is_indexed(self)
+        is_renamed = self._id() != structure.info.node_id or self.name() != structure.info.name
+        if is_indexed and is_renamed:
+            node_tree._remove_from_index(self)
+        self._set_structure(structure)
+        if is_indexed and is_renamed:
+            node_tree._add_to_index(self)
+        if not self._child_nodes and not self._structure_subscriptions:  # nobody has seen any children yet
+            self._child_nodes = None
+            self._child_structures = structure.node if structure.node else ()
+            return
+        if remap:
+            children_by_key = dict((child.name(), child) for child in self._children)
+        else:
+            children_by_key = dict((child._id(), child) for child in self._children)
+        matched_children = set()
+        new_structures = []
         added_children = []
 
-        def update_matching_children():
-            for node in self._structure.node:
-                for child in self._children:
-                    if node.info.node_id == child._id():
-                        child._structure = node
-
-        def diff_children():
-            for n in self._structure.node:
-                for existing_child in self._children:
-                    if n.info.node_id == existing_child._id():
-                        if n in new_children:
-                            new_children.remove(n)
-                        if existing_child in lost_children:
-                            lost_children.remove(existing_child)
-
-        def report_children_diff():
-            for child in lost_children:
-                removed_children.append(child)
-                if child in self._children:
-                    self._children.remove(child)
-            for child in new_children:
-                node = Node(self, self._connection, child)
-                self._children.append(node)
-                added_children.append(node)
-
-            if added_children or removed_children:
-                for callback in self._structure_subscriptions:
-                    callback(added_children, removed_children)
-
-        update_matching_children()  # update children so that children structure response can lookup nodes by correct node id
-        diff_children()
-        report_children_diff()
+        # update matching children first so that children structure response can lookup nodes by correct node id
+        for node in structure.node:
+            child = children_by_key.get(node.info.name if remap else node.info.node_id)
+            if child is None:
+                new_structures.append(node)
+                continue
+            matched_children.add(child)
+            if remap and is_indexed:
+                node_tree._remap_id(child, node)
+            elif is_indexed and node.info.name != child.name():
+                node_tree._remove_from_index(child)
+                child._set_structure(node)
+                node_tree._add_to_index(child)
+            else:
+                child._set_structure(node)
+
+        removed_children = [child for child in self._children if child not in matched_children]
+        if removed_children:
+            self._children[:] = [child for child in self._children if child in matched_children]
+            if is_indexed:
+                for child in removed_children:
+                    node_tree._remove_from_index(child)
+        for structure in new_structures:
+            node = Node(self, self._connection, structure)
+            self._children.append(node)
+            added_children.append(node)
+            if is_indexed:
+                node_tree._add_to_index(node)
+
+        if added_children or removed_children:
+            for callback in self._structure_subscriptions:
+                callback(added_children, removed_children)
 
     def _update_value(self, variant):
-        self._value = self._value_from_variant(self._structure.info.value_type, variant)
-        for callback, fs, sample_rate in self._value_subscriptions:
-            callback(self._value, variant.timestamp + self._connection.server_time_difference() * nanoseconds_in_second)
+        self._value = self._codec.decode(variant)
+        timestamp = variant.timestamp + self._connection.server_time_difference() * nanoseconds_in_second
+        requested = self._rates.requested if self._rates is not None else None
+        for callback, fs, sample_rate, sampler in self._value_subscriptions:
+            if sampler is None or sampler.passes_all(requested):
+                self._notify(callback, self._value, timestamp)
+            else:
+                sample = sampler.sample(self._value, timestamp)
+                if sample is not None:
+                    self._notify(callback, *sample)
+
+    def _update_value_batch(self, variants):
+        if self._codec is undefined_value_codec:
+            return
+        values = self._codec.decode_many(variants)
+        timestamps = numpy.fromiter(map(attrgetter('timestamp'), variants), numpy.int64, len(variants))
+        timestamps += int(round(self._connection.server_time_difference() * nanoseconds_in_second))
+        requested = self._rates.requested if self._rates is not None else None
+        for callback, fs, sample_rate, sampler in self._value_batch_subscriptions:
+            if sampler is None or sampler.passes_all(requested):
+                self._notify(callback, values, timestamps)
+            else:
+                keep = sampler.sample_batch(values, timestamps)
+                if keep.any():
+                    self._notify(callback, values[keep], timestamps[keep])
+        if self._value_subscriptions:
+            for variant in variants:
+                self._update_value(variant)
+        else:
+            self._value = self._codec.decode(variants[-1])
 
     def _update_event(self, event_info):
         for callback in self._event_subscriptions:
-            callback(event_info)
+            self._notify(callback, event_info)
+
+    def _notify(self, callback, *args):
+        dispatcher = self._connection._callback_dispatcher
+        if dispatcher is None:
+            callback(*args)
+        else:
+            dispatcher.dispatch(self, callback, args)
 
     @staticmethod
     def _translate_type(node_type):
@@ -363,79 +1067,853 @@ class Node:
         else:
             return NodeType.UNDEFINED
 
-    @staticmethod
-    def _value_from_variant(type, variant):
-        if type == proto.eDOUBLE:
-            return variant.d_value
-        elif type == proto.eUINT64:
-            return variant.f_value
-        elif type == proto.eINT64:
-            return variant.ui64_value
-        elif type == proto.eFLOAT:
-            return variant.i64_value
-        elif type == proto.eUINT:
-            return variant.ui_value
-        elif type == proto.eINT:
-            return variant.i_value
-        elif type == proto.eUSHORT:
-            return variant.us_value
-        elif type == proto.eSHORT:
-            return variant.s_value
-        elif type == proto.eUCHAR:
-            return variant.uc_value
-        elif type == proto.eCHAR:
-            return variant.c_value
-        elif type == proto.eBOOL:
-            return variant.b_value
-        elif type == proto.eSTRING:
-            return variant.str_value
-        else:
+
+class SubscriptionGroup:
+    def __init__(self, connection, nodes, callback, fs=5, sample_rate=0, failure_callback=None, aggregation=None,
+                 deadband=None):
+        self._connection = connection
+        self._callbacks = {}  # node -> callback bound to that node
+        self._failures = {}
+        self._failure_callback = failure_callback
+        items = nodes.items() if isinstance(nodes, dict) else [(None, node) for node in nodes]
+        requests = []
+        requested = {}  # node -> rates requested before, restored when the requests cannot be queued
+        with connection._subscription_lock:
+            for path, node in items:
+                if isinstance(node, Exception):
+                    self._report_failure(path, node)
+                elif node._codec is undefined_value_codec:
+                    self._report_failure(node.path(), InvalidRequestError("Node '" + node.path() + "' does not have a value"))
+                elif node not in self._callbacks:
+                    bound_callback = partial(callback, node)
+                    self._callbacks[node] = bound_callback
+                    node._value_subscriptions += ((bound_callback, fs, sample_rate,
+                                                   ValueSampler.create(fs, sample_rate, aggregation,
+                                                                       node._deadband(deadband))),)
+                    requested[node] = node._subscription_rates().requested
+                    node._rates.add(fs, sample_rate)
+                    request = node._value_request()
+                    if request is not None:
+                        requests.append(request)
+            self._connection._subscription_groups.append(self)
+            if requests:
+                try:
+                    self._connection.send_value_requests(requests)
+                except QueueFullError:
+                    self._remove_subscriptions()
+                    for node, rates in requested.items():
+                        node._rates.requested = rates
+                    raise
+
+    def nodes(self):
+        return list(self._callbacks)
+
+    def failures(self):
+        """Returns dict of path to error for nodes that could not be subscribed."""
+        return dict(self._failures)
+
+    def unsubscribe(self):
+        """Stops listening value changes of all nodes in the group."""
+        requests = []
+        unrequests = []
+        with self._connection._subscription_lock:
+            for node in self._remove_subscriptions():
+                if node._has_value_subscriptions():
+                    request = node._value_request()
+                    if request is not None:
+                        requests.append(request)
+                elif node._value_unrequest() is not None:
+                    unrequests.append(node._id())
+            if requests:
+                self._connection.send_value_requests(requests)
+            if unrequests:
+                self._connection.send_value_unrequests(unrequests)
+
+    def _remove_subscriptions(self):
+        """Removes the subscriptions of the group from its nodes and returns those nodes."""
+        nodes = list(self._callbacks)
+        for node, bound_callback in self._callbacks.items():
+            node._value_subscriptions = node._remove_value_subscription(node._value_subscriptions, bound_callback)
+        self._callbacks.clear()
+        if self in self._connection._subscription_groups:
+            self._connection._subscription_groups.remove(self)
+        return nodes
+
+    def _node_failed(self, node_id, error):
+        for node in self._callbacks:
+            if node._id() == node_id:
+                self._report_failure(node.path(), error)
+
+    def _report_failure(self, path, error):
+        self._failures[path] = error
+        if self._failure_callback is not None:
+            self._failure_callback(path, error)
+
+
+class StructureCache:
+    """Stores application structures on disk so that nodes can be found without waiting for structure responses.
+
+    A cache file holds one serialized proto.Node tree per system name, application name and CDP version. The file
+    is read only when a matching application is connected and its structure is requested for the first time.
+    """
+    def __init__(self, directory):
+        self._directory = directory
+
+    def load(self, system_name, application_name, cdp_version):
+        """Returns the cached system structure as proto.Node or None if nothing usable is cached."""
+        file_name = self._file_name(system_name, application_name, cdp_version)
+        structure = proto.Node()
+        try:
+            with open(file_name, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                with memoryview(data) as view:
+                    structure.ParseFromString(view)
+        except (OSError, ValueError, TypeError, DecodeError) as e:  # missing, empty or corrupt file
+            logging.debug('Structure cache not used for ' + file_name + ': ' + str(e))
             return None
+        return structure
+
+    def store(self, system_name, application_name, cdp_version, structure):
+        file_name = self._file_name(system_name, application_name, cdp_version)
+        os.makedirs(self._directory, exist_ok=True)
+        with open(file_name + '.tmp', 'wb') as f:
+            f.write(structure.SerializeToString())
+        os.replace(file_name + '.tmp', file_name)  # readers never see a partially written file
+
+    def _file_name(self, system_name, application_name, cdp_version):
+        key = '_'.join([system_name, application_name, cdp_version])
+        return os.path.join(self._directory, re.sub(r'[^\w.-]', '_', key) + '.cdpstructure')
+
+
+class SubscriptionRates:
+    """Counts the fs and sample_rate values of the value subscriptions of a node, keeping their maximums.
+
+    The maximums are updated as subscriptions are added and removed, so the effective rate is known without
+    scanning the subscriptions. By StudioAPI protocol, sample_rate 0 (all samples) is the highest sample_rate.
+    """
+    __slots__ = ('_fs_counts', '_sample_rate_counts', 'max_fs', 'max_sample_rate', 'requested')
+
+    def __init__(self):
+        self._fs_counts = {}  # fs -> amount of subscriptions with it
+        self._sample_rate_counts = {}  # sample_rate -> amount of subscriptions with it
+        self.max_fs = None
+        self.max_sample_rate = None
+        self.requested = None  # (fs, sample_rate) last requested from the server, None when not requested
+
+    def add(self, fs, sample_rate):
+        self._fs_counts[fs] = self._fs_counts.get(fs, 0) + 1
+        self._sample_rate_counts[sample_rate] = self._sample_rate_counts.get(sample_rate, 0) + 1
+        if self.max_fs is None or fs > self.max_fs:
+            self.max_fs = fs
+        if self.max_sample_rate is None or self._order(sample_rate) > self._order(self.max_sample_rate):
+            self.max_sample_rate = sample_rate
+
+    def remove(self, fs, sample_rate):
+        if self._decrement(self._fs_counts, fs) and fs == self.max_fs:
+            self.max_fs = max(self._fs_counts) if self._fs_counts else None
+        if self._decrement(self._sample_rate_counts, sample_rate) and sample_rate == self.max_sample_rate:
+            self.max_sample_rate = max(self._sample_rate_counts, key=self._order) \
+                if self._sample_rate_counts else None
 
     @staticmethod
-    def _value_to_variant(type, value):
-        variant = proto.VariantValue()
-        if type == proto.eDOUBLE:
-            variant.d_value = value
-        elif type == proto.eUINT64:
-            variant.f_value = int(value)
-        elif type == proto.eINT64:
-            variant.ui64_value = int(value)
-        elif type == proto.eFLOAT:
-            variant.i64_value = value
-        elif type == proto.eUINT:
-            variant.ui_value = int(value)
-        elif type == proto.eINT:
-            variant.i_value = int(value)
-        elif type == proto.eUSHORT:
-            variant.us_value = int(value)
-        elif type == proto.eSHORT:
-            variant.s_value = int(value)
-        elif type == proto.eUCHAR:
-            variant.uc_value = int(value)
-        elif type == proto.eCHAR:
-            variant.c_value = int(value)
-        elif type == proto.eBOOL:
-            variant.b_value = bool(value)
-        elif type == proto.eSTRING:
-            variant.str_value = str(value)
-        return variant
+    def _order(sample_rate):
+        return math.inf if sample_rate == 0 else sample_rate
+
+    @staticmethod
+    def _decrement(counts, key):
+        """Returns True when the last subscription with key was removed."""
+        count = counts[key] - 1
+        if count:
+            counts[key] = count
+            return False
+        del counts[key]
+        return True
+
+
+class ValueSampler:
+    """Filters the samples of one value subscription by its own rate, aggregation and deadband.
+
+    Time is split into intervals of 1 / sample_rate seconds by sample timestamps. Without aggregation the first
+    sample of each interval is passed right away, with aggregation one value aggregated from the samples of an
+    interval is passed when the first sample of a later interval arrives. With a deadband, a value is passed only
+    when it differs enough from the previous passed value.
+    """
+    __slots__ = ('_sample_rate', '_interval', '_aggregation', '_deadband', '_interval_index', '_values',
+                 '_timestamp', '_last')
+
+    def __init__(self, sample_rate=None, aggregation=None, deadband=None):
+        self._sample_rate = sample_rate
+        self._interval = nanoseconds_in_second / sample_rate if sample_rate else None  # nanoseconds
+        self._aggregation = aggregation
+        self._deadband = deadband
+        self._interval_index = None  # interval of the latest sample
+        self._values = []  # samples of the current interval when aggregating
+        self._timestamp = None  # timestamp of the latest sample when aggregating
+        self._last = None  # latest passed value when a deadband is used
+
+    @staticmethod
+    def create(fs, sample_rate, aggregation=None, deadband=None):
+        """Returns ValueSampler for subscription with fs, sample_rate, aggregation and Deadband, or None when all
+        samples pass."""
+        if aggregation is not None:
+            return ValueSampler(sample_rate or fs, aggregation, deadband)
+        if sample_rate or deadband is not None:
+            return ValueSampler(sample_rate, deadband=deadband)
+        return None
+
+    def passes_all(self, requested):
+        """Returns True when the (fs, sample_rate) requested from the server is not above the rate of this sampler."""
+        if self._aggregation is not None or self._deadband is not None:
+            return False
+        return requested is None or 0 < requested[1] <= self._sample_rate
+
+    def sample(self, value, timestamp):
+        """Returns (value, timestamp) to pass for the received sample, or None when nothing is passed."""
+        sample = self._sample_interval(value, timestamp) if self._interval is not None else (value, timestamp)
+        if sample is None or self._deadband is None:
+            return sample
+        if self._last is not None and not self._exceeds_deadband(sample[0], self._last):
+            return None
+        self._last = sample[0]
+        return sample
+
+    def sample_batch(self, values, timestamps):
+        """Returns a NumPy bool array telling which of the samples with values and timestamps are passed."""
+        if self._interval is not None:
+            intervals = timestamps // self._interval
+            keep = numpy.empty(len(intervals), dtype=bool)
+            keep[0] = intervals[0] != self._interval_index
+            numpy.not_equal(intervals[1:], intervals[:-1], out=keep[1:])
+            self._interval_index = intervals[-1]
+        else:
+            keep = numpy.ones(len(values), dtype=bool)
+        if self._deadband is not None:
+            indices = numpy.flatnonzero(keep)
+            keep[indices[~self._deadband_mask(values[indices])]] = False
+        return keep
+
+    def _sample_interval(self, value, timestamp):
+        index = timestamp // self._interval
+        if self._aggregation is None:
+            if index == self._interval_index:
+                return None
+            self._interval_index = index
+            return value, timestamp
+        result = None
+        if index != self._interval_index and self._values:
+            result = self._aggregate(), self._timestamp
+            self._values = []
+        self._interval_index = index
+        self._values.append(value)
+        self._timestamp = timestamp
+        return result
+
+    def _aggregate(self):
+        if self._aggregation == Aggregation.LAST:
+            return self._values[-1]
+        if self._aggregation == Aggregation.MEAN:
+            return sum(self._values) / len(self._values)
+        if self._aggregation == Aggregation.MIN:
+            return min(self._values)
+        return max(self._values)
+
+    def _exceeds_deadband(self, values, last):
+        # works on single values and on NumPy arrays alike
+        threshold, mode = self._deadband
+        if mode == DeadbandMode.CHANGES:
+            return values != last
+        if numpy is not None and isinstance(values, numpy.ndarray):
+            difference = numpy.abs(values.astype(numpy.float64) - float(last))  # unsigned types would wrap around
+        else:
+            difference = abs(values - last)
+        if mode == DeadbandMode.PERCENT:
+            return difference > abs(last) * threshold / 100.0
+        return difference > threshold
+
+    def _deadband_mask(self, values):
+        # each passed value becomes the reference of the following ones, so find the next passing value one
+        # window at a time, growing the window while nothing passes
+        passed = numpy.zeros(len(values), dtype=bool)
+        start = 0
+        if self._last is None and len(values):
+            passed[0] = True
+            self._last = values[0]
+            start = 1
+        window = 16
+        while start < len(values):
+            exceeds = numpy.asarray(self._exceeds_deadband(values[start:start + window], self._last))
+            offset = int(exceeds.argmax())
+            if not exceeds[offset]:
+                start += window
+                window *= 2
+                continue
+            start += offset
+            passed[start] = True
+            self._last = values[start]
+            start += 1
+            window = 16
+        return passed
+
+
+class LatestValues:
+    """Latest received values of nodes subscribed with Node.subscribe_to_latest_value(), kept until drained."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}  # node -> (fs, sample_rate)
+        self._changed = {}  # node -> latest VariantValue received since the previous drain
+        self._callbacks = []
+        self._interval = 0
+        self._timer = None
+        self._last_notification = 0
+
+    def subscribe(self, node, fs, sample_rate):
+        """Returns the (fs, sample_rate) of the subscription of node that is replaced, or None."""
+        previous = self._subscriptions.get(node)
+        self._subscriptions[node] = (fs, sample_rate)
+        return previous
+
+    def unsubscribe(self, node):
+        """Returns the (fs, sample_rate) of the removed subscription of node, or None."""
+        with self._lock:
+            self._changed.pop(node, None)
+            return self._subscriptions.pop(node, None)
+
+    def add_callback(self, callback, interval):
+        with self._lock:
+            self._callbacks.append(callback)
+            self._interval = interval
+            self._schedule_notification()
+
+    def remove_callback(self, callback):
+        with self._lock:
+            self._callbacks.remove(callback)
+
+    def drain(self):
+        with self._lock:
+            changed, self._changed = self._changed, {}
+        values = {}
+        for node, variant in changed.items():
+            node._value = node._codec.decode(variant)
+            timestamp = variant.timestamp + node._connection.server_time_difference() * nanoseconds_in_second
+            values[node] = (node._value, timestamp)
+        return values
+
+    def _update(self, changed):
+        with self._lock:
+            self._changed.update(changed)
+            self._schedule_notification()
+
+    def _schedule_notification(self):
+        if self._callbacks and self._changed and self._timer is None:
+            delay = max(0, self._last_notification + self._interval - time.time())
+            self._timer = threading.Timer(delay, self._notify)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _notify(self):
+        with self._lock:
+            self._timer = None
+            self._last_notification = time.time()
+            callbacks = list(self._callbacks)
+        changed = self.drain()
+        if changed:
+            for callback in callbacks:
+                callback(changed)
+
+
+class HeldRequests:
+    """Requests a MessageCoalescer holds for one connection."""
+    __slots__ = ('containers', 'size', 'is_flush_scheduled', 'deadline')
+
+    def __init__(self):
+        self.containers = {}  # message type -> container the requests of that type are merged into
+        self.size = 0
+        self.is_flush_scheduled = False
+        self.deadline = None  # time.monotonic() to send the requests at, see MessageCoalescer._wake_flusher()
+
+
+class MessageCoalescer:
+    """Merges getter, setter, structure and event requests sent within max_delay seconds into one message per type.
+
+    Held requests are sent when max_delay has passed since the first of them, when their size reaches max_size bytes
+    or when flush() is called on the client. Other messages are sent right away, after the held requests. Held
+    requests are sent in time by one thread of the coalescer, started with the first of them. Requests are held per
+    connection, so that one coalescer can be given to many clients.
+    """
+    _merged_fields = {
+        proto.Container.eGetterRequest: 'getter_request',
+        proto.Container.eSetterRequest: 'setter_request',
+        proto.Container.eStructureRequest: 'structure_request',
+        proto.Container.eEventRequest: 'event_request',
+    }
+
+    def __init__(self, max_delay=0.001, max_size=default_max_message_size):
+        self.max_delay = max_delay
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._has_deadline = threading.Condition(self._lock)
+        self._held = {}  # connection -> HeldRequests
+        self._flusher = None
+
+    def _add(self, connection, data):
+        field = self._merged_fields.get(data.message_type)
+        schedule_flush = False
+        with self._lock:
+            if field is None or not getattr(data, field):  # the system structure request must be sent alone
+                self._send_pending(connection)
+                connection._send_container(data)
+                return
+            size = data.ByteSize()
+            held = self._held.get(connection)
+            if held is not None and held.size + size > self.max_size:
+                self._send_pending(connection)
+                held = None
+            if held is None:
+                held = self._held[connection] = HeldRequests()
+            pending = held.containers.get(data.message_type)
+            if pending is None:
+                held.containers[data.message_type] = data
+            else:
+                getattr(pending, field).extend(getattr(data, field))
+            held.size += size
+            if held.size >= self.max_size:
+                self._send_pending(connection)
+            elif not held.is_flush_scheduled:
+                held.is_flush_scheduled = schedule_flush = True
+        if schedule_flush:
+            connection._schedule_flush(self)
+
+    def _flush(self, connection):
+        with self._lock:
+            self._send_pending(connection)
+
+    def _wake_flusher(self, connection):
+        """Has the flusher thread, shared by all windows instead of a timer for each, send held requests in time."""
+        with self._lock:
+            held = self._held.get(connection)
+            if held is None or not held.is_flush_scheduled:  # flushed already
+                return
+            held.deadline = time.monotonic() + self.max_delay
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run_flusher, daemon=True)
+                self._flusher.start()
+            self._has_deadline.notify()
+
+    def _run_flusher(self):
+        client_threads.is_internal = True
+        with self._lock:
+            while True:
+                deadlines = [(held.deadline, connection) for connection, held in self._held.items()
+                             if held.deadline is not None]
+                if not deadlines:
+                    self._has_deadline.wait()
+                    continue
+                deadline, connection = min(deadlines, key=itemgetter(0))
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    self._has_deadline.wait(remaining)
+                    continue
+                try:
+                    self._send_pending(connection)
+                except Exception as error:
+                    logging.error('Sending held requests failed: ' + str(error))
+
+    def _discard(self, connection):
+        with self._lock:
+            self._held.pop(connection, None)
+
+    def _send_pending(self, connection):
+        held = self._held.pop(connection, None)
+        if held is None:
+            return
+        for data in held.containers.values():
+            connection._send_container(data)
+
+
+class ClockOffsetEstimator:
+    """Estimates how much the local clock is ahead of the application clock from periodic time samples.
+
+    Of the latest window samples, only the rtt_share of them with the shortest round trips are used, as a long round
+    trip leaves more room for the request and the response to be delayed unevenly. A line fitted through those samples
+    follows the drift between the clocks once they span more than one sampling interval.
+    """
+    def __init__(self, interval=5.0, window=32, initial_samples=3, rtt_share=0.5):
+        self.interval = interval
+        self.initial_samples = initial_samples
+        self._rtt_share = rtt_share
+        self._samples = deque(maxlen=window)  # (local time, offset, round trip time) tuples
+        self._fit = (0.0, 0.0, 0.0, None)  # (local time, offset at that time, drift, uncertainty)
+
+    def add_sample(self, sent, received, server_time):
+        """Adds a time sample.
+
+        Args:
+            sent: Local time in seconds when the time request was sent
+            received: Local time in seconds when the response was received
+            server_time: Application time in seconds in the response
+        """
+        round_trip_time = received - sent
+        local_time = sent + round_trip_time / 2.0
+        self._samples.append((local_time, local_time - server_time, round_trip_time))
+        self._fit = self._fit_samples()
+
+    def offset(self, at=None):
+        """Returns the estimated offset in seconds at local time at, which defaults to now."""
+        local_time, offset, drift, uncertainty = self._fit
+        if drift:
+            offset += drift * ((time.time() if at is None else at) - local_time)
+        return offset
+
+    def estimate(self, at=None):
+        """Returns ClockOffset(offset, drift, uncertainty) at local time at, which defaults to now.
+
+        Drift is in seconds per second and uncertainty in seconds, None before the first sample.
+        """
+        return ClockOffset(self.offset(at), self._fit[2], self._fit[3])
+
+    def _fit_samples(self):
+        samples = sorted(self._samples, key=lambda sample: sample[2])
+        samples = samples[:max(1, int(len(samples) * self._rtt_share))]
+        count = len(samples)
+        mean_time = sum(sample[0] for sample in samples) / count
+        mean_offset = sum(sample[1] for sample in samples) / count
+        drift = 0.0
+        if max(sample[0] for sample in samples) - min(sample[0] for sample in samples) > self.interval:
+            drift = sum((t - mean_time) * (offset - mean_offset) for t, offset, rtt in samples) \
+                / sum((t - mean_time) ** 2 for t, offset, rtt in samples)
+        residual = math.sqrt(sum((offset - mean_offset - drift * (t - mean_time)) ** 2
+                                 for t, offset, rtt in samples) / count)
+        return mean_time, mean_offset, drift, samples[0][2] / 2.0 + residual
+
+
+class ReconnectBackoff:
+    """Delays between reconnect attempts, growing by multiplier from initial_delay up to maximum_delay.
+
+    Each delay is shortened by a random amount of up to jitter times its length, so that clients that lost their
+    connection at the same time do not all reconnect at once. The delays start over once a connection succeeds.
+    """
+    def __init__(self, initial_delay=0.5, maximum_delay=30.0, multiplier=2.0, jitter=0.5):
+        self._initial_delay = initial_delay
+        self._maximum_delay = maximum_delay
+        self._multiplier = multiplier
+        self._jitter = jitter
+        self._delay = initial_delay
+
+    def next_delay(self):
+        """Returns the time in seconds to wait before the next reconnect attempt."""
+        delay = self._delay
+        self._delay = min(self._delay * self._multiplier, self._maximum_delay)
+        return delay * (1 - self._jitter * random.random())
+
+    def reset(self):
+        self._delay = self._initial_delay
+
+
+class AdaptiveThrottlingPolicy:
+    """Lowers the requested value rates of the heaviest subscriptions while the server throttles values.
+
+    On every throttling report, the fs and sample_rate requested for the reported node, or when no node is
+    reported for the heaviest_share of subscribed nodes with the highest rates, are multiplied by decrease_factor.
+    Subscriptions of all samples count as the heaviest and are limited to fs samples per second first. After
+    throttling has stopped, the rates are multiplied by increase_factor every ramp_interval seconds, checked as
+    messages arrive, until fully restored.
+    """
+    def __init__(self, decrease_factor=0.5, increase_factor=1.25, heaviest_share=0.25, minimum_fs=0.1,
+                 ramp_interval=5.0):
+        self._decrease_factor = decrease_factor
+        self._increase_factor = increase_factor
+        self._heaviest_share = heaviest_share
+        self._minimum_fs = minimum_fs
+        self._ramp_interval = ramp_interval
+        self._scales = {}  # node -> factor applied to its requested rates, nodes at full rate are not included
+        self._next_ramp_up = None  # time of the next increase, None when not ramping up
+
+    def scale(self, node):
+        """Returns the factor currently applied to the requested rates of node."""
+        return self._scales.get(node, 1.0)
+
+    def _apply(self, node, fs, sample_rate):
+        scale = self._scales.get(node)
+        if scale is None:
+            return fs, sample_rate
+        sample_rate = sample_rate or fs
+        return max(fs * scale, min(fs, self._minimum_fs)), max(sample_rate * scale, min(sample_rate, self._minimum_fs))
+
+    def _throttling_changed(self, connection, is_throttling, node):
+        if not is_throttling:
+            self._next_ramp_up = time.time() + self._ramp_interval if self._scales else None
+            return
+        self._next_ramp_up = None
+        nodes = [node] if node is not None and node._has_value_subscriptions() else self._heaviest_nodes(connection)
+        for node in nodes:
+            self._scales[node] = self.scale(node) * self._decrease_factor
+        self._send_value_requests(connection, nodes)
+
+    def _ramp_up(self, connection):
+        if self._next_ramp_up is None or time.time() < self._next_ramp_up:
+            return
+        nodes = list(self._scales)
+        for node in nodes:
+            scale = self._scales[node] * self._increase_factor
+            if scale >= 1:
+                del self._scales[node]
+            else:
+                self._scales[node] = scale
+        self._next_ramp_up = time.time() + self._ramp_interval if self._scales else None
+        self._send_value_requests(connection, nodes)
+
+    def _heaviest_nodes(self, connection):
+        def load(node):
+            fs, sample_rate = node._value_request_parameters()
+            return (sample_rate == 0, sample_rate, fs)
+
+        node_tree = connection.node_tree()
+        if node_tree._root_node is None:
+            return []
+        node_tree._ensure_index()
+        nodes = [node for node in node_tree._nodes_by_id.values() if node._has_value_subscriptions()]
+        nodes.sort(key=load, reverse=True)
+        return nodes[:int(math.ceil(len(nodes) * self._heaviest_share))]
+
+    def _send_value_requests(self, connection, nodes):
+        requests = [node._value_request() for node in nodes if node._has_value_subscriptions()]
+        requests = [request for request in requests if request is not None]
+        if requests:
+            connection.send_value_requests(requests)
+
+
+class CallbackDispatcher:
+    """Calls value and event callbacks in worker threads instead of the thread that receives messages.
+
+    Calls of a callback for the same node are made in order, one at a time. Each callback of each node has a queue
+    of at most maxsize calls, and overflow_policy (OverflowPolicy) decides what happens when it is full.
+    """
+    def __init__(self, workers=4, maxsize=1024, overflow_policy=OverflowPolicy.BLOCK):
+        if overflow_policy == OverflowPolicy.RAISE:
+            raise ValueError('OverflowPolicy.RAISE is not supported for callbacks')  # would stop receiving a message
+        self._maxsize = maxsize
+        self._overflow_policy = overflow_policy
+        self._lock = threading.Lock()
+        self._has_work = threading.Condition(self._lock)
+        self._has_room = threading.Condition(self._lock)
+        self._queues = {}  # queued calls by (node, callback), kept while queued or being called
+        self._ready = deque()  # keys of queues with calls that no worker is making
+        self._queue_depth = 0
+        self._dropped = 0
+        self._dropped_by_node = {}
+        self._is_closed = False
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def stats(self, node=None):
+        """Returns CallbackDispatcherStats(queue_depth, dropped) of all calls or of the calls for node."""
+        with self._lock:
+            if node is None:
+                return CallbackDispatcherStats(self._queue_depth, self._dropped)
+            queue_depth = sum(len(queue) for key, queue in self._queues.items() if key[0] is node)
+            return CallbackDispatcherStats(queue_depth, self._dropped_by_node.get(node, 0))
+
+    def close(self, timeout=None):
+        """Stops the worker threads after the queued calls are made, later calls are made right away."""
+        with self._lock:
+            self._is_closed = True
+            self._has_work.notify_all()
+            self._has_room.notify_all()
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def dispatch(self, node, callback, args):
+        key = (node, callback)
+        with self._lock:
+            if self._is_closed:
+                queue = None
+            else:
+                queue = self._queues.get(key)
+                while queue is not None and len(queue) >= self._maxsize \
+                        and self._overflow_policy == OverflowPolicy.BLOCK and not self._is_closed:
+                    self._has_room.wait()
+                    queue = self._queues.get(key)
+                if queue is None:
+                    queue = self._queues[key] = deque()
+                    self._ready.append(key)
+                    self._has_work.notify()
+                elif len(queue) >= self._maxsize:
+                    dropped = 1 if self._overflow_policy == OverflowPolicy.DROP_OLDEST else len(queue)
+                    for _ in range(dropped):
+                        queue.popleft()
+                    self._queue_depth -= dropped
+                    self._dropped += dropped
+                    self._dropped_by_node[node] = self._dropped_by_node.get(node, 0) + dropped
+                queue.append(args)
+                self._queue_depth += 1
+        if queue is None:
+            callback(*args)
+
+    def _work(self):
+        while True:
+            with self._lock:
+                while not self._ready and not self._is_closed:
+                    self._has_work.wait()
+                if not self._ready:
+                    return
+                key = self._ready.popleft()
+                args = self._queues[key].popleft()
+                self._queue_depth -= 1
+                self._has_room.notify_all()
+            try:
+                key[1](*args)
+            except Exception as error:
+                logging.error("Error in callback of node '" + key[0].path() + "': " + str(error))
+            with self._lock:
+                if self._queues[key]:
+                    self._ready.append(key)
+                    self._has_work.notify()
+                else:
+                    del self._queues[key]
+
+
+class MessageWriter:
+    """Sends messages in a thread of its own, so that threads sending requests do not wait for the socket.
+
+    Messages are queued in order, at most maxsize of them, and overflow_policy (OverflowPolicy.BLOCK, DROP_OLDEST or
+    RAISE) decides what happens when the queue is full. Only setter requests are dropped, as other requests have
+    state waiting for them; without setter requests to drop, DROP_OLDEST waits for room like BLOCK.
+    high_water_callback(queue_depth) is called in the sending thread whenever the queue grows to high_water_mark
+    messages, which defaults to three quarters of maxsize.
+    """
+    def __init__(self, maxsize=1024, overflow_policy=OverflowPolicy.BLOCK, high_water_mark=None,
+                 high_water_callback=None):
+        if overflow_policy == OverflowPolicy.CONFLATE:
+            raise ValueError('OverflowPolicy.CONFLATE is not supported for messages')
+        self._maxsize = maxsize
+        self._overflow_policy = overflow_policy
+        self._high_water_mark = high_water_mark if high_water_mark is not None else max(1, maxsize * 3 // 4)
+        self._high_water_callback = high_water_callback
+        self._lock = threading.Lock()
+        self._has_work = threading.Condition(self._lock)
+        self._has_room = threading.Condition(self._lock)
+        self._has_sent = threading.Condition(self._lock)
+        self._queue = deque()  # (connection, message, is_droppable) tuples
+        self._sending = None  # connection of the message being sent
+        self._dropped = 0
+        self._high_water_reached = 0
+        self._is_closed = False
+        self._thread = threading.Thread(target=self._work, daemon=True)
+        self._thread.start()
+
+    def stats(self):
+        """Returns MessageWriterStats(queue_depth, dropped, high_water_reached) of queued messages."""
+        with self._lock:
+            return MessageWriterStats(len(self._queue), self._dropped, self._high_water_reached)
+
+    def close(self, timeout=None):
+        """Stops the thread after the queued messages are sent, later messages are sent right away."""
+        with self._lock:
+            self._is_closed = True
+            self._has_work.notify_all()
+            self._has_room.notify_all()
+        self._thread.join(timeout)
+
+    def _write(self, connection, message, is_droppable=False):
+        is_high_water = False
+        with self._lock:
+            while len(self._queue) >= self._maxsize and not self._is_closed:
+                if self._overflow_policy == OverflowPolicy.RAISE and not getattr(client_threads, 'is_internal', False):
+                    raise QueueFullError('Send queue is full')
+                if self._overflow_policy == OverflowPolicy.DROP_OLDEST:
+                    index = next((i for i, item in enumerate(self._queue) if item[2]), None)
+                    if index is not None:
+                        del self._queue[index]
+                        self._dropped += 1
+                        continue
+                self._has_room.wait()
+            is_closed = self._is_closed
+            if not is_closed:
+                self._queue.append((connection, message, is_droppable))
+                self._has_work.notify()
+                is_high_water = len(self._queue) == self._high_water_mark
+                if is_high_water:
+                    self._high_water_reached += 1
+        if is_closed:
+            connection._ws.send(message)
+        elif is_high_water and self._high_water_callback is not None:
+            self._high_water_callback(self._high_water_mark)
+
+    def _drain(self, connection, timeout=None):
+        """Waits up to timeout seconds until the queued messages of connection have been sent."""
+        with self._lock:
+            self._has_sent.wait_for(lambda: self._sending is not connection
+                                    and not any(item[0] is connection for item in self._queue), timeout)
+
+    def _discard(self, connection):
+        with self._lock:
+            self._queue = deque(item for item in self._queue if item[0] is not connection)
+            self._has_room.notify_all()
+            self._has_sent.notify_all()
+
+    def _work(self):
+        while True:
+            with self._lock:
+                while not self._queue and not self._is_closed:
+                    self._has_work.wait()
+                if not self._queue:
+                    return
+                connection, message, is_droppable = self._queue.popleft()
+                self._sending = connection
+                self._has_room.notify_all()
+            try:
+                connection._ws.send(message)
+            except Exception as error:
+                logging.error('Sending a message failed: ' + str(error))
+            with self._lock:
+                self._sending = None
+                self._has_sent.notify_all()
 
 
 class Connection:
     def __init__(self, host, port, auto_reconnect, notification_listener=NotificationListener(),
-                 encryption_parameters=dict()):
+                 encryption_parameters=dict(), structure_cache=None, callback_dispatcher=None, throttling_policy=None,
+                 structure_change_window=0, reconnect_backoff=None, clock_estimator=None, message_coalescer=None,
+                 message_writer=None):
         self._host = host
         self._port = port
         self._system_name = ''
         self._application_name = ''
         self._cdp_version = ''
         self._system_use_notification = None
-        self._node_tree = NodeTree(self)
+        self._node_tree = NodeTree(self, structure_cache)
         self._structure_requests = Requests()
+        self._subscription_groups = []
+        self._callback_dispatcher = callback_dispatcher
+        self._latest_values = LatestValues()
+        self._throttling_policy = throttling_policy
+        self._is_throttling = False
+        self._throttling_occurrences = 0
+        self._throttling_by_node = {}  # node -> amount of throttling reports about it
+        self._structure_change_window = structure_change_window  # seconds
+        self._structure_change_lock = threading.Lock()
+        self._changed_nodes = {}  # nodes reported changed and not yet refetched, in report order
+        self._is_structure_change_scheduled = False
+        self._reconnect_backoff = reconnect_backoff if reconnect_backoff is not None else ReconnectBackoff()
+        self._reconnects = 0
+        self._last_reconnect_delay = None
+        self._connected_at = None  # time the websocket of the current connection was opened
+        self._first_value_latency = None  # seconds from the latest reconnect to the first value received after it
+        self._handshake_state = HandshakeState.CONNECTING
+        self._handshake_started = time.time()
+        self._handshake_timings = HandshakeTimings(None, None, None, None)  # seconds from _handshake_started
+        self._max_message_size = default_max_message_size
+        self._message_coalescer = message_coalescer
+        self._message_writer = message_writer
+        self._send_lock = threading.Lock()  # guards the counters of sent messages, sends come from any thread
+        self._subscription_lock = threading.RLock()  # guards subscription bookkeeping of all nodes
+        self._messages_sent = 0
+        self._frames_sent = 0
+        self._bytes_sent = 0
+        self._outbound_stats_started = time.time()
         self._time_request = Promise()
-        self._time_diff = 0 #seconds
-        self._last_time_diff_update = 0
+        self._clock_estimator = clock_estimator if clock_estimator is not None else ClockOffsetEstimator()
+        self._clock_sampling = 0  # incremented on every connect to stop the sampling of an earlier connection
         self._is_connected = False
         self._auto_reconnect = auto_reconnect
         self._notification_listener = notification_listener
@@ -456,46 +1934,122 @@ class Connection:
         p = Promise()
         self._structure_requests.add(node_path, p)
         if self._is_connected:
-            self._update_time_difference()
             self._compose_and_send_structure_request(node_id)
         return p
 
+    def send_structure_requests(self, nodes):
+        """Requests structure of many nodes in a single message.
+
+        Args:
+            nodes: List of (node_id, node_path) tuples
+
+        Returns:
+            List of promises, one per node, in the same order as nodes.
+        """
+        promises = []
+        for node_id, node_path in nodes:
+            p = Promise()
+            self._structure_requests.add(node_path, p)
+            promises.append(p)
+        if self._is_connected and nodes:
+            self._compose_and_send_structure_requests([node_id for node_id, node_path in nodes])
+        return promises
+
     def send_value_request(self, node_id, fs, sample_rate):
-        self._update_time_difference()
         self._compose_and_send_value_request(node_id, fs, sample_rate)
 
     def send_value_unrequest(self, node_id):
-        self._update_time_difference()
         self._compose_and_send_value_request(node_id, 1, 0, True)
 
+    def send_value_requests(self, requests):
+        """Sends many value requests in as few messages as possible.
+
+        Args:
+            requests: List of (node_id, fs, sample_rate) tuples
+        """
+        self._compose_and_send_value_requests([self._compose_value_request(node_id, fs, sample_rate)
+                                               for node_id, fs, sample_rate in requests])
+
+    def send_value_unrequests(self, node_ids):
+        self._compose_and_send_value_requests([self._compose_value_request(node_id, 1, 0, True)
+                                               for node_id in node_ids])
+
     def send_value(self, variant):
-        self._update_time_difference()
         self._compose_and_send_value(variant)
 
+    def send_values(self, variants):
+        self._compose_and_send_values(variants)
+
     def send_event_request(self, node_id, starting_from=None):
-        self._update_time_difference()
         self._compose_and_send_event_request(node_id, starting_from)
 
     def send_event_unrequest(self, node_id):
-        self._update_time_difference()
         self._compose_and_send_event_request(node_id, None, True)
 
+    def send_event_requests(self, node_ids):
+        """Requests events of many nodes in as few messages as possible."""
+        requests = []
+        for node_id in node_ids:
+            request = proto.EventRequest()
+            request.node_id = node_id
+            requests.append(request)
+        for chunk in self._split_by_size(requests):
+            data = proto.Container()
+            data.message_type = proto.Container.eEventRequest
+            data.event_request.extend(chunk)
+            self._send(data)
+
     def run_event_loop(self):
+        run_internally(self._run_forever)
+
+    def _run_forever(self):
         self._ws.run_forever(sslopt=self._encryption_parameters)
         while self._auto_reconnect:
-            sleep(1)
+            sleep(self._next_reconnect_delay())
             self._ws = self._connect(self._ws.url)
             self._ws.run_forever(sslopt=self._encryption_parameters)
 
     def close(self):
         self._auto_reconnect = False
+        self._node_tree.store_cache()
         self._cleanup_queued_requests(ConnectionError('Connection was closed'))
+        self.flush()  # held requests, e.g. the latest set_value(), are discarded once the socket is closed
+        if self._message_writer is not None:
+            self._message_writer._drain(self, message_writer_drain_timeout)
         self._ws.close()
 
     def server_time_difference(self):
-        return self._time_diff
+        return self._clock_estimator.offset()
+
+    def clock_offset(self):
+        return self._clock_estimator.estimate()
+
+    def handshake_timings(self):
+        return self._handshake_timings
+
+    def outbound_stats(self):
+        elapsed = time.time() - self._outbound_stats_started
+        return OutboundStats(self._messages_sent, self._frames_sent,
+                             self._frames_sent / elapsed if elapsed > 0 else 0.0,
+                             self._bytes_sent / self._frames_sent if self._frames_sent else 0.0)
+
+    def flush(self):
+        if self._message_coalescer is not None:
+            self._message_coalescer._flush(self)
+
+    def throttling_stats(self):
+        return ThrottlingStats(self._is_throttling, self._throttling_occurrences, dict(self._throttling_by_node))
+
+    def reconnect_stats(self):
+        return ReconnectStats(self._reconnects, self._last_reconnect_delay, self._first_value_latency)
+
+    def _next_reconnect_delay(self):
+        self._reconnects += 1
+        self._last_reconnect_delay = self._reconnect_backoff.next_delay()
+        return self._last_reconnect_delay
 
     def _connect(self, url):
+        self._start_handshake()
         return websocket.WebSocketApp(url,
                                       on_message=self._handle_hello_message,
                                       on_error=self._on_error,
@@ -508,76 +2062,63 @@ class Connection:
 
     def _on_close(self, ws, close_status_code=None, close_msg=None):
         self._is_connected = False
+        if self._message_coalescer is not None:
+            self._message_coalescer._discard(self)  # node ids of held requests may not be valid after reconnect
+        if self._message_writer is not None:
+            self._message_writer._discard(self)
+        self._node_tree.invalidate()  # structure may change while disconnected, e.g. when the application restarts
         if not self._auto_reconnect:
             self._cleanup_queued_requests(ConnectionError("Connection was closed"))
 
     def _on_open(self, ws):
-        pass
-
-    def _fetch_time_difference(self):
-        def do_time_request():
-            self._compose_and_send_time_request()
-            return self._time_request
-
-        def get_time_diff(time_samples):
-            def get_best_sample():
-                best_sample = None
-                for sample in time_samples:
-                    if best_sample is None or sample.ping < best_sample.ping:
-                        best_sample = sample
-                return best_sample
-            return Promise(lambda resolve, reject: resolve(get_best_sample().diff))
-
-        def calculate_time_diff(time_request_sent, response):
-            time_response_received = time.time()
-            client_time = time_response_received
-            ping_time = time_response_received - time_request_sent
-            server_time = response / nanoseconds_in_second + ping_time / 2.0
-            time_diff = client_time - server_time  # time_diff in seconds
-            Sample = namedtuple('Sample', 'ping, diff')
-            return Promise(lambda resolve, reject: resolve(Sample(ping_time, time_diff)))
-
-        def get_time_sample():
-            time_request_sent = time.time()
-            return do_time_request().then(lambda response: calculate_time_diff(time_request_sent, response))
-
-        def get_time_samples():
-            number_of_samples = 3
-            time_samples = []
-            promise = Promise()
-
-            def get_more_samples_if_needed():
-                def store_sample_and_get_more_if_needed(sample):
-                    time_samples.append(sample)
-                    return get_more_samples_if_needed()
-
-                if len(time_samples) < number_of_samples:
-                    return get_time_sample().then(store_sample_and_get_more_if_needed)
-                else:
-                    promise.do_resolve(time_samples)
-
-            get_more_samples_if_needed()
-            return promise
+        self._connected_at = time.time()
+
+    def _start_clock_sampling(self):
+        self._clock_sampling += 1
+        self._sample_clock(self._clock_sampling, self._clock_estimator.initial_samples)
+
+    def _sample_clock(self, sampling, burst=1):
+        def add_sample(response):
+            self._clock_estimator.add_sample(sent, time.time(), response / nanoseconds_in_second)
+            if burst > 1:
+                self._sample_clock(sampling, burst - 1)
+            else:
+                self._call_later(self._clock_estimator.interval, lambda: self._sample_clock(sampling))
+
+        if sampling != self._clock_sampling or not self._is_connected:
+            return
+        self._time_request = Promise()
+        self._time_request.then(add_sample)
+        sent = time.time()
+        self._compose_and_send_time_request()
 
-        return get_time_samples().then(get_time_diff)
+    def _start_handshake(self):
+        self._handshake_state = HandshakeState.CONNECTING
+        self._handshake_started = time.time()
+        self._handshake_timings = HandshakeTimings(None, None, None, None)
 
-    def _update_time_difference(self):
-        maximum_time_diff_update_frequency = 10 #seconds
+    def _enter_handshake_state(self, state, phase):
+        """Moves the handshake to state, recording the time the phase leading to it was completed."""
+        self._handshake_state = state
+        self._record_handshake_phase(phase)
 
-        def store_time_diff(time_diff):
-            self._time_diff = time_diff
-            self._last_time_diff_update = time.time()
-            return Promise(lambda resolve, reject: resolve())
+    def _record_handshake_phase(self, phase):
+        self._handshake_timings = self._handshake_timings._replace(**{phase: time.time() - self._handshake_started})
 
-        if time.time() >= self._last_time_diff_update + maximum_time_diff_update_frequency:
-            return self._fetch_time_difference().then(store_time_diff)
-        else:
-            return Promise(lambda resolve, reject: resolve())
+    def _synchronize(self):
+        """Starts clock sampling and structure fetching together once the connection is authenticated.
 
-    def _sync_time(self):
-        self._is_connected = True
+        The structure requests of the reconnect update and the structure cache are queued with those made while
+        connecting, so that all of them are sent at once, right after the first time request.
+        """
+        self._enter_handshake_state(HandshakeState.SYNCING, 'auth')
+        self._reconnect_backoff.reset()
         self._ws.on_message = self._handle_container_message
-        self._update_time_difference().then(self._node_tree.update()).then(self._send_queued_requests())
+        self._node_tree.update()
+        self._node_tree.load_cache()  # after update(), which refreshes a root node only when it existed before
+        self._is_connected = True
+        self._start_clock_sampling()
+        self._send_queued_requests()
 
     def _handle_auth_response(self, ws=None, message=None):
         if message is None:
@@ -586,7 +2127,7 @@ class Connection:
         data = proto.AuthResponse()
         data.ParseFromString(message)
         if data.result_code in (data.eGranted, data.eGrantedPasswordWillExpireSoon):
-            self._sync_time()
+            self._synchronize()
         else:
             auth_request = AuthRequest(host=self._host, port=self._port, system_name=self._system_name,
                                        application_name=self._application_name, cdp_version=self._cdp_version,
@@ -611,6 +2152,7 @@ class Connection:
             message = ws
             ws = None
         if self._parse_hello_message(message):
+            self._enter_handshake_state(HandshakeState.AUTHENTICATING, 'hello')
             request = AuthRequest(host=self._host, port=self._port, system_name=self._system_name,
                                   application_name=self._application_name, cdp_version=self._cdp_version,
                                   system_use_notification=self._system_use_notification)
@@ -629,7 +2171,7 @@ class Connection:
             request.then(self._authenticate)
             self._notification_listener.credentials_requested(request)
         else:
-            self._sync_time()
+            self._synchronize()
 
     def _handle_re_auth_request(self, message):
         if not self._re_auth_request:
@@ -646,6 +2188,8 @@ class Connection:
             ws = None
         data = proto.Container()
         data.ParseFromString(message)
+        if self._throttling_policy is not None:
+            self._throttling_policy._ramp_up(self)
         if data.message_type == proto.Container.eStructureResponse:
             self._parse_structure_response(data.structure_response)
         elif data.message_type == proto.Container.eGetterResponse:
@@ -664,15 +2208,57 @@ class Connection:
             logging.info('Unsupported message type received')
 
     def _parse_getter_response(self, response):
+        if self._handshake_timings.first_value is None:
+            self._record_handshake_phase('first_value')
+            if self._reconnects > 0:
+                self._first_value_latency = time.time() - self._connected_at
+        batches = {}
+        latest = {}
         for variant in response:
             node = self._node_tree.find_by_id(variant.node_id)
-            node._update_value(variant)
+            if node in self._latest_values._subscriptions:
+                latest[node] = variant  # later samples overwrite earlier ones, only the last one is decoded
+                if not node._value_subscriptions and not node._value_batch_subscriptions:
+                    continue
+            if node._value_batch_subscriptions:
+                batches.setdefault(node, []).append(variant)
+            else:
+                node._update_value(variant)
+        for node, variants in batches.items():
+            node._update_value_batch(variants)
+        if latest:
+            self._latest_values._update(latest)
 
     def _parse_structure_change_response(self, response):
-        for node_id in response:
-            node = self._node_tree.find_by_id(node_id)
-            if node is not None:
-                node._update()
+        with self._structure_change_lock:
+            for node_id in response:
+                node = self._node_tree.find_by_id(node_id)
+                if node is not None:
+                    node._is_structure_valid = False
+                    self._changed_nodes[node] = None
+            schedule = self._structure_change_window > 0 and not self._is_structure_change_scheduled
+            if schedule:
+                self._is_structure_change_scheduled = True
+        if self._structure_change_window <= 0:
+            self._update_changed_nodes()
+        elif schedule:  # changes reported during the window are collected and refetched together
+            self._call_later(self._structure_change_window, self._update_changed_nodes)
+
+    def _update_changed_nodes(self):
+        with self._structure_change_lock:
+            nodes = list(self._changed_nodes)
+            self._changed_nodes.clear()
+            self._is_structure_change_scheduled = False
+        if nodes:
+            self._node_tree.update_changed(nodes)
+
+    def _call_later(self, delay, callback):
+        timer = threading.Timer(delay, run_internally, (callback,))
+        timer.daemon = True
+        timer.start()
+
+    def _schedule_flush(self, message_coalescer):
+        message_coalescer._wake_flusher(self)
 
     def _parse_current_time_response(self, response):
         self._time_request.do_resolve(response)
@@ -701,9 +2287,26 @@ class Connection:
             self._challenge = error.challenge
             self._handle_re_auth_request(error.text)
         elif error.code == proto.eINVALID_REQUEST:
+            if error.HasField('node_id'):
+                for group in list(self._subscription_groups):
+                    group._node_failed(error.node_id, InvalidRequestError(error.text))
             self._cleanup_queued_requests(InvalidRequestError(error.text))
         elif error.code == proto.eUNSUPPORTED_CONTAINER_TYPE:
             self._cleanup_queued_requests(CommunicationError(error.text))
+        elif error.code in (proto.eVALUE_THROTTLING_OCCURRING, proto.eVALUE_THROTTLING_STOPPED):
+            self._parse_throttling(error)
+
+    def _parse_throttling(self, error):
+        is_throttling = error.code == proto.eVALUE_THROTTLING_OCCURRING
+        node = self._node_tree.find_by_id(error.node_id) if error.HasField('node_id') else None
+        if is_throttling:
+            self._throttling_occurrences += 1
+            if node is not None:
+                self._throttling_by_node[node] = self._throttling_by_node.get(node, 0) + 1
+        self._is_throttling = is_throttling
+        if self._throttling_policy is not None:
+            self._throttling_policy._throttling_changed(self, is_throttling, node)
+        self._notification_listener.value_throttling_changed(is_throttling, node)
 
     def _parse_hello_message(self, message):
         data = proto.Hello()
@@ -721,35 +2324,60 @@ class Connection:
         return True
 
     def _parse_structure_response(self, response):
+        if self._handshake_state == HandshakeState.SYNCING:
+            self._enter_handshake_state(HandshakeState.READY, 'first_structure')
         for structure in response:
             node = self._node_tree.find_by_id(structure.info.node_id)
             node_path = node.path() if node is not None else None
-            request = self._structure_requests.find(node_path)  # requests are stored with node path because node id can change between application reconnect
-            if request is not None:
-                self._structure_requests.remove(node_path)
-                for p in request.promises:
-                    p.do_resolve(structure)
+            self._resolve_queued_request(node_path, structure)  # requests are stored with node path because node id can change between application reconnect
 
     def _send_queued_requests(self):
+        node_ids = []
         for request in self._structure_requests.get():
             node_path = request.node_path
-            node_id = None if node_path is None else self._node_tree.find_by_path(node_path)._id()
-            self._compose_and_send_structure_request(node_id)
+            if node_path is None:
+                self._compose_and_send_structure_request(None)  # system structure request must be sent alone
+            else:
+                node_ids.append(self._node_tree.find_by_path(node_path)._id())
+        if node_ids:
+            self._compose_and_send_structure_requests(node_ids)
+
+    def _resolve_queued_request(self, node_path, structure):
+        request = self._structure_requests.remove(node_path)
+        if request is not None:
+            for p in request.promises:
+                p.do_resolve(structure)
 
     def _cleanup_queued_requests(self, error):
         self._time_request.reject(error)
         self._structure_requests.clear(error)
 
     def _compose_and_send_structure_request(self, node_id):
-        data = proto.Container()
-        data.message_type = proto.Container.eStructureRequest
-        if node_id is not None:
-            data.structure_request.append(node_id)
-        self._ws.send(data.SerializeToString())
+        self._compose_and_send_structure_requests([] if node_id is None else [node_id])
+
+    def _compose_and_send_structure_requests(self, node_ids):
+        ids_per_message = max(1, self._max_message_size // 6)  # field tag and varint of each node id
+        for start in range(0, max(len(node_ids), 1), ids_per_message):  # empty node_ids requests the system
+            data = proto.Container()
+            data.message_type = proto.Container.eStructureRequest
+            data.structure_request.extend(node_ids[start:start + ids_per_message])
+            self._send(data)
 
     def _compose_and_send_value_request(self, node_id, fs, sample_rate, stop=False):
         data = proto.Container()
         data.message_type = proto.Container.eGetterRequest
+        data.getter_request.extend([self._compose_value_request(node_id, fs, sample_rate, stop)])
+        self._send(data)
+
+    def _compose_and_send_value_requests(self, value_requests):
+        for chunk in self._split_by_size(value_requests):
+            data = proto.Container()
+            data.message_type = proto.Container.eGetterRequest
+            data.getter_request.extend(chunk)
+            self._send(data)
+
+    @staticmethod
+    def _compose_value_request(node_id, fs, sample_rate, stop=False):
         value = proto.ValueRequest()
         value.node_id = node_id
         value.fs = fs
@@ -757,19 +2385,61 @@ class Connection:
             value.sample_rate = sample_rate
         if stop:
             value.stop = stop
-        data.getter_request.extend([value])
-        self._ws.send(data.SerializeToString())
+        return value
+
+    def _send(self, data):
+        with self._send_lock:
+            self._messages_sent += 1
+        if self._message_coalescer is not None:
+            self._message_coalescer._add(self, data)
+        else:
+            self._send_container(data)
+
+    def _send_container(self, data):
+        self._send_frame(data.SerializeToString(), data.message_type == proto.Container.eSetterRequest)
+
+    def _send_frame(self, message, is_droppable=False):
+        """Sends message, which the message writer may drop when it is_droppable and the send queue is full."""
+        with self._send_lock:
+            self._frames_sent += 1
+            self._bytes_sent += len(message)
+        if self._message_writer is not None:
+            self._message_writer._write(self, message, is_droppable)
+        else:
+            self._ws.send(message)  # websocket.WebSocketApp sends each frame whole under a lock of its own
+
+    def _split_by_size(self, messages):
+        repeated_field_overhead = 6  # field tag and length prefix of each repeated message entry
+        chunk = []
+        chunk_size = 0
+        for message in messages:
+            size = message.ByteSize() + repeated_field_overhead
+            if chunk and chunk_size + size > self._max_message_size:
+                yield chunk
+                chunk = []
+                chunk_size = 0
+            chunk.append(message)
+            chunk_size += size
+        if chunk:
+            yield chunk
 
     def _compose_and_send_value(self, variant):
         data = proto.Container()
         data.message_type = proto.Container.eSetterRequest
         data.setter_request.extend([variant])
-        self._ws.send(data.SerializeToString())
+        self._send(data)
+
+    def _compose_and_send_values(self, variants):
+        for chunk in self._split_by_size(variants):
+            data = proto.Container()
+            data.message_type = proto.Container.eSetterRequest
+            data.setter_request.extend(chunk)
+            self._send(data)
 
     def _compose_and_send_time_request(self):
         data = proto.Container()
         data.message_type = proto.Container.eCurrentTimeRequest
-        self._ws.send(data.SerializeToString())
+        self._send(data)
 
     def _compose_and_send_event_request(self, node_id, starting_from=None, stop=False):
         data = proto.Container()
@@ -781,7 +2451,7 @@ class Connection:
         if stop:
             event_request.stop = stop
         data.event_request.extend([event_request])
-        self._ws.send(data.SerializeToString())
+        self._send(data)
 
     def _compose_auth_request(self, request):
         if not 'Username' in self._credentials:
@@ -797,7 +2467,7 @@ class Connection:
     def _compose_and_send_auth_request(self):
         request = proto.AuthRequest()
         self._compose_auth_request(request)
-        self._ws.send(request.SerializeToString())
+        self._send_frame(request.SerializeToString())
 
     def _compose_and_send_re_auth_request(self):
         container = proto.Container()
@@ -805,12 +2475,19 @@ class Connection:
         request = proto.AuthRequest()
         self._compose_auth_request(request)
         container.re_auth_request.CopyFrom(request)
-        self._ws.send(container.SerializeToString())
+        self._send(container)
 
 class NodeTree:
-    def __init__(self, connection):
+    def __init__(self, connection, structure_cache=None):
         self._connection = connection
+        self._structure_cache = structure_cache
+        self._system_info = None
+        self._structure_cache_hits = 0
+        self._structure_cache_misses = 0
         self._root_node = None  # starts with application node as node tree is created for each application connection
+        self._indexed_root_node = None
+        self._nodes_by_id = {}
+        self._nodes_by_path = {}  # keyed by path below the root node, root node itself is keyed by ''
 
     def root_node(self):
         if self._root_node is None:
@@ -820,100 +2497,707 @@ class NodeTree:
         return Promise(lambda resolve, reject: resolve(self._root_node))
 
     def find_by_id(self, node_id):
-        def find_node(node):
-            if node._id() == node_id:
-                return node
-            for child in node._children:
-                node = find_node(child)
-                if node is not None:
-                    return node
-            return None
-
         if self._root_node is None:
             return None
-        return find_node(self._root_node)
+        self._ensure_index()
+        node = self._nodes_by_id.get(node_id)
+        return node if node is not None else self._build_by_id(node_id)
 
     def find_by_path(self, path):
-        def find_node(node):
-            tokens.pop(0)
-            if not tokens:
-                return node
-            for child in node._children:
-                if child.name() == tokens[0]:
-                    return find_node(child)
-            return None
-
         if self._root_node is None:
             return None
-        tokens = path.split('.')
-        return find_node(self._root_node)
+        self._ensure_index()
+        relative_path = path.partition('.')[2]  # the first token is the root node and is not matched
+        node = self._nodes_by_path.get(relative_path)
+        if node is None and relative_path:
+            node = self._root_node
+            for name in relative_path.split('.'):  # builds the nodes on the path only
+                node = node._find_child(name)
+                if node is None:
+                    break
+        return node
+
+    def structure_cache_stats(self):
+        return StructureCacheStats(self._structure_cache_hits, self._structure_cache_misses)
+
+    def invalidate(self):
+        """Marks structure of all nodes unknown so that it is fetched again when next needed."""
+        if self._root_node is None:
+            return
+        self._ensure_index()
+        for node in self._nodes_by_id.values():
+            node._is_structure_valid = False
+
+    def load_cache(self):
+        """Sets the root node from the structure cache and revalidates it from the application in the background.
+
+        Does nothing when there is no cache, no matching cache entry or the root node already exists. A pending root
+        node request is resolved right away. Revalidation is done as in update(), so nodes found through the cache
+        keep their subscriptions when the application has renumbered them.
+        """
+        if self._structure_cache is None or self._root_node is not None:
+            return
+        system_structure = self._structure_cache.load(self._connection._system_name,
+                                                      self._connection._application_name,
+                                                      self._connection._cdp_version)
+        if system_structure is None or self._find_local_app(system_structure.node) is None:
+            return
+        self._set_root_node(system_structure)
+        self._root_node._is_cached = True  # children built from the cached structure are marked cached as well
+        self._connection._resolve_queued_request(None, system_structure)
+        self.update()
+
+    def store_cache(self):
+        """Stores the structure of all fetched nodes to the structure cache."""
+        def copy_node(target, node):
+            target.info.CopyFrom(node._info())
+            if node._child_nodes is None:
+                target.node.extend(node._child_structures)
+                return
+            for child in node._child_nodes:
+                copy_node(target.node.add(), child)
+
+        if self._structure_cache is None or self._root_node is None or self._system_info is None:
+            return
+        system_structure = proto.Node()
+        system_structure.info.CopyFrom(self._system_info)
+        app_structure = system_structure.node.add()
+        copy_node(app_structure, self._root_node)
+        app_structure.info.is_local = True
+        self._structure_cache.store(self._connection._system_name, self._connection._application_name,
+                                    self._connection._cdp_version, system_structure)
 
     def update(self):
+        """Refetches the structure of used nodes after a reconnect and restores their subscriptions.
+
+        Node ids can change when the application restarts, so nodes are matched by path. Each tree level is fetched
+        with one structure request, then all value and event subscriptions are restored with batched requests.
+        """
         if self._root_node is not None:
             return self._fetch_system() \
-                .then(self._get_root_node) \
-                .then(self._update_recursively)
+                .then(self._remap_root_node) \
+                .then(lambda root: self._update_level([root])) \
+                .then(lambda result: self._restore_subscriptions())
         return Promise(lambda resolve, reject: resolve())
 
-    def _update_recursively(self, node):
-        def update_children(node):
-            promises = []
-            for child in node._children:
-                if child._children or child.is_leaf():  # do not fetch more than needed
-                    promises.append(self._update_recursively(child))
-            return Promise.all(promises)
+    def update_changed(self, nodes):
+        """Refetches the structure of nodes reported changed by the application in one structure request.
+
+        A node below another changed node is only left marked unknown, to be fetched when next needed, unless its
+        children have been used. Each refetched node reports its changes to structure change callbacks once.
+        """
+        def has_changed_ancestor(node):
+            parent = node._parent
+            while parent is not None:
+                if parent in changed:
+                    return True
+                parent = parent._parent
+            return False
+
+        def depth(node):
+            level = 0
+            while node._parent is not None:
+                node = node._parent
+                level += 1
+            return level
+
+        def update_nodes(structures):
+            requests = []
+            for node, structure in zip(nodes, structures):
+                node._update_structure(structure)
+                if node._has_value_subscriptions():
+                    requests.append(node._value_request(force=True))
+            if requests:
+                self._connection.send_value_requests(requests)
+
+        changed = set(nodes)
+        nodes = [node for node in nodes if node._child_nodes or node._structure_subscriptions
+                 or not has_changed_ancestor(node)]
+        nodes.sort(key=depth)  # parents are updated before their children
+        promises = self._connection.send_structure_requests([(node._id(), node.path()) for node in nodes])
+        return Promise.all(promises).then(update_nodes)
+
+    def _remap_root_node(self, system_structure):
+        app = self._find_local_app(system_structure.node)
+        if app is not None and app.info.name == self._root_node.name():
+            self._remap_id(self._root_node, app)
+        return Promise(lambda resolve, reject: resolve(self._root_node))
 
-        return node._update().done(update_children)
+    def _update_level(self, nodes):
+        def update_nodes(structures):
+            next_level = []
+            for node, structure in zip(nodes, structures):
+                node._update_structure(structure, remap=True)
+                for child in node._child_nodes or ():  # children not built yet are replaced by the parent update
+                    if child._child_nodes or child._structure_subscriptions:
+                        next_level.append(child)
+                    else:
+                        child._is_cached = False  # others are fetched when next needed
+            return self._update_level(next_level) if next_level else None
+
+        promises = self._connection.send_structure_requests([(node._id(), node.path()) for node in nodes])
+        return Promise.all(promises).then(update_nodes)
+
+    def _restore_subscriptions(self):
+        self._ensure_index()
+        value_requests = []
+        event_node_ids = []
+        for node in self._nodes_by_id.values():
+            if node._has_value_subscriptions():
+                value_requests.append(node._value_request(force=True))
+            if node._event_subscriptions:
+                event_node_ids.append(node._id())
+        if value_requests:
+            self._connection.send_value_requests(value_requests)
+        if event_node_ids:
+            self._connection.send_event_requests(event_node_ids)
+
+    def _remap_id(self, node, structure):
+        """Gives node the id in structure, which has the same name, when the application has renumbered it."""
+        if node._id() == structure.info.node_id:
+            node._set_structure(structure)
+            return
+        if self._nodes_by_id.get(node._id()) is node:
+            del self._nodes_by_id[node._id()]
+        node._set_structure(structure)
+        if self._indexed_root_node is not None:
+            self._nodes_by_id[node._id()] = node
 
     def _update_node(self, node):
+        if node._is_cached:  # use cached structure right away, load_cache() revalidates it in the background
+            return Promise(lambda resolve, reject: resolve(node))
         return node._update()
 
-    def _set_root_node(self, system_structure):
-        def find_local_app(apps):
-            for app in apps:
-                if app.info.is_local:
-                    return app
-            return None
+    def _ensure_index(self):
+        if self._indexed_root_node is not self._root_node:
+            self._nodes_by_id.clear()
+            self._nodes_by_path.clear()
+            self._indexed_root_node = self._root_node
+            self._add_to_index(self._root_node)  # children not built yet are indexed when built
+
+    def _build_by_id(self, node_id):
+        """Builds the nodes down to the one with node_id from the structures of nodes not built yet, if any."""
+        nodes = [self._root_node]
+        while nodes:
+            node = nodes.pop()
+            if node._child_nodes is not None:
+                nodes.extend(node._child_nodes)
+                continue
+            structures = [(structure, (structure.info.name,)) for structure in node._child_structures]
+            while structures:
+                structure, names = structures.pop()
+                if structure.info.node_id == node_id:
+                    for name in names:
+                        node = node._find_child(name)
+                    return node
+                structures.extend((child, names + (child.info.name,)) for child in structure.node)
+        return None
 
+    def _is_indexed(self, node):
+        return self._indexed_root_node is not None and self._nodes_by_id.get(node._id()) is node
+
+    def _relative_path(self, node):
+        return node.path().partition('.')[2]
+
+    def _add_to_index(self, node):
+        nodes = [node]
+        while nodes:
+            node = nodes.pop()
+            self._nodes_by_id[node._id()] = node
+            self._nodes_by_path[self._relative_path(node)] = node
+            nodes.extend(node._child_nodes or ())  # the rest are indexed when built
+
+    def _remove_from_index(self, node):
+        nodes = [node]
+        while nodes:
+            node = nodes.pop()
+            if self._nodes_by_id.get(node._id()) is node:
+                del self._nodes_by_id[node._id()]
+            path = self._relative_path(node)
+            if self._nodes_by_path.get(path) is node:
+                del self._nodes_by_path[path]
+            nodes.extend(node._child_nodes or ())
+
+    def _set_root_node(self, system_structure):
         if not self._root_node:
-            self._root_node = Node(None, self._connection, find_local_app(system_structure.node))
+            self._system_info = proto.Info()
+            self._system_info.CopyFrom(system_structure.info)
+            self._root_node = Node(None, self._connection, self._find_local_app(system_structure.node))
+            self._ensure_index()
         return Promise(lambda resolve, reject: resolve(self._root_node))
 
-    def _get_root_node(self, system_structure):
-        return Promise(lambda resolve, reject: resolve(self._root_node))
+    @staticmethod
+    def _find_local_app(apps):
+        for app in apps:
+            if app.info.is_local:
+                return app
+        return None
 
     def _fetch_system(self):
         return self._connection.send_structure_request(None, None)
 
 
 class Requests:
+    """Pending requests by node path, which can be added from many threads while replies are resolved."""
     def __init__(self):
         self._requests = []
+        self._lock = threading.Lock()
 
     def get(self):
-        return self._requests
+        with self._lock:
+            return list(self._requests)
 
     def add(self, node_path, promise):  # use node_path instead of node_id as this doesn't change after reconnect
-        request = self.find(node_path)
-        if request is None:
-            Request = namedtuple('Request', 'node_path, promises')
-            self._requests.append(Request(node_path, [promise]))
-        else:
-            if promise not in request.promises:
-                request.promises.append(promise)
+        with self._lock:
+            request = self._find(node_path)
+            if request is None:
+                Request = namedtuple('Request', 'node_path, promises')
+                self._requests.append(Request(node_path, [promise]))
+            else:
+                if promise not in request.promises:
+                    request.promises.append(promise)
 
     def find(self, node_path):
-        for r in self._requests:
-            if r.node_path == node_path:
-                return r
-        return None
+        with self._lock:
+            return self._find(node_path)
 
     def remove(self, node_path):
-        request = self.find(node_path)
-        self._requests.remove(request)
+        """Removes and returns the request of node_path, None if there is no such request."""
+        with self._lock:
+            request = self._find(node_path)
+            if request is not None:
+                self._requests.remove(request)
+            return request
 
     def clear(self, error=UnknownError('Something has went wrong')):
-        for request in self._requests:
+        with self._lock:
+            requests = self._requests
+            self._requests = []
+        for request in requests:
             for p in request.promises:
                 p.do_reject(error)
-        del self._requests[:]
+
+    def _find(self, node_path):
+        for r in self._requests:
+            if r.node_path == node_path:
+                return r
+        return None
+
+
+def await_promise(promise):
+    """Returns an asyncio future that is resolved or rejected together with promise."""
+    future = asyncio.get_running_loop().create_future()
+    promise.then(lambda value: future.done() or future.set_result(value),
+                 lambda error: future.done() or future.set_exception(error))
+    return future
+
+
+class AsyncClient:
+    """Client for asyncio applications, running in the event loop of the caller instead of a thread of its own.
+
+    Uses the same handshake, authentication and message handling as Client, but provides coroutines instead of
+    promises and bounded async iterators instead of callbacks. Requires the websockets package.
+    """
+    def __init__(self, host='127.0.0.1', port=7689, auto_reconnect=True, notification_listener=NotificationListener(),
+                 encryption_parameters=dict(), structure_cache=None, throttling_policy=None, structure_change_window=0,
+                 reconnect_backoff=None, clock_estimator=None, message_coalescer=None):
+        if websockets is None:
+            raise ImportError("websockets is required for AsyncClient")
+        self._connection = AsyncConnection(host, port, auto_reconnect, notification_listener, encryption_parameters,
+                                           structure_cache, throttling_policy, structure_change_window,
+                                           reconnect_backoff, clock_estimator, message_coalescer)
+        self._task = None
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.disconnect()
+
+    def start(self):
+        """Starts running the connection as a task of the current event loop, if not started yet."""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.run_event_loop())
+
+    async def run_event_loop(self):
+        await self._connection.run_event_loop()
+
+    async def disconnect(self):
+        self._connection.close()
+        if self._task is not None:
+            await self._task
+
+    async def root_node(self):
+        return AsyncNode(await await_promise(self._connection.node_tree().root_node()))
+
+    def throttling_stats(self):
+        return self._connection.throttling_stats()
+
+    def reconnect_stats(self):
+        return self._connection.reconnect_stats()
+
+    def clock_offset(self):
+        return self._connection.clock_offset()
+
+    def handshake_timings(self):
+        return self._connection.handshake_timings()
+
+    def outbound_stats(self):
+        return self._connection.outbound_stats()
+
+    def flush(self):
+        self._connection.flush()
+
+    async def find_node(self, path):
+        node = await self.root_node()
+        for name in path.split('.')[1:]:
+            node = await node.child(name)
+        return node
+
+
+class MultiClient:
+    """Client for all applications of a CDP system, running their connections in one asyncio event loop.
+
+    Connects to the application at host and port and, through its system structure, to the other applications
+    of the system that have a server address. Each connection reconnects on its own when auto_reconnect is set.
+    Requires the websockets package.
+    """
+    def __init__(self, host='127.0.0.1', port=7689, auto_reconnect=True, notification_listener=NotificationListener(),
+                 encryption_parameters=dict()):
+        self._auto_reconnect = auto_reconnect
+        self._notification_listener = notification_listener
+        self._encryption_parameters = encryption_parameters
+        self._client = AsyncClient(host, port, auto_reconnect, notification_listener, encryption_parameters)
+        self._clients = {}  # by application name
+        self._discovery = None
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.disconnect()
+
+    def start(self):
+        """Starts connecting to the applications as tasks of the current event loop, if not started yet."""
+        self._client.start()
+        if self._discovery is None:
+            self._discovery = asyncio.ensure_future(self.discover())
+
+    async def run_event_loop(self):
+        self.start()
+        await self._discovery
+        await asyncio.gather(*[client._task for client in self._all_clients()])
+
+    async def disconnect(self):
+        if self._discovery is not None and not self._discovery.done():
+            self._discovery.cancel()
+        await asyncio.gather(*[client.disconnect() for client in self._all_clients()])
+
+    async def discover(self):
+        """Connects to the applications of the system that are not connected yet.
+
+        Returns:
+            Dict of AsyncClient objects of all connected applications, keyed by application name.
+        """
+        root_node = await self._client.root_node()
+        self._clients[root_node.name()] = self._client
+        system_structure = await await_promise(self._client._connection.node_tree()._fetch_system())
+        for app in system_structure.node:
+            if app.info.name not in self._clients and app.info.server_addr:
+                client = AsyncClient(app.info.server_addr, app.info.server_port, self._auto_reconnect,
+                                     self._notification_listener, self._encryption_parameters)
+                client.start()
+                self._clients[app.info.name] = client
+        return dict(self._clients)
+
+    async def clients(self):
+        """Returns a dict of AsyncClient objects of all connected applications, keyed by application name."""
+        self.start()
+        await asyncio.shield(self._discovery)
+        return dict(self._clients)
+
+    async def root_nodes(self):
+        """Returns a list of the application AsyncNode objects of all connected applications."""
+        clients = await self.clients()
+        return list(await asyncio.gather(*[client.root_node() for client in clients.values()]))
+
+    async def find_node(self, path):
+        """Finds a node by path starting with an application name, from the application it belongs to."""
+        clients = await self.clients()
+        application_name = path.split('.')[0]
+        if application_name not in clients:
+            raise NotFoundError("Could not find application '" + application_name + "'")
+        return await clients[application_name].find_node(path)
+
+    def _all_clients(self):
+        clients = set(self._clients.values())
+        clients.add(self._client)
+        return [client for client in clients if client._task is not None]
+
+
+class AsyncNode:
+    """Node of an AsyncClient, with coroutines and async iterators in place of promises and callbacks."""
+    __slots__ = ('_node',)
+
+    def __init__(self, node):
+        self._node = node
+
+    def __eq__(self, other):
+        return isinstance(other, AsyncNode) and other._node is self._node
+
+    def __hash__(self):
+        return hash(self._node)
+
+    def last_value(self):
+        return self._node.last_value()
+
+    def set_value(self, value, timestamp=0):
+        self._node.set_value(value, timestamp)
+
+    def name(self):
+        return self._node.name()
+
+    def path(self):
+        return self._node.path()
+
+    def parent(self):
+        parent = self._node.parent()
+        return AsyncNode(parent) if parent is not None else None
+
+    def type(self):
+        return self._node.type()
+
+    def class_name(self):
+        return self._node.class_name()
+
+    def is_read_only(self):
+        return self._node.is_read_only()
+
+    def is_leaf(self):
+        return self._node.is_leaf()
+
+    async def child(self, name):
+        return AsyncNode(await await_promise(self._node.child(name)))
+
+    async def children(self):
+        return [AsyncNode(node) for node in await await_promise(self._node.children())]
+
+    def values(self, fs=5, sample_rate=0, maxsize=default_stream_size, overflow_policy=OverflowPolicy.DROP_OLDEST):
+        """Starts listening value changes.
+
+        Args:
+            fs: Maximum frequency that value updates are expected
+            sample_rate: Maximum amount of value updates sent per second, zero means all samples
+            maxsize: Amount of unread values the stream holds
+            overflow_policy: OverflowPolicy.DROP_OLDEST or CONFLATE, which values to drop when the stream is full
+
+        Returns:
+            AsyncStream of (value, timestamp) tuples, that stops listening when closed.
+        """
+        stream = AsyncStream(self._node._connection, lambda: self._node.unsubscribe_from_value_changes(callback),
+                             maxsize, overflow_policy)
+        callback = lambda value, timestamp: stream._put((value, timestamp))
+        self._node.subscribe_to_value_changes(callback, fs, sample_rate)
+        return stream
+
+    def events(self, starting_from=None, maxsize=default_stream_size, overflow_policy=OverflowPolicy.DROP_OLDEST):
+        """Starts listening events from this node and its children.
+
+        Args:
+            starting_from: Optional timestamp to start receiving events from (nanoseconds since Epoch)
+            maxsize: Amount of unread events the stream holds
+            overflow_policy: OverflowPolicy.DROP_OLDEST or CONFLATE, which events to drop when the stream is full
+
+        Returns:
+            AsyncStream of EventInfo messages, that stops listening when closed.
+        """
+        stream = AsyncStream(self._node._connection, lambda: self._node.unsubscribe_from_events(stream._put), maxsize,
+                             overflow_policy)
+        self._node.subscribe_to_events(stream._put, starting_from)
+        return stream
+
+
+class AsyncStream:
+    """Bounded async iterator over values or events of a node.
+
+    When maxsize items are unread, overflow_policy (OverflowPolicy.DROP_OLDEST or CONFLATE) decides which of them
+    are dropped, so that a slow or forgotten consumer holds back neither the connection nor other streams.
+    Iteration ends after the stream or client is closed.
+    """
+    def __init__(self, connection, unsubscribe, maxsize, overflow_policy=OverflowPolicy.DROP_OLDEST):
+        if overflow_policy not in (OverflowPolicy.DROP_OLDEST, OverflowPolicy.CONFLATE):
+            raise ValueError('Only OverflowPolicy.DROP_OLDEST and CONFLATE are supported for streams')
+        self._connection = connection
+        self._unsubscribe = unsubscribe
+        self._maxsize = maxsize
+        self._overflow_policy = overflow_policy
+        self._items = deque()
+        self._has_items = asyncio.Event()
+        self._dropped = 0
+        self._is_closed = False
+        connection._streams.add(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._items:
+            if self._is_closed:
+                raise StopAsyncIteration
+            self._has_items.clear()
+            await self._has_items.wait()
+        return self._items.popleft()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def qsize(self):
+        """Returns the amount of unread items."""
+        return len(self._items)
+
+    def dropped(self):
+        """Returns the amount of items dropped because the stream was full."""
+        return self._dropped
+
+    def close(self):
+        """Stops listening, items received before are still iterated."""
+        if not self._is_closed:
+            self._unsubscribe()
+            self._end()
+
+    def _end(self):
+        self._is_closed = True
+        self._connection._streams.discard(self)
+        self._has_items.set()
+
+    def _put(self, item):
+        if self._is_closed:
+            return
+        if len(self._items) >= self._maxsize:
+            if self._overflow_policy == OverflowPolicy.CONFLATE:
+                self._dropped += len(self._items)
+                self._items.clear()
+            else:
+                self._items.popleft()
+                self._dropped += 1
+        self._items.append(item)
+        self._has_items.set()
+
+
+class AsyncConnection(Connection):
+    """Connection that runs in an asyncio event loop, see AsyncWebSocket."""
+    def __init__(self, host, port, auto_reconnect, notification_listener=NotificationListener(),
+                 encryption_parameters=dict(), structure_cache=None, throttling_policy=None, structure_change_window=0,
+                 reconnect_backoff=None, clock_estimator=None, message_coalescer=None):
+        self._streams = set()
+        Connection.__init__(self, host, port, auto_reconnect, notification_listener, encryption_parameters,
+                            structure_cache, throttling_policy=throttling_policy,
+                            structure_change_window=structure_change_window, reconnect_backoff=reconnect_backoff,
+                            clock_estimator=clock_estimator, message_coalescer=message_coalescer)
+
+    async def run_event_loop(self):
+        await self._ws.run_forever(sslopt=self._encryption_parameters)
+        while self._auto_reconnect:
+            await asyncio.sleep(self._next_reconnect_delay())
+            self._ws = self._connect(self._ws.url)
+            await self._ws.run_forever(sslopt=self._encryption_parameters)
+        for stream in list(self._streams):
+            stream._end()
+
+    def _connect(self, url):
+        self._start_handshake()
+        ws = AsyncWebSocket(url,
+                            on_message=self._handle_hello_message,
+                            on_error=self._on_error,
+                            on_close=self._on_close,
+                            on_open=self._on_open)
+        return ws
+
+    def _call_later(self, delay, callback):
+        asyncio.get_running_loop().call_later(delay, callback)
+
+    def _schedule_flush(self, message_coalescer):
+        self._call_later(message_coalescer.max_delay, lambda: message_coalescer._flush(self))
+
+
+class AsyncWebSocket:
+    """Websocket for the asyncio event loop, with the part of websocket.WebSocketApp interface that Connection uses."""
+    def __init__(self, url, on_message, on_error, on_close, on_open):
+        self.url = url
+        self.on_message = on_message
+        self.on_error = on_error
+        self.on_close = on_close
+        self.on_open = on_open
+        self._websocket = None
+        self._outgoing = None
+        self._is_closed = False
+
+    async def run_forever(self, sslopt=dict()):
+        if self._is_closed:
+            return
+        self._outgoing = asyncio.Queue()
+        try:
+            # like websocket.WebSocketApp, do not limit the message size, compress or ping
+            async with websockets.connect(self.url, ssl=self._ssl_context(sslopt), max_size=None, compression=None,
+                                          ping_interval=None) as ws:
+                self._websocket = ws
+                if self._is_closed:  # closed while connecting
+                    return
+                self.on_open(self)
+                writer = asyncio.ensure_future(self._write(ws))
+                try:
+                    await self._read(ws)
+                finally:
+                    writer.cancel()
+        except websockets.ConnectionClosed:
+            pass
+        except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as error:
+            self.on_error(self, error)
+        finally:
+            self._websocket = None
+            self.on_close(self)
+
+    def send(self, data):
+        if self._websocket is None or self._is_closed:
+            raise websocket.WebSocketConnectionClosedException("Connection is already closed.")
+        self._outgoing.put_nowait(data)
+
+    def close(self):
+        if self._is_closed:
+            return
+        self._is_closed = True
+        if self._websocket is not None:
+            self._outgoing.put_nowait(None)  # closes after the messages sent before
+
+    async def _read(self, ws):
+        while True:
+            message = await ws.recv()
+            try:
+                self.on_message(self, message)
+            except Exception as error:
+                logging.error("Error handling message: %s", error)
+                self.on_error(self, error)
+
+    async def _write(self, ws):
+        while True:
+            data = await self._outgoing.get()
+            if data is None:
+                await ws.close()
+                return
+            await ws.send(data)
+
+    def _ssl_context(self, sslopt):
+        if not self.url.startswith('wss://'):
+            return None
+        context = ssl.create_default_context(cafile=sslopt.get('ca_certs'))
+        if 'certfile' in sslopt:
+            context.load_cert_chain(sslopt['certfile'], sslopt.get('keyfile'))
+        cert_reqs = sslopt.get('cert_reqs', ssl.CERT_REQUIRED)
+        context.check_hostname = sslopt.get('check_hostname', cert_reqs != ssl.CERT_NONE)
+        context.verify_mode = cert_reqs
+        return context
@@ -19,6 +19,20 @@ value1_node.info.node_type = proto.CDP_PROPERTY
 value1_node.info.value_type = proto.eDOUBLE
 value1_node.info.flags = proto.Info.eNodeIsLeaf
 
+bool_node = proto.Node()
+bool_node.info.node_id = 6
+bool_node.info.name = "Bool1"
+bool_node.info.node_type = proto.CDP_PROPERTY
+bool_node.info.value_type = proto.eBOOL
+bool_node.info.flags = proto.Info.eNodeIsLeaf
+
+int_node = proto.Node()
+int_node.info.node_id = 7
+int_node.info.name = "Int1"
+int_node.info.node_type = proto.CDP_PROPERTY
+int_node.info.value_type = proto.eINT
+int_node.info.flags = proto.Info.eNodeIsLeaf
+
 comp1_node = proto.Node()
 comp1_node.info.node_id = 9
 comp1_node.info.name = "Comp1"
@@ -86,10 +100,17 @@ def create_structure_change_response(node_id):
     return response
 
 
-def create_value_response():
+def create_value_response(node_id=None, values=None):
     response = proto.Container()
     response.message_type = proto.Container.eGetterResponse
-    response.getter_response.extend([value1])
+    if node_id is None:
+        response.getter_response.extend([value1])
+        return response
+    for i, value in enumerate(values):
+        variant = response.getter_response.add()
+        variant.node_id = node_id
+        variant.d_value = value
+        variant.timestamp = i + 1
     return response
 
 
@@ -270,3 +291,13 @@ def create_event_response(event_info):
     event_resp = response.event_response.add()
     event_resp.CopyFrom(event_info)
     return response
+
+
+def sent_containers(mock_send):
+    containers = []
+    for call in mock_send.call_args_list:
+        container = proto.Container()
+        container.ParseFromString(call[0][0])
+        if container.message_type != proto.Container.eCurrentTimeRequest:
+            containers.append(container)
+    return containers
@@ -0,0 +1,102 @@
+from cdp_client import cdp_pb2 as proto
+from cdp_client.tests import fake_data
+from copy import copy
+import asyncio
+import time
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+
+def create_system_structure(local_application_name='App1'):
+    """Returns System with App1 and App2, the local one of them holding Comp1 with Value1 and Int1."""
+    comp = copy(fake_data.comp1_node)
+    comp.node.extend([fake_data.value1_node, fake_data.int_node])
+    system = copy(fake_data.system_node)
+    for app_node in (fake_data.app1_node, fake_data.app2_node):
+        app = system.node.add()
+        app.info.CopyFrom(app_node.info)
+        app.info.flags = proto.Info.eValueIsReadOnly
+        app.info.is_local = app.info.name == local_application_name
+        if app.info.is_local:
+            app.node.extend([comp])
+    return system
+
+
+class FakeServer:
+    """In-process stand-in for the StudioAPI server of a CDP application.
+
+    Answers hello, time and structure requests from the given system structure and records all other requests.
+    """
+    def __init__(self, system_structure=None):
+        self.system_structure = system_structure if system_structure is not None else create_system_structure()
+        self.requests = []  # received containers, except time requests
+        self.port = None
+        self._server = None
+        self._connections = set()
+
+    async def start(self):
+        self._server = await websockets.serve(self._serve, '127.0.0.1', 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def send(self, container):
+        for ws in list(self._connections):
+            await ws.send(container.SerializeToString())
+
+    async def disconnect(self):
+        """Closes the connections of all clients."""
+        for ws in list(self._connections):
+            await ws.close()
+
+    async def wait_for_request(self, message_type, condition=lambda request: True, timeout=5):
+        """Returns the first received request of message_type matching condition, waiting up to timeout seconds."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            for request in self.requests:
+                if request.message_type == message_type and condition(request):
+                    return request
+            await asyncio.sleep(0.01)
+        raise AssertionError('No request of type ' + str(message_type) + ' received')
+
+    async def _serve(self, ws, path=None):
+        self._connections.add(ws)
+        try:
+            await ws.send(fake_data.create_valid_hello_response().SerializeToString())
+            async for message in ws:
+                await self._handle(ws, message)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self._connections.discard(ws)
+
+    async def _handle(self, ws, message):
+        request = proto.Container()
+        request.ParseFromString(message)
+        if request.message_type == proto.Container.eCurrentTimeRequest:
+            await ws.send(fake_data.create_time_response(time.time_ns()).SerializeToString())
+            return
+        self.requests.append(request)
+        if request.message_type == proto.Container.eStructureRequest:
+            response = proto.Container()
+            response.message_type = proto.Container.eStructureResponse
+            for node_id in request.structure_request or [None]:
+                response.structure_response.extend([self._structure(node_id)])
+            await ws.send(response.SerializeToString())
+
+    def _structure(self, node_id):
+        nodes = [self.system_structure]
+        while nodes:
+            node = nodes.pop()
+            if node_id is None or node.info.node_id == node_id:
+                structure = proto.Node()
+                structure.info.CopyFrom(node.info)
+                for child in node.node:
+                    structure.node.add().info.CopyFrom(child.info)
+                return structure
+            nodes.extend(node.node)
+        raise KeyError(node_id)
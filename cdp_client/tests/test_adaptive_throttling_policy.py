@@ -0,0 +1,65 @@
+from cdp_client import cdp
+from cdp_client import cdp_pb2 as proto
+from cdp_client.tests import fake_data
+from cdp_client.tests.fake_server import FakeServer
+import asyncio
+import unittest
+
+
+def create_throttling_error(code, node_id=None):
+    response = proto.Container()
+    response.message_type = proto.Container.eRemoteError
+    response.error.code = code
+    if node_id is not None:
+        response.error.node_id = node_id
+    return response
+
+
+def is_value_request(node_id, fs, sample_rate):
+    return lambda request: any(r.node_id == node_id and r.fs == fs and r.sample_rate == sample_rate and not r.stop
+                               for r in request.getter_request)
+
+
+@unittest.skipIf(cdp.websockets is None, 'websockets is not installed')
+class AdaptiveThrottlingPolicyTester(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._server = FakeServer()
+        await self._server.start()
+        self._policy = cdp.AdaptiveThrottlingPolicy(heaviest_share=0.5, ramp_interval=0)
+        self._client = cdp.AsyncClient(port=self._server.port, auto_reconnect=False, throttling_policy=self._policy)
+        self._client.start()
+        self._value = await asyncio.wait_for(self._client.find_node('App1.Comp1.Value1'), 5)
+        self._int = await asyncio.wait_for(self._client.find_node('App1.Comp1.Int1'), 5)
+        self._streams = [self._value.values(fs=8), self._int.values(fs=4, sample_rate=2)]
+        await self._server.wait_for_request(proto.Container.eGetterRequest, is_value_request(7, 4, 2))
+        del self._server.requests[:]
+
+    async def asyncTearDown(self):
+        for stream in self._streams:
+            stream.close()
+        await asyncio.wait_for(self._client.disconnect(), 5)
+        await self._server.stop()
+
+    async def test_heaviest_subscription_is_lowered_and_restored(self):
+        await self._server.send(create_throttling_error(proto.eVALUE_THROTTLING_OCCURRING))
+        await self._server.wait_for_request(proto.Container.eGetterRequest, is_value_request(5, 4, 4))
+        self.assertEqual(self._policy.scale(self._value._node), 0.5)
+        self.assertEqual(self._policy.scale(self._int._node), 1.0)
+        self.assertEqual(self._client.throttling_stats().occurrences, 1)
+
+        await self._server.send(create_throttling_error(proto.eVALUE_THROTTLING_STOPPED))
+        for value in range(5):
+            await self._server.send(fake_data.create_value_response(5, [value]))
+        await self._server.wait_for_request(proto.Container.eGetterRequest, is_value_request(5, 8, 0))
+        self.assertEqual(self._policy.scale(self._value._node), 1.0)
+        self.assertFalse(self._client.throttling_stats().is_throttling)
+
+    async def test_reported_node_is_lowered(self):
+        await self._server.send(create_throttling_error(proto.eVALUE_THROTTLING_OCCURRING, 7))
+        await self._server.wait_for_request(proto.Container.eGetterRequest, is_value_request(7, 2, 1))
+        self.assertEqual(self._policy.scale(self._value._node), 1.0)
+        self.assertEqual(self._client.throttling_stats().by_node, {self._int._node: 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
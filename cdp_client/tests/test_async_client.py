@@ -0,0 +1,85 @@
+from cdp_client import cdp
+from cdp_client import cdp_pb2 as proto
+from cdp_client.tests import fake_data
+from cdp_client.tests.fake_server import FakeServer
+import asyncio
+import unittest
+
+
+@unittest.skipIf(cdp.websockets is None, 'websockets is not installed')
+class AsyncClientTester(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._server = FakeServer()
+        await self._server.start()
+        self._client = cdp.AsyncClient(port=self._server.port, auto_reconnect=False)
+        self._client.start()
+
+    async def asyncTearDown(self):
+        await asyncio.wait_for(self._client.disconnect(), 5)
+        await self._server.stop()
+
+    async def test_root_node(self):
+        node = await asyncio.wait_for(self._client.root_node(), 5)
+        self.assertIsInstance(node, cdp.AsyncNode)
+        self.assertEqual(node.name(), 'App1')
+        self.assertEqual(node.type(), cdp.NodeType.APPLICATION)
+
+    async def test_find_node_child_and_children(self):
+        node = await asyncio.wait_for(self._client.find_node('App1.Comp1.Value1'), 5)
+        self.assertEqual(node.path(), 'App1.Comp1.Value1')
+        self.assertEqual(node.parent(), await node.parent().parent().child('Comp1'))
+        children = await node.parent().children()
+        self.assertEqual([c.name() for c in children], ['Value1', 'Int1'])
+        with self.assertRaises(cdp.NotFoundError):
+            await node.parent().child('Missing')
+
+    async def test_value_stream(self):
+        node = await asyncio.wait_for(self._client.find_node('App1.Comp1.Value1'), 5)
+        async with node.values(fs=10) as values:
+            request = await self._server.wait_for_request(proto.Container.eGetterRequest)
+            self.assertEqual((request.getter_request[0].node_id, request.getter_request[0].fs), (5, 10))
+            await self._server.send(fake_data.create_value_response(5, [1, 2]))
+            self.assertEqual((await asyncio.wait_for(values.__anext__(), 5))[0], 1)
+            self.assertEqual((await asyncio.wait_for(values.__anext__(), 5))[0], 2)
+        request = await self._server.wait_for_request(proto.Container.eGetterRequest,
+                                                      lambda request: request.getter_request[0].stop)
+        self.assertEqual(request.getter_request[0].node_id, 5)
+
+    async def test_full_stream_drops_oldest_values_without_holding_back_others(self):
+        node = await asyncio.wait_for(self._client.find_node('App1.Comp1.Value1'), 5)
+        values = node.values(maxsize=2)
+        await self._server.wait_for_request(proto.Container.eGetterRequest)
+        for value in range(5):
+            await self._server.send(fake_data.create_value_response(5, [value]))
+        await asyncio.sleep(0.1)
+        self.assertEqual((values.qsize(), values.dropped()), (2, 3))
+
+        root = await asyncio.wait_for(self._client.root_node(), 5)
+        self.assertEqual((await asyncio.wait_for(root.child('Comp1'), 5)).name(), 'Comp1')
+        async with node.values(maxsize=2, overflow_policy=cdp.OverflowPolicy.CONFLATE) as latest:
+            await self._server.send(fake_data.create_value_response(5, [5, 6, 7]))
+            self.assertEqual((await asyncio.wait_for(latest.__anext__(), 5))[0], 7)
+            self.assertEqual(latest.dropped(), 2)
+        self.assertEqual([(await values.__anext__())[0] for _ in range(2)], [6, 7])
+
+    def test_stream_does_not_support_blocking(self):
+        with self.assertRaises(ValueError):
+            cdp.AsyncStream(self._client._connection, lambda: None, 2, cdp.OverflowPolicy.BLOCK)
+
+    async def test_event_stream(self):
+        node = await asyncio.wait_for(self._client.root_node(), 5)
+        events = node.events()
+        await self._server.wait_for_request(proto.Container.eEventRequest)
+        await self._server.send(fake_data.create_event_response(fake_data.event_info1))
+        event = await asyncio.wait_for(events.__anext__(), 5)
+        self.assertEqual(event.id, fake_data.event_info1.id)
+
+    async def test_disconnect_ends_streams(self):
+        node = await asyncio.wait_for(self._client.find_node('App1.Comp1.Value1'), 5)
+        values = node.values()
+        await self._client.disconnect()
+        self.assertEqual([value async for value in values], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
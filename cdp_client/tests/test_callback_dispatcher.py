@@ -0,0 +1,100 @@
+from cdp_client import cdp
+from cdp_client.tests import fake_data
+import threading
+import unittest
+
+
+class CallbackDispatcherTester(unittest.TestCase):
+    def __init__(self, method_name):
+        unittest.TestCase.__init__(self, method_name)
+        self._connection = None
+
+    def setUp(self):
+        self._connection = cdp.Connection("foo", "bar", False)
+        self._node = cdp.Node(None, self._connection, fake_data.value1_node)
+        self._received = []
+        self._first_call_started = threading.Event()
+        self._release = threading.Event()
+
+    def tearDown(self):
+        self._release.set()
+        del self._connection
+        del self._node
+
+    def blocking_callback(self, value):
+        self._first_call_started.set()
+        self._release.wait(5)
+        self._received.append(value)
+
+    def dispatch_while_first_call_blocks(self, dispatcher, values):
+        dispatcher.dispatch(self._node, self.blocking_callback, (values[0],))
+        self.assertTrue(self._first_call_started.wait(5))
+        for value in values[1:]:
+            dispatcher.dispatch(self._node, self.blocking_callback, (value,))
+
+    def test_calls_are_ordered_per_node_and_callback(self):
+        dispatcher = cdp.CallbackDispatcher(workers=4)
+        nodes = [cdp.Node(None, self._connection, fake_data.value1_node) for _ in range(3)]
+        received = dict((node, []) for node in nodes)
+        threads = set()
+
+        def on_value(node, value):
+            threads.add(threading.current_thread())
+            received[node].append(value)
+
+        for value in range(200):
+            for node in nodes:
+                dispatcher.dispatch(node, on_value, (node, value))
+        dispatcher.close(5)
+        for node in nodes:
+            self.assertEqual(received[node], list(range(200)))
+        self.assertNotIn(threading.current_thread(), threads)
+        self.assertEqual(dispatcher.stats(), (0, 0))
+
+    def test_drop_oldest(self):
+        dispatcher = cdp.CallbackDispatcher(workers=1, maxsize=2, overflow_policy=cdp.OverflowPolicy.DROP_OLDEST)
+        self.dispatch_while_first_call_blocks(dispatcher, [1, 2, 3, 4, 5])
+        self.assertEqual(dispatcher.stats(), (2, 2))
+        self.assertEqual(dispatcher.stats(self._node), (2, 2))
+        self._release.set()
+        dispatcher.close(5)
+        self.assertEqual(self._received, [1, 4, 5])
+
+    def test_conflate(self):
+        dispatcher = cdp.CallbackDispatcher(workers=1, maxsize=2, overflow_policy=cdp.OverflowPolicy.CONFLATE)
+        self.dispatch_while_first_call_blocks(dispatcher, [1, 2, 3, 4])
+        self.assertEqual(dispatcher.stats(), (1, 2))
+        self._release.set()
+        dispatcher.close(5)
+        self.assertEqual(self._received, [1, 4])
+
+    def test_raise_is_not_supported(self):
+        with self.assertRaises(ValueError):
+            cdp.CallbackDispatcher(overflow_policy=cdp.OverflowPolicy.RAISE)
+
+    def test_block(self):
+        dispatcher = cdp.CallbackDispatcher(workers=1, maxsize=2, overflow_policy=cdp.OverflowPolicy.BLOCK)
+        self.dispatch_while_first_call_blocks(dispatcher, [1, 2, 3])
+        thread = threading.Thread(target=dispatcher.dispatch, args=(self._node, self.blocking_callback, (4,)))
+        thread.start()
+        thread.join(0.1)
+        self.assertTrue(thread.is_alive())
+        self._release.set()
+        thread.join(5)
+        dispatcher.close(5)
+        self.assertEqual(self._received, [1, 2, 3, 4])
+        self.assertEqual(dispatcher.stats().dropped, 0)
+
+    def test_node_callbacks_are_dispatched(self):
+        dispatcher = cdp.CallbackDispatcher(workers=1)
+        self._connection._callback_dispatcher = dispatcher
+        threads = []
+        self._node._value_subscriptions += ((lambda value, timestamp: threads.append(threading.current_thread()), 5, 0, None),)
+        self._node._update_value(fake_data.value1)
+        dispatcher.close(5)
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+
+
+if __name__ == '__main__':
+    unittest.main()
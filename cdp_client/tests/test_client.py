@@ -1,4 +1,5 @@
 from cdp_client import cdp
+from cdp_client import cdp_pb2 as proto
 from cdp_client.tests import fake_data
 from promise import Promise
 from copy import copy
@@ -40,6 +41,33 @@ class ClientTester(unittest.TestCase):
         self._client.find_node(path).then(lambda node: nodes.append(node))
         self.assertEqual(nodes[0]._id(), fake_data.value1_node.info.node_id)
 
+    @mock.patch.object(cdp.NodeTree, 'root_node')
+    @mock.patch.object(cdp.Connection, 'send_structure_requests')
+    def test_find_nodes(self, mock_send_structure_requests, mock_root_node):
+        def send_structure_requests(nodes):
+            return [Promise(lambda resolve, reject, node_id=node_id: resolve(structures[node_id])) for node_id, path in nodes]
+
+        results = []
+        comp_node = copy(fake_data.comp1_node)
+        comp_node.node.extend([fake_data.value1_node])
+        app_node = copy(fake_data.app1_node)
+        app_node.node.extend([fake_data.comp1_node, fake_data.app2_node])
+        structures = {comp_node.info.node_id: comp_node, fake_data.app2_node.info.node_id: fake_data.app2_node}
+        mock_root_node.return_value = Promise(lambda resolve, reject: resolve(cdp.Node(None, self._client._connection, app_node)))
+        mock_send_structure_requests.side_effect = send_structure_requests
+        paths = ['App1.Comp1.Value1', 'App1.Comp1', 'App1.App2', 'App1.Missing.Value1', 'App1.Comp1.Missing']
+        self._client.find_nodes(paths).then(lambda nodes: results.append(nodes))
+
+        self.assertEqual(mock_send_structure_requests.call_count, 1)
+        mock_send_structure_requests.assert_called_once_with([(comp_node.info.node_id, 'App1.Comp1'),
+                                                               (fake_data.app2_node.info.node_id, 'App1.App2')])
+        nodes = results[0]
+        self.assertEqual(nodes['App1.Comp1.Value1']._id(), fake_data.value1_node.info.node_id)
+        self.assertEqual(nodes['App1.Comp1']._id(), comp_node.info.node_id)
+        self.assertEqual(nodes['App1.App2']._id(), fake_data.app2_node.info.node_id)
+        self.assertIsInstance(nodes['App1.Missing.Value1'], cdp.NotFoundError)
+        self.assertIsInstance(nodes['App1.Comp1.Missing'], cdp.NotFoundError)
+
     @mock.patch.object(cdp.Connection, 'run_event_loop')
     def test_run_event_loop(self, mock_run_event_loop):
         self._client.run_event_loop()
@@ -49,3 +77,52 @@ class ClientTester(unittest.TestCase):
     def test_disconnect(self, mock_close):
         self._client.disconnect()
         mock_close.assert_called_once_with()
+
+    @mock.patch.object(cdp.Connection, 'send_values')
+    def test_set_values(self, mock_send_values):
+        nodes = [cdp.Node(None, self._client._connection, fake_data.value1_node),
+                 cdp.Node(None, self._client._connection, fake_data.bool_node),
+                 cdp.Node(None, self._client._connection, fake_data.int_node)]
+        self._client.set_values(nodes, [1.5, 1, -7], [10, 20, 30])
+        variants = mock_send_values.call_args[0][0]
+        self.assertEqual(len(variants), 3)
+        by_id = dict((v.node_id, v) for v in variants)
+        self.assertEqual(by_id[fake_data.value1_node.info.node_id].d_value, 1.5)
+        self.assertEqual(by_id[fake_data.value1_node.info.node_id].timestamp, 10)
+        self.assertEqual(by_id[fake_data.bool_node.info.node_id].b_value, True)
+        self.assertEqual(by_id[fake_data.int_node.info.node_id].i_value, -7)
+        self.assertEqual(by_id[fake_data.int_node.info.node_id].timestamp, 30)
+
+    @mock.patch.object(cdp.Connection, 'send_values')
+    def test_set_values_validates_before_sending(self, mock_send_values):
+        nodes = [cdp.Node(None, self._client._connection, fake_data.value1_node),
+                 cdp.Node(None, self._client._connection, fake_data.int_node)]
+        self.assertRaises(ValueError, self._client.set_values, nodes, [1.0, 2 ** 40])
+        self.assertRaises(ValueError, self._client.set_values, nodes, [1.0, 'foo'])
+        self.assertRaises(ValueError, self._client.set_values, nodes, [1.0])
+        self.assertRaises(ValueError, self._client.set_values,
+                          [cdp.Node(None, self._client._connection, fake_data.comp1_node)], [1])
+        mock_send_values.assert_not_called()
+
+    @unittest.skipIf(cdp.numpy is None, 'numpy is not installed')
+    @mock.patch.object(cdp.Connection, 'send_values')
+    def test_set_values_from_numpy_arrays(self, mock_send_values):
+        nodes = [cdp.Node(None, self._client._connection, fake_data.value1_node),
+                 cdp.Node(None, self._client._connection, fake_data.int_node)]
+        self._client.set_values(nodes, cdp.numpy.array([1.5, 3.0]), cdp.numpy.array([10, 20]))
+        variants = mock_send_values.call_args[0][0]
+        self.assertEqual([(v.node_id, v.d_value, v.i_value, v.timestamp) for v in variants],
+                         [(fake_data.value1_node.info.node_id, 1.5, 0, 10), (fake_data.int_node.info.node_id, 0, 3, 20)])
+        mock_send_values.reset_mock()
+        self.assertRaises(ValueError, self._client.set_values, nodes, cdp.numpy.array([1.5, cdp.numpy.nan]))
+        self.assertRaises(ValueError, self._client.set_values, nodes, cdp.numpy.array([1.5, 2.0 ** 40]))
+        mock_send_values.assert_not_called()
+
+    @unittest.skipIf(cdp.numpy is None, 'numpy is not installed')
+    @mock.patch.object(cdp.Connection, 'send_values')
+    def test_set_values_of_string_nodes_from_numeric_numpy_array(self, mock_send_values):
+        string_node = proto.Node()
+        string_node.CopyFrom(fake_data.int_node)
+        string_node.info.value_type = proto.eSTRING
+        self._client.set_values([cdp.Node(None, self._client._connection, string_node)], cdp.numpy.array([1.5]))
+        self.assertEqual([v.str_value for v in mock_send_values.call_args[0][0]], ['1.5'])
@@ -0,0 +1,37 @@
+from cdp_client import cdp
+import unittest
+
+
+class ClockOffsetEstimatorTester(unittest.TestCase):
+    def test_no_samples(self):
+        estimator = cdp.ClockOffsetEstimator()
+        self.assertEqual(estimator.estimate(), (0.0, 0.0, None))
+
+    def test_long_round_trips_are_ignored(self):
+        estimator = cdp.ClockOffsetEstimator(window=4)
+        for sent, received, server_time in [(0, 0.2, 10), (1, 1.01, 1.005), (2, 2.4, 12), (3, 3.01, 3.005)]:
+            estimator.add_sample(sent, received, server_time)
+        offset, drift, uncertainty = estimator.estimate()
+        self.assertAlmostEqual(offset, 0)
+        self.assertEqual(drift, 0)
+        self.assertAlmostEqual(uncertainty, 0.005)
+
+    def test_drift_is_fitted_over_intervals(self):
+        estimator = cdp.ClockOffsetEstimator(interval=5, rtt_share=1)
+        for local_time in range(0, 60, 5):
+            estimator.add_sample(local_time, local_time, local_time - 0.5 - local_time * 0.001)
+        offset, drift, uncertainty = estimator.estimate(at=100)
+        self.assertAlmostEqual(drift, 0.001)
+        self.assertAlmostEqual(offset, 0.6)
+        self.assertAlmostEqual(uncertainty, 0)
+        self.assertAlmostEqual(estimator.offset(200), 0.7)
+
+    def test_burst_does_not_estimate_drift(self):
+        estimator = cdp.ClockOffsetEstimator(rtt_share=1)
+        estimator.add_sample(0, 0.001, -1)
+        estimator.add_sample(0.001, 0.002, -1.0005)
+        self.assertEqual(estimator.estimate().drift, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
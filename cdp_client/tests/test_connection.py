@@ -1,6 +1,8 @@
 from cdp_client import cdp
 from cdp_client.tests import fake_data
+from cdp_client.tests.fake_server import create_system_structure
 from collections import namedtuple
+import threading
 import unittest
 import mock
 
@@ -64,6 +66,27 @@ class ConnectionTester(unittest.TestCase):
         self.assertTrue(mock_add.called)
         mock_send.assert_any_call(fake_data.create_structure_request().SerializeToString())
 
+    @mock.patch.object(cdp.websocket.WebSocketApp, 'send')
+    def test_sending_batched_structure_requests(self, mock_send):
+        self._connection._is_connected = True
+        promises = self._connection.send_structure_requests([(1, 'foo.a'), (2, 'foo.b')])
+        self.assertEqual(len(promises), 2)
+        self.assertEqual(len(self._connection._structure_requests.get()), 2)
+        request = fake_data.create_structure_request(1)
+        request.structure_request.append(2)
+        mock_send.assert_any_call(request.SerializeToString())
+
+    def test_structure_requests_added_from_many_threads(self):
+        threads = [threading.Thread(target=lambda: [self._connection.send_structure_request(i, 'foo.' + str(i))
+                                                    for i in range(50)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        requests = self._connection._structure_requests.get()
+        self.assertEqual(sorted(r.node_path for r in requests), sorted('foo.' + str(i) for i in range(50)))
+        self.assertTrue(all(len(r.promises) == 4 for r in requests))
+
     @mock.patch.object(cdp.websocket.WebSocketApp, 'send')
     def test_sending_value_request(self, mock_send):
         node_id = 1
@@ -99,6 +122,44 @@ class ConnectionTester(unittest.TestCase):
         self._connection._handle_hello_message(fake_data.create_valid_hello_response().SerializeToString())
         self.assertTrue(self._connection._is_connected)
 
+    @mock.patch.object(cdp.websocket.WebSocketApp, 'send')
+    def test_handshake_sends_time_and_queued_structure_requests_together(self, mock_send):
+        self._connection.node_tree().root_node()
+        self.assertFalse(mock_send.called)
+
+        self._connection._handle_hello_message(fake_data.create_valid_hello_response().SerializeToString())
+        sent = [call[0][0] for call in mock_send.call_args_list]
+        self.assertEqual(sent, [fake_data.create_time_request().SerializeToString(),
+                                fake_data.create_structure_request().SerializeToString()])
+        timings = self._connection.handshake_timings()
+        self.assertIsNotNone(timings.hello)
+        self.assertGreaterEqual(timings.auth, timings.hello)
+        self.assertIsNone(timings.first_structure)
+
+        self._connection._handle_container_message(fake_data.create_system_structure_response().SerializeToString())
+        self.assertEqual(self._connection._handshake_state, cdp.HandshakeState.READY)
+        self.assertGreaterEqual(self._connection.handshake_timings().first_structure, timings.auth)
+        self.assertIsNone(self._connection.handshake_timings().first_value)
+
+        with mock.patch.object(cdp.NodeTree, 'find_by_id') as mock_find_by_id:
+            mock_find_by_id.return_value = cdp.Node(None, self._connection, fake_data.value1_node)
+            self._connection._handle_container_message(fake_data.create_value_response().SerializeToString())
+        self.assertIsNotNone(self._connection.handshake_timings().first_value)
+
+    @mock.patch.object(cdp.websocket.WebSocketApp, 'send')
+    def test_system_structure_is_requested_once_on_reconnect(self, mock_send):
+        self._connection.node_tree().root_node()
+        self._connection._handle_hello_message(fake_data.create_valid_hello_response().SerializeToString())
+        self._connection._handle_container_message(fake_data.create_system_structure_response().SerializeToString())
+        self._connection._on_close(self._connection._ws)
+        self._connection._ws = self._connection._connect(self._connection._ws.url)
+        self.assertEqual(self._connection.handshake_timings(), (None, None, None, None))
+        mock_send.reset_mock()
+
+        self._connection._handle_hello_message(fake_data.create_valid_hello_response().SerializeToString())
+        sent = [call[0][0] for call in mock_send.call_args_list]
+        self.assertEqual(sent.count(fake_data.create_structure_request().SerializeToString()), 1)
+
     def test_connected_state_is_unset_when_receiving_hello_message_with_incorrect_version(self):
         self.assertFalse(self._connection._is_connected)
         self._connection._handle_hello_message(fake_data.create_invalid_hello_response().SerializeToString())
@@ -113,6 +174,21 @@ class ConnectionTester(unittest.TestCase):
         self._connection._handle_container_message(response.SerializeToString())
         mock_update_value.assert_called_once_with(response.getter_response[0])
 
+    @unittest.skipIf(cdp.numpy is None, 'numpy is not installed')
+    @mock.patch.object(cdp.NodeTree, 'find_by_id')
+    @mock.patch.object(cdp.Node, '_update_value_batch')
+    @mock.patch.object(cdp.Node, '_update_value')
+    def test_node_batch_updated_once_per_message(self, mock_update_value, mock_update_value_batch, mock_find_by_id):
+        self._connection._is_connected = True
+        node = cdp.Node(None, self._connection, fake_data.value1_node)
+        node._value_batch_subscriptions += ((lambda values, timestamps: None, 5, 0, None),)
+        mock_find_by_id.return_value = node
+        response = fake_data.create_value_response()
+        response.getter_response.extend([fake_data.value2])
+        self._connection._handle_container_message(response.SerializeToString())
+        mock_update_value.assert_not_called()
+        mock_update_value_batch.assert_called_once_with([response.getter_response[0], response.getter_response[1]])
+
     @mock.patch.object(cdp.NodeTree, 'find_by_id')
     @mock.patch.object(cdp.websocket.WebSocketApp, 'send')
     def test_node_structure_requested_when_node_structure_change_received(self, mock_send, mock_find_by_id):
@@ -123,48 +199,105 @@ class ConnectionTester(unittest.TestCase):
         self._connection._handle_container_message(response.SerializeToString())
         mock_send.assert_any_call(request.SerializeToString())
 
+    @mock.patch.object(cdp.NodeTree, 'find_by_id')
+    @mock.patch.object(cdp.NodeTree, 'update_changed')
+    def test_node_structure_invalidated_when_node_structure_change_received(self, mock_update_changed, mock_find_by_id):
+        node = cdp.Node(None, self._connection, fake_data.app1_node)
+        node._is_structure_valid = True
+        mock_find_by_id.return_value = node
+        response = fake_data.create_structure_change_response(fake_data.app1_node.info.node_id)
+        self._connection._handle_container_message(response.SerializeToString())
+        self.assertFalse(node._is_structure_valid)
+        mock_update_changed.assert_called_once_with([node])
+
+    @mock.patch.object(cdp.Connection, '_call_later')
+    @mock.patch.object(cdp.websocket.WebSocketApp, 'send')
+    def test_structure_change_burst_refetched_in_one_request(self, mock_send, mock_call_later):
+        self._connection._is_connected = True
+        self._connection._structure_change_window = 0.1
+        app = cdp.Node(None, self._connection, create_system_structure().node[0])
+        self._connection.node_tree()._root_node = app
+        comp = app._find_child('Comp1')
+        added = []
+        comp.subscribe_to_structure_changes(lambda added_nodes, removed_nodes: added.append(added_nodes))
+        for node_id in (9, 1, 9, 5, 7):
+            response = fake_data.create_structure_change_response(node_id)
+            self._connection._handle_container_message(response.SerializeToString())
+        mock_send.assert_not_called()
+        mock_call_later.assert_called_once_with(0.1, self._connection._update_changed_nodes)
+
+        self._connection._update_changed_nodes()
+        request = cdp.proto.Container()
+        request.ParseFromString(mock_send.call_args[0][0])
+        self.assertEqual(list(request.structure_request), [1, 9])  # the leaves are absorbed by Comp1
+
+        structures = create_system_structure().node[0]
+        structures.node[0].node.add().info.CopyFrom(fake_data.bool_node.info)
+        response = cdp.proto.Container()
+        response.message_type = cdp.proto.Container.eStructureResponse
+        response.structure_response.extend([structures, structures.node[0]])
+        self._connection._handle_container_message(response.SerializeToString())
+        self.assertEqual([[node.name() for node in nodes] for nodes in added], [['Bool1']])
+
     @mock.patch.object(cdp.Requests, 'clear')
     def test_requests_cleared_when_error_received(self, mock_clear):
         self._connection._handle_container_message(fake_data.create_error_response().SerializeToString())
         self.assertTrue(mock_clear.called)
 
+    def test_value_throttling_reported(self):
+        node = cdp.Node(None, self._connection, fake_data.value1_node)
+        self._connection.node_tree()._root_node = node
+        listener = mock.Mock(spec=cdp.NotificationListener)
+        self._connection._notification_listener = listener
+        error = fake_data.create_error_response()
+        error.error.code = cdp.proto.eVALUE_THROTTLING_OCCURRING
+        error.error.node_id = node._id()
+        self._connection._handle_container_message(error.SerializeToString())
+        listener.value_throttling_changed.assert_called_once_with(True, node)
+        self.assertEqual(self._connection.throttling_stats(), (True, 1, {node: 1}))
+
+        error.error.code = cdp.proto.eVALUE_THROTTLING_STOPPED
+        error.error.ClearField('node_id')
+        self._connection._handle_container_message(error.SerializeToString())
+        listener.value_throttling_changed.assert_called_with(False, None)
+        self.assertEqual(self._connection.throttling_stats(), (False, 1, {node: 1}))
+
+    @mock.patch.object(cdp.Connection, '_call_later')
     @mock.patch.object(cdp.websocket.WebSocketApp, 'send')
     @mock.patch.object(cdp.time, 'time')
-    def _test_time_difference_udpate(self, mock_time, mock_send):
-        def side_effect(*args, **kwargs):
-            nsec_in_sec = 1000000000
+    def test_clock_is_sampled_in_background(self, mock_time, mock_send, mock_call_later):
+        def side_effect(message):
             sample = samples.pop(0)
-            mock_time.side_effect = [initial_time + sample.ping, initial_time]
-            self._connection._handle_container_message(fake_data.create_time_response(sample.diff * nsec_in_sec).SerializeToString())
+            now[0] += sample.ping
+            self._connection._handle_container_message(fake_data.create_time_response(sample.server_time * nsec_in_sec)
+                                                       .SerializeToString())
 
-        initial_time = 10
-        mock_time.return_value = initial_time
+        nsec_in_sec = 1000000000
+        now = [10]
+        mock_time.side_effect = lambda: now[0]
         mock_send.side_effect = side_effect
-        samples = []
-
-        Sample = namedtuple('Sample', 'ping, diff')
-        samples.append(Sample(20, 100))
-        samples.append(Sample(10, 200)) #this should be selected as it has the best ping
-        samples.append(Sample(30, 300))
+        Sample = namedtuple('Sample', 'ping, server_time')
+        samples = [Sample(2, 100), Sample(1, 200), Sample(3, 300)]  # the shortest round trip is used
 
-        self._connection._update_time_difference()
+        self._connection._is_connected = True
+        self._connection._start_clock_sampling()
         request = fake_data.create_time_request().SerializeToString()
         mock_send.assert_has_calls([mock.call(request), mock.call(request), mock.call(request)])
-        self.assertEqual(self._connection.server_time_difference(), -185.0)
+        self.assertEqual(self._connection.server_time_difference(), -187.5)
+        self.assertEqual(self._connection.clock_offset(), (-187.5, 0.0, 0.5))
+        mock_call_later.assert_called_once_with(self._connection._clock_estimator.interval, mock.ANY)
 
-    @mock.patch.object(cdp.websocket.WebSocketApp, 'send')
-    @mock.patch.object(cdp.time, 'time')
-    def test_time_difference_udpate_frequency(self, mock_time, mock_send):
-        def side_effect(*args, **kwargs):
-            self._connection._handle_container_message(fake_data.create_time_response(1).SerializeToString())
+        samples.append(Sample(1, 201))
+        mock_call_later.call_args[0][1]()
+        self.assertEqual(mock_send.call_count, 4)
 
-        mock_time.return_value = 10
-        mock_send.side_effect = side_effect
-        self._connection._update_time_difference()
-        self.assertTrue(mock_send.called)
-        mock_send.reset_mock()
-        self._connection._update_time_difference()
-        self.assertFalse(mock_send.called)
+    @mock.patch.object(cdp.websocket.WebSocketApp, 'send')
+    def test_sending_does_not_sample_clock(self, mock_send):
+        self._connection._is_connected = True
+        self._connection.send_value_request(1, 5, 0)
+        self._connection.send_event_request(1)
+        self.assertEqual(mock_send.call_count, 2)
+        self.assertNotIn(mock.call(fake_data.create_time_request().SerializeToString()), mock_send.call_args_list)
 
     @mock.patch.object(cdp.websocket.WebSocketApp, 'send')
     def test_accept_request_is_sent_when_hello_is_received(self, mock_send):
@@ -277,8 +410,7 @@ class ConnectionTester(unittest.TestCase):
         self.assertFalse(self._connection._is_connected)
 
     @mock.patch.object(cdp.websocket.WebSocketApp, 'send')
-    @mock.patch.object(cdp.Connection, '_update_time_difference')
-    def test_sending_event_request(self, mock_time_update, mock_send):
+    def test_sending_event_request(self, mock_send):
         node_id = 1
         self._connection.send_event_request(node_id)
         expected_msg = fake_data.create_event_request(node_id).SerializeToString()
@@ -289,8 +421,7 @@ class ConnectionTester(unittest.TestCase):
         self.assertEqual(len(calls), 1)
 
     @mock.patch.object(cdp.websocket.WebSocketApp, 'send')
-    @mock.patch.object(cdp.Connection, '_update_time_difference')
-    def test_sending_event_unrequest(self, mock_time_update, mock_send):
+    def test_sending_event_unrequest(self, mock_send):
         node_id = 1
         self._connection.send_event_unrequest(node_id)
         mock_send.assert_any_call(fake_data.create_event_unrequest(node_id).SerializeToString())
@@ -303,3 +434,38 @@ class ConnectionTester(unittest.TestCase):
         response = fake_data.create_event_response(fake_data.event_info1)
         self._connection._handle_container_message(response.SerializeToString())
         mock_update_event.assert_called_once_with(response.event_response[0])
+
+    @mock.patch.object(cdp.websocket.WebSocketApp, 'send')
+    def test_sending_structure_requests_in_size_bounded_messages(self, mock_send):
+        self._connection._is_connected = True
+        self._connection._max_message_size = 50
+        node_ids = list(range(1000, 1030))
+        self._connection.send_structure_requests([(node_id, 'foo.' + str(node_id)) for node_id in node_ids])
+        self.assertTrue(mock_send.call_count > 1)
+        sent = []
+        for call in mock_send.call_args_list:
+            container = cdp.proto.Container()
+            container.ParseFromString(call[0][0])
+            self.assertTrue(container.ByteSize() <= 50)
+            sent.extend(container.structure_request)
+        self.assertEqual(sent, node_ids)
+
+    @mock.patch.object(cdp.websocket.WebSocketApp, 'send')
+    def test_sending_values_in_size_bounded_messages(self, mock_send):
+        self._connection._max_message_size = 50
+        variants = []
+        for node_id in range(10):
+            variant = cdp.proto.VariantValue()
+            variant.node_id = node_id
+            variant.d_value = node_id
+            variants.append(variant)
+        self._connection.send_values(variants)
+        self.assertTrue(mock_send.call_count > 1)
+        sent = []
+        for call in mock_send.call_args_list:
+            container = cdp.proto.Container()
+            container.ParseFromString(call[0][0])
+            self.assertEqual(container.message_type, cdp.proto.Container.eSetterRequest)
+            self.assertTrue(container.ByteSize() <= 50)
+            sent.extend(container.setter_request)
+        self.assertEqual(sent, variants)
@@ -0,0 +1,90 @@
+from cdp_client import cdp
+from cdp_client import cdp_pb2 as proto
+from cdp_client.tests import fake_data
+import threading
+import unittest
+import mock
+
+
+def create_value_response(values):
+    response = proto.Container()
+    response.message_type = proto.Container.eGetterResponse
+    for i, value in enumerate(values):
+        variant = response.getter_response.add()
+        variant.node_id = fake_data.value1_node.info.node_id
+        variant.d_value = value
+        variant.timestamp = i + 1
+    return response
+
+
+class LatestValuesTester(unittest.TestCase):
+    def __init__(self, method_name):
+        unittest.TestCase.__init__(self, method_name)
+        self._client = None
+
+    def setUp(self):
+        self._client = cdp.Client("foo")
+        self._connection = self._client._connection
+        self._node = cdp.Node(None, self._connection, fake_data.value1_node)
+        self._connection.node_tree()._root_node = self._node
+
+    def tearDown(self):
+        del self._client
+        del self._connection
+        del self._node
+
+    @mock.patch.object(cdp.Connection, 'send_value_request')
+    def test_drain_returns_latest_value_once(self, mock_send_value_request):
+        self._node.subscribe_to_latest_value(10, 2)
+        mock_send_value_request.assert_called_once_with(self._node._id(), 10, 2)
+        self._connection._handle_container_message(create_value_response([1, 2]).SerializeToString())
+        self._connection._handle_container_message(create_value_response([3, 4]).SerializeToString())
+
+        changed = self._client.drain_changed()
+        self.assertEqual(list(changed), [self._node])
+        self.assertEqual(changed[self._node], (4, 2))
+        self.assertEqual(self._node.last_value(), 4)
+        self.assertEqual(self._client.drain_changed(), {})
+
+    @mock.patch.object(cdp.Connection, 'send_value_request')
+    def test_other_subscriptions_get_every_value(self, mock_send_value_request):
+        values = []
+        self._node.subscribe_to_latest_value()
+        self._node.subscribe_to_value_changes(lambda value, timestamp: values.append(value))
+        self._connection._handle_container_message(create_value_response([1, 2, 3]).SerializeToString())
+        self.assertEqual(values, [1, 2, 3])
+        self.assertEqual(self._client.drain_changed()[self._node][0], 3)
+
+    @mock.patch.object(cdp.Connection, 'send_value_unrequest')
+    @mock.patch.object(cdp.Connection, 'send_value_request')
+    def test_unsubscribe(self, mock_send_value_request, mock_send_value_unrequest):
+        self._node.subscribe_to_latest_value()
+        self._connection._handle_container_message(create_value_response([1]).SerializeToString())
+        self._node.unsubscribe_from_latest_value()
+        mock_send_value_unrequest.assert_called_once_with(self._node._id())
+        self.assertEqual(self._client.drain_changed(), {})
+
+    @mock.patch.object(cdp.Connection, 'send_value_request')
+    def test_callback_is_rate_limited(self, mock_send_value_request):
+        calls = []
+        called = threading.Event()
+
+        def on_changed(changed):
+            calls.append(changed[self._node][0])
+            called.set()
+
+        self._node.subscribe_to_latest_value()
+        self._client.subscribe_to_latest_values(on_changed, interval=0.2)
+        self._connection._handle_container_message(create_value_response([1]).SerializeToString())
+        self.assertTrue(called.wait(5))
+        called.clear()
+        self._connection._handle_container_message(create_value_response([2]).SerializeToString())
+        self._connection._handle_container_message(create_value_response([3]).SerializeToString())
+        self.assertFalse(called.wait(0.05))
+        self.assertTrue(called.wait(5))
+        self.assertEqual(calls, [1, 3])
+        self._client.unsubscribe_from_latest_values(on_changed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+from cdp_client import cdp
+from cdp_client import cdp_pb2 as proto
+from cdp_client.tests import fake_data
+import time
+import unittest
+import mock
+
+
+@mock.patch.object(cdp.websocket.WebSocketApp, 'send')
+@mock.patch.object(cdp.Connection, '_schedule_flush')
+class MessageCoalescerTester(unittest.TestCase):
+    def __init__(self, method_name):
+        unittest.TestCase.__init__(self, method_name)
+        self._connection = None
+
+    def setUp(self):
+        self._coalescer = cdp.MessageCoalescer(max_delay=0.001, max_size=1000)
+        self._connection = cdp.Connection("foo", "bar", False, message_coalescer=self._coalescer)
+
+    def tearDown(self):
+        del self._connection
+        del self._coalescer
+
+    def test_requests_are_merged_per_type_until_delay_has_passed(self, mock_schedule_flush, mock_send):
+        for node_id in (1, 2, 3):
+            self._connection.send_value_request(node_id, 5, 0)
+        self._connection.send_event_request(4)
+        self.assertFalse(mock_send.called)
+        mock_schedule_flush.assert_called_once_with(self._coalescer)
+
+        self._coalescer._flush(self._connection)
+        containers = fake_data.sent_containers(mock_send)
+        self.assertEqual([c.message_type for c in containers],
+                         [proto.Container.eGetterRequest, proto.Container.eEventRequest])
+        self.assertEqual([r.node_id for r in containers[0].getter_request], [1, 2, 3])
+        self.assertEqual([r.node_id for r in containers[1].event_request], [4])
+        stats = self._connection.outbound_stats()
+        self.assertEqual((stats.messages, stats.frames), (4, 2))
+        self.assertEqual(stats.bytes_per_frame, sum(len(call[0][0]) for call in mock_send.call_args_list) / 2.0)
+
+    def test_requests_are_sent_when_size_is_reached(self, mock_schedule_flush, mock_send):
+        self._coalescer.max_size = 20
+        for node_id in range(1, 6):
+            self._connection.send_value_request(node_id, 5, 0)
+        self.assertTrue(mock_send.call_count > 1)
+        for container in fake_data.sent_containers(mock_send):
+            self.assertTrue(container.ByteSize() <= 20)
+        self._connection.flush()
+        node_ids = [r.node_id for c in fake_data.sent_containers(mock_send) for r in c.getter_request]
+        self.assertEqual(node_ids, [1, 2, 3, 4, 5])
+
+    def test_other_messages_are_sent_after_held_requests(self, mock_schedule_flush, mock_send):
+        self._connection.send_value_request(1, 5, 2)
+        self._connection._compose_and_send_structure_request(None)
+        self.assertEqual(mock_send.call_args_list,
+                         [mock.call(fake_data.create_value_request(1, 5, 2).SerializeToString()),
+                          mock.call(fake_data.create_structure_request().SerializeToString())])
+
+    @mock.patch.object(cdp.websocket.WebSocketApp, 'close')
+    def test_held_requests_are_sent_before_closing(self, mock_close, mock_schedule_flush, mock_send):
+        order = []
+        mock_send.side_effect = lambda message: order.append('send')
+        mock_close.side_effect = lambda: order.append('close')
+        self._connection.send_value(fake_data.value1)
+        self._connection.close()
+        self.assertEqual(order, ['send', 'close'])
+        mock_send.assert_called_once_with(fake_data.create_setter_request(fake_data.value1).SerializeToString())
+
+    def test_flusher_thread_sends_held_requests_of_every_window(self, mock_schedule_flush, mock_send):
+        mock_schedule_flush.side_effect = lambda coalescer: coalescer._wake_flusher(self._connection)
+        for node_id in (1, 2):
+            self._connection.send_value_request(node_id, 5, 2)
+            deadline = time.time() + 5
+            while mock_send.call_count < node_id and time.time() < deadline:
+                time.sleep(0.001)
+            self.assertEqual(mock_send.call_count, node_id)
+        flusher = self._coalescer._flusher
+        self.assertTrue(flusher.is_alive())
+        self._connection.send_value_request(3, 5, 2)
+        self.assertIs(self._coalescer._flusher, flusher)
+
+    def test_requests_are_held_per_connection(self, mock_schedule_flush, mock_send):
+        other = cdp.Connection("foo", "bar", False, message_coalescer=self._coalescer)
+        with mock.patch.object(self._connection._ws, 'send') as mock_send_first, \
+                mock.patch.object(other._ws, 'send') as mock_send_other:
+            self._connection.send_value_request(1, 5, 2)
+            other.send_value_request(2, 5, 2)
+            other.send_value(fake_data.value1)
+            self._coalescer._flush(self._connection)
+            self.assertEqual([[r.node_id for r in c.getter_request] for c in fake_data.sent_containers(mock_send_first)],
+                             [[1]])
+            self.assertFalse(mock_send_other.called)
+            self._coalescer._flush(other)
+            self.assertEqual([c.message_type for c in fake_data.sent_containers(mock_send_other)],
+                             [proto.Container.eGetterRequest, proto.Container.eSetterRequest])
+            self.assertEqual(mock_send_first.call_count, 1)
+        self.assertEqual(mock_schedule_flush.call_count, 2)
+
+    def test_held_requests_are_discarded_on_close(self, mock_schedule_flush, mock_send):
+        self._connection.send_value_request(1, 5, 0)
+        self._connection._on_close(self._connection._ws)
+        self._connection.flush()
+        self.assertFalse(mock_send.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
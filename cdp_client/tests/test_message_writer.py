@@ -0,0 +1,175 @@
+from cdp_client import cdp
+from cdp_client.tests import fake_data
+import threading
+import unittest
+import mock
+
+
+@mock.patch.object(cdp.websocket.WebSocketApp, 'send')
+class MessageWriterTester(unittest.TestCase):
+    def __init__(self, method_name):
+        unittest.TestCase.__init__(self, method_name)
+        self._connection = None
+
+    def setUp(self):
+        self._first_send_started = threading.Event()
+        self._release = threading.Event()
+        self._sent = []
+
+    def tearDown(self):
+        self._release.set()
+        del self._connection
+
+    def create_connection(self, writer):
+        self._connection = cdp.Connection("foo", "bar", False, message_writer=writer)
+        return self._connection
+
+    def blocking_send(self, message):
+        self._first_send_started.set()
+        self._release.wait(5)
+        self._sent.append(message)
+
+    def write_while_first_send_blocks(self, mock_send, connection, messages):
+        mock_send.side_effect = self.blocking_send
+        connection._send_frame(messages[0])
+        self.assertTrue(self._first_send_started.wait(5))
+        for message in messages[1:]:
+            connection._send_frame(message)
+
+    def test_messages_are_sent_in_order_by_writer_thread(self, mock_send):
+        threads = set()
+        mock_send.side_effect = lambda message: (threads.add(threading.current_thread()), self._sent.append(message))
+        writer = cdp.MessageWriter()
+        connection = self.create_connection(writer)
+        producers = [threading.Thread(target=lambda i=i: [connection._send_frame(bytes([i, j])) for j in range(100)])
+                     for i in range(4)]
+        for producer in producers:
+            producer.start()
+        for producer in producers:
+            producer.join(5)
+        writer.close(5)
+        self.assertEqual(len(self._sent), 400)
+        for i in range(4):
+            self.assertEqual([m[1] for m in self._sent if m[0] == i], list(range(100)))
+        self.assertEqual(threads, {writer._thread})
+        self.assertEqual(connection.outbound_stats().frames, 400)
+
+    def test_raise(self, mock_send):
+        writer = cdp.MessageWriter(maxsize=2, overflow_policy=cdp.OverflowPolicy.RAISE)
+        connection = self.create_connection(writer)
+        self.write_while_first_send_blocks(mock_send, connection, [b'1', b'2', b'3'])
+        with self.assertRaises(cdp.QueueFullError):
+            connection._send_frame(b'4')
+        self._release.set()
+        writer.close(5)
+        self.assertEqual(self._sent, [b'1', b'2', b'3'])
+
+    def test_subscription_is_undone_when_request_cannot_be_queued(self, mock_send):
+        writer = cdp.MessageWriter(maxsize=1, overflow_policy=cdp.OverflowPolicy.RAISE)
+        connection = self.create_connection(writer)
+        node = cdp.Node(None, connection, fake_data.value1_node)
+        self.write_while_first_send_blocks(mock_send, connection, [b'1', b'2'])
+        callback = lambda value, timestamp: None
+        with self.assertRaises(cdp.QueueFullError):
+            node.subscribe_to_value_changes(callback, sample_rate=2)
+        self.assertEqual(node._value_subscriptions, ())
+        self.assertIsNone(node._rates.requested)
+
+        self._release.set()
+        writer._drain(connection, 5)
+        node.subscribe_to_value_changes(callback, sample_rate=2)
+        writer.close(5)
+        self.assertEqual(self._sent[-1], fake_data.create_value_request(fake_data.value1_node.info.node_id, 5, 2)
+                         .SerializeToString())
+
+    def test_sends_of_the_client_itself_wait_instead_of_raising(self, mock_send):
+        writer = cdp.MessageWriter(maxsize=1, overflow_policy=cdp.OverflowPolicy.RAISE)
+        connection = self.create_connection(writer)
+        self.write_while_first_send_blocks(mock_send, connection, [b'1', b'2'])
+        timer_thread = threading.Thread(target=cdp.run_internally, args=(connection._send_frame, b'3'))
+        timer_thread.start()
+        timer_thread.join(0.1)
+        self.assertTrue(timer_thread.is_alive())
+        self._release.set()
+        timer_thread.join(5)
+        writer.close(5)
+        self.assertEqual(self._sent, [b'1', b'2', b'3'])
+
+    def test_drop_oldest(self, mock_send):
+        writer = cdp.MessageWriter(maxsize=2, overflow_policy=cdp.OverflowPolicy.DROP_OLDEST)
+        connection = self.create_connection(writer)
+        self.write_while_first_send_blocks(mock_send, connection, [b'1'])
+        connection._send_frame(b'2')
+        connection._send_frame(b'3', is_droppable=True)
+        connection._send_frame(b'4', is_droppable=True)
+        self.assertEqual(writer.stats().dropped, 1)
+        self._release.set()
+        writer.close(5)
+        self.assertEqual(self._sent, [b'1', b'2', b'4'])
+
+    def test_drop_oldest_waits_when_only_requests_that_are_not_setters_are_queued(self, mock_send):
+        writer = cdp.MessageWriter(maxsize=2, overflow_policy=cdp.OverflowPolicy.DROP_OLDEST)
+        connection = self.create_connection(writer)
+        self.write_while_first_send_blocks(mock_send, connection, [b'1', b'2', b'3'])
+        producer = threading.Thread(target=connection._send_frame, args=(b'4', True))
+        producer.start()
+        producer.join(0.1)
+        self.assertTrue(producer.is_alive())
+        self._release.set()
+        producer.join(5)
+        writer.close(5)
+        self.assertEqual(self._sent, [b'1', b'2', b'3', b'4'])
+        self.assertEqual(writer.stats().dropped, 0)
+
+    def test_setter_requests_are_droppable(self, mock_send):
+        mock_send.side_effect = self._sent.append
+        connection = self.create_connection(None)
+        with mock.patch.object(connection, '_send_frame') as mock_send_frame:
+            connection._send(fake_data.create_setter_request(fake_data.value1))
+            connection._send(fake_data.create_value_request(fake_data.value1.node_id, 5, 2))
+        self.assertEqual([c[0][1] for c in mock_send_frame.call_args_list], [True, False])
+
+    def test_block_and_high_water_callback(self, mock_send):
+        depths = []
+        writer = cdp.MessageWriter(maxsize=2, high_water_mark=2, high_water_callback=depths.append)
+        connection = self.create_connection(writer)
+        self.write_while_first_send_blocks(mock_send, connection, [b'1', b'2', b'3'])
+        self.assertEqual(depths, [2])
+        producer = threading.Thread(target=connection._send_frame, args=(b'4',))
+        producer.start()
+        producer.join(0.1)
+        self.assertTrue(producer.is_alive())
+        self._release.set()
+        producer.join(5)
+        writer.close(5)
+        self.assertEqual(self._sent, [b'1', b'2', b'3', b'4'])
+        self.assertEqual(writer.stats()[:2], (0, 0))
+
+    def test_queued_messages_are_discarded_on_close(self, mock_send):
+        writer = cdp.MessageWriter()
+        connection = self.create_connection(writer)
+        self.write_while_first_send_blocks(mock_send, connection, [b'1', b'2'])
+        connection._on_close(connection._ws)
+        self._release.set()
+        writer.close(5)
+        self.assertEqual(self._sent, [b'1'])
+
+    def test_queued_messages_are_sent_before_closing(self, mock_send):
+        writer = cdp.MessageWriter()
+        connection = self.create_connection(writer)
+        self.write_while_first_send_blocks(mock_send, connection, [b'1', b'2'])
+        with mock.patch.object(cdp.websocket.WebSocketApp, 'close',
+                               side_effect=lambda: self._sent.append('close')) as mock_close:
+            threading.Timer(0.1, self._release.set).start()
+            connection.close()
+        mock_close.assert_called_once_with()
+        writer.close(5)
+        self.assertEqual(self._sent, [b'1', b'2', 'close'])
+
+    def test_conflate_is_not_supported(self, mock_send):
+        with self.assertRaises(ValueError):
+            cdp.MessageWriter(overflow_policy=cdp.OverflowPolicy.CONFLATE)
+
+
+if __name__ == '__main__':
+    unittest.main()
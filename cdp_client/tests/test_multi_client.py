@@ -0,0 +1,74 @@
+from cdp_client import cdp
+from cdp_client import cdp_pb2 as proto
+from cdp_client.tests import fake_data
+from cdp_client.tests.fake_server import FakeServer, create_system_structure
+import asyncio
+import unittest
+
+
+def structure_requests(server):
+    return [r for r in server.requests if r.message_type == proto.Container.eStructureRequest]
+
+
+@unittest.skipIf(cdp.websockets is None, 'websockets is not installed')
+class MultiClientTester(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._servers = {'App1': FakeServer(create_system_structure('App1')),
+                         'App2': FakeServer(create_system_structure('App2'))}
+        for server in self._servers.values():
+            await server.start()
+        for server in self._servers.values():
+            for app in server.system_structure.node:
+                if not app.info.is_local:
+                    app.info.server_addr = '127.0.0.1'
+                    app.info.server_port = self._servers[app.info.name].port
+        self._client = cdp.MultiClient(port=self._servers['App1'].port)
+        self._client.start()
+
+    async def asyncTearDown(self):
+        await asyncio.wait_for(self._client.disconnect(), 5)
+        for server in self._servers.values():
+            await server.stop()
+
+    async def test_discovers_sibling_applications(self):
+        clients = await asyncio.wait_for(self._client.clients(), 5)
+        self.assertEqual(sorted(clients), ['App1', 'App2'])
+        root_nodes = await asyncio.wait_for(self._client.root_nodes(), 5)
+        self.assertEqual(sorted(node.name() for node in root_nodes), ['App1', 'App2'])
+
+    async def test_find_node_uses_connection_of_its_application(self):
+        node = await asyncio.wait_for(self._client.find_node('App2.Comp1.Value1'), 5)
+        self.assertEqual(node.path(), 'App2.Comp1.Value1')
+        comp_requests = [r for r in structure_requests(self._servers['App2']) if list(r.structure_request) == [9]]
+        self.assertEqual(len(comp_requests), 1)
+        self.assertEqual([r for r in structure_requests(self._servers['App1']) if list(r.structure_request) == [9]], [])
+        with self.assertRaises(cdp.NotFoundError):
+            await self._client.find_node('App3.Comp1')
+
+    async def test_values_of_all_applications_in_one_loop(self):
+        streams = []
+        for name in ('App1', 'App2'):
+            node = await asyncio.wait_for(self._client.find_node(name + '.Comp1.Value1'), 5)
+            streams.append(node.values())
+            await self._servers[name].wait_for_request(proto.Container.eGetterRequest)
+        await self._servers['App1'].send(fake_data.create_value_response(5, [1]))
+        await self._servers['App2'].send(fake_data.create_value_response(5, [2]))
+        self.assertEqual((await asyncio.wait_for(streams[0].__anext__(), 5))[0], 1)
+        self.assertEqual((await asyncio.wait_for(streams[1].__anext__(), 5))[0], 2)
+
+    async def test_connections_reconnect_independently(self):
+        node = await asyncio.wait_for(self._client.find_node('App2.Comp1.Value1'), 5)
+        values = node.values()
+        await self._servers['App2'].wait_for_request(proto.Container.eGetterRequest)
+        app1_requests = len(self._servers['App1'].requests)
+        del self._servers['App2'].requests[:]
+
+        await self._servers['App2'].disconnect()
+        await self._servers['App2'].wait_for_request(proto.Container.eGetterRequest)
+        await self._servers['App2'].send(fake_data.create_value_response(5, [3]))
+        self.assertEqual((await asyncio.wait_for(values.__anext__(), 5))[0], 3)
+        self.assertEqual(len(self._servers['App1'].requests), app1_requests)
+
+
+if __name__ == '__main__':
+    unittest.main()
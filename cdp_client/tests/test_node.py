@@ -43,6 +43,59 @@ class NodeTester(unittest.TestCase):
         node.set_value(data.value1.d_value, data.value1.timestamp)
         mock_send_value.assert_called_with(data.value1)
 
+    @mock.patch.object(cdp.Connection, 'send_value')
+    def test_value_round_trip_for_every_value_type(self, mock_send_value):
+        values = {
+            cdp.proto.eDOUBLE: ('d_value', 1.25),
+            cdp.proto.eUINT64: ('ui64_value', 2 ** 64 - 1),
+            cdp.proto.eINT64: ('i64_value', -2 ** 63),
+            cdp.proto.eFLOAT: ('f_value', 1.5),
+            cdp.proto.eUINT: ('ui_value', 2 ** 32 - 1),
+            cdp.proto.eINT: ('i_value', -2 ** 31),
+            cdp.proto.eUSHORT: ('us_value', 2 ** 16 - 1),
+            cdp.proto.eSHORT: ('s_value', -2 ** 15),
+            cdp.proto.eUCHAR: ('uc_value', 2 ** 8 - 1),
+            cdp.proto.eCHAR: ('c_value', -2 ** 7),
+            cdp.proto.eBOOL: ('b_value', True),
+            cdp.proto.eSTRING: ('str_value', 'foo'),
+        }
+        for value_type in cdp.proto.CDPValueType.values():
+            structure = copy(data.value1_node)
+            structure.info.value_type = value_type
+            node = cdp.Node(None, self._connection, structure)
+            if value_type not in values:
+                node._update_value(data.value1)
+                self.assertIsNone(node.last_value())
+                continue
+            field, value = values[value_type]
+            node.set_value(value, 123)
+            sent = mock_send_value.call_args[0][0]
+            self.assertEqual([f.name for f, v in sent.ListFields()], ['node_id', field, 'timestamp'])
+            received = cdp.proto.VariantValue()
+            received.ParseFromString(sent.SerializeToString())
+            node._update_value(received)
+            self.assertEqual(node.last_value(), value)
+            self.assertEqual(type(node.last_value()), type(value))
+            if cdp.numpy is not None:
+                decoded = node._codec.decode_many([received])
+                self.assertEqual(decoded.tolist(), [value])
+
+    def test_value_setter_rejects_out_of_range_value(self):
+        structure = copy(data.value1_node)
+        structure.info.value_type = cdp.proto.eUCHAR
+        node = cdp.Node(None, self._connection, structure)
+        self.assertRaises(ValueError, node.set_value, 256)
+
+    def test_float_value_setter_rejects_value_that_does_not_fit_float(self):
+        structure = copy(data.value1_node)
+        structure.info.value_type = cdp.proto.eFLOAT
+        node = cdp.Node(None, self._connection, structure)
+        self.assertRaises(ValueError, node.set_value, 1e40)
+        self.assertRaises(ValueError, node.set_value, -1e40)
+        if cdp.numpy is not None:
+            self.assertRaises(ValueError, node._codec.encode_many, cdp.numpy.array([1.0, 1e40]))
+            self.assertEqual(node._codec.encode_many(cdp.numpy.array([1.0, float('inf')])), [1.0, float('inf')])
+
     @mock.patch.object(cdp.Connection, 'send_structure_request')
     def test_child_getter_when_child_is_leaf(self, mock_send_structure_request):
         children = []
@@ -64,6 +117,26 @@ class NodeTester(unittest.TestCase):
         self.assertEqual(children[0].name(), data.app2_node.info.name)
         self.assertEqual(children[0].type(), cdp.NodeType.APPLICATION)
 
+    @mock.patch.object(cdp.Connection, 'send_structure_request')
+    def test_child_structure_is_fetched_only_once(self, mock_send_structure_request):
+        children = []
+        node = cdp.Node(None, self._connection, self._root_node)
+        mock_send_structure_request.return_value = Promise(lambda resolve, reject: resolve(data.app2_node))
+        node.child(data.app2_node.info.name).then(children.append)
+        node.child(data.app2_node.info.name).then(children.append)
+        node.children()
+        mock_send_structure_request.assert_called_once_with(data.app2_node.info.node_id, node.path() + '.' + data.app2_node.info.name)
+        self.assertEqual(children[0], children[1])
+        self.assertEqual(self._connection.node_tree().structure_cache_stats(), cdp.StructureCacheStats(2, 1))
+
+        children[0].refresh()
+        self.assertEqual(mock_send_structure_request.call_count, 2)
+
+        self._connection.node_tree()._root_node = node
+        self._connection._on_close(None)
+        node.child(data.app2_node.info.name)
+        self.assertEqual(mock_send_structure_request.call_count, 3)
+
     @mock.patch.object(cdp.Connection, 'send_structure_request')
     def test_invalid_child_getter(self, mock_send_structure_request):
         errors = []
@@ -90,6 +163,76 @@ class NodeTester(unittest.TestCase):
         mock_send_structure_request.assert_called_once_with(data.app2_node.info.node_id, node.path() + '.' + data.app2_node.info.name)
         self.assertEqual(len(children), len(self._root_node.node))
 
+    def _create_prefetch_structures(self):
+        leaf = copy(data.value1_node)
+        leaf.info.node_id = 31
+        sub_comp = copy(data.comp1_node)
+        sub_comp.info.node_id = 30
+        sub_comp.info.name = 'SubComp'
+        sub_comp.node.extend([leaf])
+        comp = copy(data.comp1_node)
+        comp.node.extend([sub_comp])
+        comp2 = copy(data.comp1_node)
+        comp2.info.node_id = 40
+        comp2.info.name = 'Comp2'
+        app = copy(data.app2_node)
+        app.node.extend([comp, comp2, data.value1_node])
+        return dict((s.info.node_id, s) for s in (app, comp, comp2, sub_comp))
+
+    @mock.patch.object(cdp.Connection, 'send_structure_requests')
+    def test_prefetch(self, mock_send_structure_requests):
+        def send_structure_requests(nodes):
+            return [Promise(lambda resolve, reject, node_id=node_id: resolve(structures[node_id])) for node_id, path in nodes]
+
+        structures = self._create_prefetch_structures()
+        mock_send_structure_requests.side_effect = send_structure_requests
+        progress = []
+        results = []
+        node = cdp.Node(None, self._connection, data.app2_node)
+        node.prefetch(progress_callback=progress.append).then(results.append)
+
+        self.assertEqual(results, [node])
+        self.assertEqual(mock_send_structure_requests.call_args_list,
+                         [mock.call([(2, 'App2')]),
+                          mock.call([(9, 'App2.Comp1'), (40, 'App2.Comp2')]),
+                          mock.call([(30, 'App2.Comp1.SubComp')])])
+        self.assertEqual(progress[-1], cdp.PrefetchProgress(4, 0, 3, 0))
+        self.assertEqual(node._find_child('Comp1')._find_child('SubComp')._find_child('Value1')._id(), 31)
+        self.assertEqual(self._connection.node_tree().structure_cache_stats(), cdp.StructureCacheStats(0, 0))
+
+    @mock.patch.object(cdp.Connection, 'send_structure_requests')
+    def test_prefetch_with_depth(self, mock_send_structure_requests):
+        def send_structure_requests(nodes):
+            return [Promise(lambda resolve, reject, node_id=node_id: resolve(structures[node_id])) for node_id, path in nodes]
+
+        structures = self._create_prefetch_structures()
+        mock_send_structure_requests.side_effect = send_structure_requests
+        results = []
+        node = cdp.Node(None, self._connection, data.app2_node)
+        node.prefetch(depth=1).then(results.append)
+        self.assertEqual(results, [node])
+        self.assertEqual(mock_send_structure_requests.call_count, 2)
+
+    @mock.patch.object(cdp.Connection, 'send_structure_requests')
+    def test_prefetch_keeps_requests_in_flight_bounded(self, mock_send_structure_requests):
+        def send_structure_requests(nodes):
+            promises = [Promise() for n in nodes]
+            pending.extend(zip([node_id for node_id, path in nodes], promises))
+            return promises
+
+        structures = self._create_prefetch_structures()
+        pending = []
+        results = []
+        mock_send_structure_requests.side_effect = send_structure_requests
+        node = cdp.Node(None, self._connection, data.app2_node)
+        node.prefetch(max_in_flight=1, batch_size=1).then(results.append)
+        while pending:
+            self.assertEqual(len(pending), 1)
+            node_id, promise = pending.pop(0)
+            promise.do_resolve(structures[node_id])
+        self.assertEqual(results, [node])
+        self.assertEqual(mock_send_structure_requests.call_count, 4)
+
     @mock.patch.object(cdp.Connection, 'send_structure_request')
     def test_structure_subscription(self, mock_send_structure_request):
         def on_change(added, removed):
@@ -124,6 +267,72 @@ class NodeTester(unittest.TestCase):
                 found = True
         self.assertTrue(found)
 
+    def test_structure_update_keeps_child_order(self):
+        def on_change(added, removed):
+            changes.append(([n._id() for n in added], [n._id() for n in removed]))
+
+        changes = []
+        structure = copy(data.system_node)
+        structure.node.extend([data.app1_node, data.app2_node, data.app3_node])
+        node = cdp.Node(None, self._connection, structure)
+        app2 = node._children[1]
+        node.subscribe_to_structure_changes(on_change)
+
+        renumbered_app1_node = copy(data.app1_node)
+        renumbered_app1_node.info.node_id = 11
+        changed_structure = copy(data.system_node)
+        changed_structure.node.extend([data.comp1_node, data.app3_node, renumbered_app1_node, data.app2_node])
+        node._update_structure(changed_structure)
+
+        self.assertEqual([c._id() for c in node._children], [2, 3, 9, 11])
+        self.assertIs(node._children[0], app2)
+        self.assertEqual(changes, [([9, 11], [1])])
+        node._update_structure(changed_structure)
+        self.assertEqual(len(changes), 1)
+
+    def test_children_are_built_when_first_accessed(self):
+        node_tree = self._connection.node_tree()
+        node_tree._root_node = cdp.Node(None, self._connection, copy(data.app1_node))
+        node_tree._ensure_index()
+        node = node_tree._root_node
+        node._update_structure(self._root_node)
+        self.assertIsNone(node._child_nodes)
+        self.assertIsNone(node_tree.find_by_id(12345))
+        self.assertIsNone(node._child_nodes)
+
+        self.assertEqual([c.name() for c in node._children], [data.app1_node.info.name, data.app2_node.info.name])
+        self.assertIs(node_tree.find_by_id(data.app2_node.info.node_id), node._children[1])
+
+    def test_cached_structure_is_built_lazily(self):
+        comp_node = copy(data.comp1_node)
+        comp_node.node.extend([data.value1_node])
+        app_node = copy(data.app2_node)
+        app_node.node.extend([comp_node])
+        node_tree = self._connection.node_tree()
+        node_tree._root_node = cdp.Node(None, self._connection, app_node)
+        node_tree._root_node._is_cached = True
+        node_tree._ensure_index()
+        self.assertIsNone(node_tree._root_node._child_nodes)
+
+        value = node_tree.find_by_path('App2.Comp1.Value1')
+        self.assertEqual(value._id(), data.value1_node.info.node_id)
+        self.assertTrue(value._is_cached and value.parent()._is_cached)
+        self.assertIs(node_tree.find_by_id(data.value1_node.info.node_id), value)
+
+    def test_node_is_compact(self):
+        node = cdp.Node(None, self._connection, self._root_node)
+        first, second = node._children
+        self.assertFalse(hasattr(node, '__dict__'))
+        self.assertIs(first._value_subscriptions, second._value_subscriptions)
+        self.assertIs(first.last_value(), second.last_value())
+
+        first.subscribe_to_structure_changes(lambda added, removed: None)
+        self.assertEqual(len(first._structure_subscriptions), 1)
+        self.assertEqual(second._structure_subscriptions, ())
+
+        renamed = cdp.Node(None, self._connection, copy(data.app2_node))
+        self.assertIs(renamed.name(), second.name())
+
     def test_structure_unsubscription(self):
         def on_change(added, removed):
             nodes_added.extend(added)
@@ -181,7 +390,7 @@ class NodeTester(unittest.TestCase):
         mock_send_value_request.assert_called_once_with(node._id(), 10, 6)
         mock_send_value_request.reset_mock()
         node.subscribe_to_value_changes(on_change3, 1, 3)
-        mock_send_value_request.assert_called_once_with(node._id(), 10, 6)
+        mock_send_value_request.assert_not_called()
 
     @mock.patch.object(cdp.Connection, 'send_structure_request')
     @mock.patch.object(cdp.Connection, 'send_value_request')
@@ -232,6 +441,142 @@ class NodeTester(unittest.TestCase):
         node.unsubscribe_from_value_changes(on_change3)
         mock_send_value_request.assert_called_once_with(node._id(), 5, 3)
 
+    @mock.patch.object(cdp.Connection, 'send_value_request')
+    @mock.patch.object(cdp.Connection, 'send_value_unrequest')
+    def test_value_request_sent_only_when_rate_changes(self, mock_send_value_unrequest, mock_send_value_request):
+        def on_change1():
+            pass
+        def on_change2():
+            pass
+        node = cdp.Node(None, self._connection, data.value1_node)
+        node.subscribe_to_value_changes(on_change1, 10, 0)
+        node.subscribe_to_value_changes(on_change2, 10, 0)
+        node.unsubscribe_from_value_changes(on_change2)
+        node.subscribe_to_latest_value(5, 2)
+        node.unsubscribe_from_latest_value()
+        mock_send_value_request.assert_called_once_with(node._id(), 10, 0)
+        node.unsubscribe_from_value_changes(on_change1)
+        node.unsubscribe_from_value_changes(on_change1)
+        mock_send_value_unrequest.assert_called_once_with(node._id())
+        node.subscribe_to_value_changes(on_change1, 10, 0)
+        self.assertEqual(mock_send_value_request.call_count, 2)
+
+    @unittest.skipIf(cdp.numpy is None, 'numpy is not installed')
+    @mock.patch.object(cdp.Connection, 'send_value_request')
+    @mock.patch.object(cdp.Connection, 'send_value_unrequest')
+    def test_value_batch_subscription(self, mock_send_value_unrequest, mock_send_value_request):
+        def on_batch(values, timestamps):
+            batches.append((values, timestamps))
+
+        batches = []
+        node = cdp.Node(None, self._connection, data.value1_node)
+        node.subscribe_to_value_batches(on_batch, 2, 100)
+        mock_send_value_request.assert_called_once_with(node._id(), 2, 100)
+        self._connection._clock_estimator.add_sample(10, 10, 9)
+        node._update_value_batch([data.value1, data.value2])
+
+        self.assertEqual(len(batches), 1)
+        values, timestamps = batches[0]
+        self.assertEqual(values.dtype, cdp.numpy.float64)
+        self.assertEqual(values.tolist(), [data.value1.d_value, data.value2.d_value])
+        self.assertEqual(timestamps.dtype, cdp.numpy.int64)
+        self.assertEqual(timestamps.tolist(), [data.value1.timestamp + 1000000000, data.value2.timestamp + 1000000000])
+        self.assertEqual(node.last_value(), data.value2.d_value)
+
+        node.unsubscribe_from_value_batches(on_batch)
+        mock_send_value_unrequest.assert_called_once_with(node._id())
+
+    @staticmethod
+    def create_samples(values, interval):
+        samples = []
+        for i, value in enumerate(values):
+            sample = cdp.proto.VariantValue()
+            sample.node_id = data.value1_node.info.node_id
+            sample.d_value = value
+            sample.timestamp = int(i * interval * 1000000000)
+            samples.append(sample)
+        return samples
+
+    @mock.patch.object(cdp.Connection, 'send_value_request')
+    def test_value_subscription_decimated_to_own_sample_rate(self, mock_send_value_request):
+        all_values = []
+        decimated_values = []
+        node = cdp.Node(None, self._connection, data.value1_node)
+        node.subscribe_to_value_changes(lambda value, timestamp: all_values.append(value), 10, 0)
+        node.subscribe_to_value_changes(lambda value, timestamp: decimated_values.append(value), 1, 2)
+        for sample in self.create_samples(range(300), 0.01):
+            node._update_value(sample)
+        self.assertEqual(len(all_values), 300)
+        self.assertEqual(decimated_values, [0, 50, 100, 150, 200, 250])
+
+    @mock.patch.object(cdp.Connection, 'send_value_request')
+    def test_value_subscription_aggregated(self, mock_send_value_request):
+        received = dict((aggregation, []) for aggregation in (cdp.Aggregation.LAST, cdp.Aggregation.MEAN,
+                                                              cdp.Aggregation.MIN, cdp.Aggregation.MAX))
+        node = cdp.Node(None, self._connection, data.value1_node)
+        for aggregation, values in received.items():
+            node.subscribe_to_value_changes(lambda value, timestamp, values=values: values.append(value),
+                                            1, 0, aggregation)
+        for sample in self.create_samples([1, 3, 2, 6, 4, 5, 7, 8, 0], 0.25):
+            node._update_value(sample)
+        self.assertEqual(received[cdp.Aggregation.LAST], [6, 8])
+        self.assertEqual(received[cdp.Aggregation.MEAN], [3, 6])
+        self.assertEqual(received[cdp.Aggregation.MIN], [1, 4])
+        self.assertEqual(received[cdp.Aggregation.MAX], [6, 8])
+
+    @unittest.skipIf(cdp.numpy is None, 'numpy is not installed')
+    @mock.patch.object(cdp.Connection, 'send_value_request')
+    def test_value_batch_decimated_to_own_sample_rate(self, mock_send_value_request):
+        batches = []
+        node = cdp.Node(None, self._connection, data.value1_node)
+        node.subscribe_to_value_changes(lambda value, timestamp: None, 10, 0)
+        node.subscribe_to_value_batches(lambda values, timestamps: batches.append(values.tolist()), 1, 4)
+        samples = self.create_samples(range(100), 0.01)
+        node._update_value_batch(samples[:40])
+        node._update_value_batch(samples[40:45])
+        node._update_value_batch(samples[45:])
+        self.assertEqual(batches, [[0, 25], [50, 75]])
+
+    @mock.patch.object(cdp.Connection, 'send_value_request')
+    def test_value_subscription_deadband(self, mock_send_value_request):
+        received = {'absolute': [], 'percent': [], 'changes': []}
+        node = cdp.Node(None, self._connection, data.value1_node)
+        node.subscribe_to_value_changes(lambda value, timestamp: received['absolute'].append(value), deadband=1)
+        node.subscribe_to_value_changes(lambda value, timestamp: received['percent'].append(value),
+                                        deadband=cdp.Deadband(10, cdp.DeadbandMode.PERCENT))
+        node.subscribe_to_value_changes(lambda value, timestamp: received['changes'].append(value),
+                                        deadband=cdp.Deadband(0, cdp.DeadbandMode.CHANGES))
+        for sample in self.create_samples([10, 10.5, 10.5, 11.5, 10.2, 12, 12], 0.1):
+            node._update_value(sample)
+        self.assertEqual(received['absolute'], [10, 11.5, 10.2, 12])
+        self.assertEqual(received['percent'], [10, 11.5, 10.2, 12])
+        self.assertEqual(received['changes'], [10, 10.5, 11.5, 10.2, 12])
+
+    @mock.patch.object(cdp.Connection, 'send_value_request')
+    def test_value_subscription_deadband_of_bool_passes_changes(self, mock_send_value_request):
+        values = []
+        node = cdp.Node(None, self._connection, data.bool_node)
+        node.subscribe_to_value_changes(lambda value, timestamp: values.append(value), deadband=5)
+        for value in [False, False, True, True, False]:
+            sample = cdp.proto.VariantValue()
+            sample.b_value = value
+            node._update_value(sample)
+        self.assertEqual(values, [False, True, False])
+
+    @unittest.skipIf(cdp.numpy is None, 'numpy is not installed')
+    @mock.patch.object(cdp.Connection, 'send_value_request')
+    def test_value_batch_deadband_matches_single_values(self, mock_send_value_request):
+        batches = []
+        single_values = []
+        node = cdp.Node(None, self._connection, data.value1_node)
+        node.subscribe_to_value_batches(lambda values, timestamps: batches.extend(values.tolist()), deadband=0.5)
+        node.subscribe_to_value_changes(lambda value, timestamp: single_values.append(value), deadband=0.5)
+        samples = self.create_samples(cdp.numpy.sin(cdp.numpy.arange(500) / 20.0) * 3, 0.01)
+        node._update_value_batch(samples[:7])
+        node._update_value_batch(samples[7:])
+        self.assertEqual(batches, single_values)
+        self.assertTrue(30 < len(batches) < 100)
+
     @mock.patch.object(cdp.Connection, 'send_event_request')
     def test_event_subscription(self, mock_send_event_request):
         def on_event(event_info):
@@ -60,3 +60,40 @@ class NodeTreeTester(unittest.TestCase):
         path = '.'.join([system_node.info.name, app_node.info.name, fake_data.value1_node.info.name])
         node = self._node_tree.find_by_path(path)
         self.assertEqual(node._id(), fake_data.value1_node.info.node_id)
+
+    def test_find_node_by_id_after_structure_change(self):
+        app_node = copy(fake_data.app2_node)
+        app_node.node.extend([fake_data.value1_node])
+        self._node_tree._connection._node_tree = self._node_tree
+        self._node_tree._root_node = cdp.Node(None, self._node_tree._connection, app_node)
+        self.assertIsNotNone(self._node_tree.find_by_id(fake_data.value1_node.info.node_id))
+
+        changed_app_node = copy(fake_data.app2_node)
+        changed_app_node.info.node_id = 20
+        changed_app_node.node.extend([fake_data.comp1_node])
+        self._node_tree._root_node._update_structure(changed_app_node)
+
+        self.assertIsNone(self._node_tree.find_by_id(fake_data.app2_node.info.node_id))
+        self.assertIsNone(self._node_tree.find_by_id(fake_data.value1_node.info.node_id))
+        self.assertIsNone(self._node_tree.find_by_path('App2.Value1'))
+        self.assertEqual(self._node_tree.find_by_id(20), self._node_tree._root_node)
+        comp_node = self._node_tree.find_by_id(fake_data.comp1_node.info.node_id)
+        self.assertEqual(comp_node.name(), fake_data.comp1_node.info.name)
+        self.assertEqual(self._node_tree.find_by_path('App2.Comp1'), comp_node)
+
+    def test_find_node_by_path_after_rename(self):
+        app_node = copy(fake_data.app2_node)
+        app_node.node.extend([fake_data.value1_node])
+        self._node_tree._connection._node_tree = self._node_tree
+        self._node_tree._root_node = cdp.Node(None, self._node_tree._connection, app_node)
+        value_node = self._node_tree.find_by_path('App2.Value1')
+
+        renamed_value_node = copy(fake_data.value1_node)
+        renamed_value_node.info.name = 'Renamed'
+        changed_app_node = copy(fake_data.app2_node)
+        changed_app_node.node.extend([renamed_value_node])
+        self._node_tree._root_node._update_structure(changed_app_node)
+
+        self.assertIsNone(self._node_tree.find_by_path('App2.Value1'))
+        self.assertEqual(self._node_tree.find_by_path('App2.Renamed'), value_node)
+        self.assertEqual(self._node_tree.find_by_id(fake_data.value1_node.info.node_id), value_node)
@@ -0,0 +1,76 @@
+from cdp_client import cdp
+from cdp_client import cdp_pb2 as proto
+from cdp_client.tests import fake_data
+from cdp_client.tests.fake_server import FakeServer, create_system_structure
+import asyncio
+import unittest
+import mock
+
+
+def create_renumbered_system_structure(offset):
+    """Returns the system structure of create_system_structure() with the ids of the local application moved."""
+    system = create_system_structure()
+    nodes = [app for app in system.node if app.info.is_local]
+    while nodes:
+        node = nodes.pop()
+        node.info.node_id += offset
+        nodes.extend(node.node)
+    return system
+
+
+class ReconnectBackoffTester(unittest.TestCase):
+    @mock.patch.object(cdp.random, 'random', return_value=0)
+    def test_delay_grows_to_maximum_and_resets(self, mock_random):
+        backoff = cdp.ReconnectBackoff(initial_delay=1, maximum_delay=5, multiplier=2)
+        self.assertEqual([backoff.next_delay() for _ in range(5)], [1, 2, 4, 5, 5])
+        backoff.reset()
+        self.assertEqual(backoff.next_delay(), 1)
+
+    def test_jitter_shortens_delay(self):
+        backoff = cdp.ReconnectBackoff(initial_delay=4, multiplier=1, jitter=0.25)
+        delays = [backoff.next_delay() for _ in range(100)]
+        self.assertTrue(all(3 <= delay <= 4 for delay in delays))
+        self.assertGreater(len(set(delays)), 1)
+
+
+@unittest.skipIf(cdp.websockets is None, 'websockets is not installed')
+class ReconnectTester(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._server = FakeServer()
+        await self._server.start()
+        self._client = cdp.AsyncClient(port=self._server.port, auto_reconnect=True,
+                                       reconnect_backoff=cdp.ReconnectBackoff(initial_delay=0.01))
+        self._client.start()
+
+    async def asyncTearDown(self):
+        await asyncio.wait_for(self._client.disconnect(), 5)
+        await self._server.stop()
+
+    async def test_subscriptions_are_restored_with_renumbered_ids(self):
+        value = await asyncio.wait_for(self._client.find_node('App1.Comp1.Value1'), 5)
+        integer = await asyncio.wait_for(self._client.find_node('App1.Comp1.Int1'), 5)
+        async with value.values(fs=10) as values, integer.events():
+            await self._server.wait_for_request(proto.Container.eEventRequest)
+            self._server.system_structure = create_renumbered_system_structure(100)
+            del self._server.requests[:]
+            await self._server.disconnect()
+
+            request = await self._server.wait_for_request(proto.Container.eGetterRequest)
+            self.assertEqual([(r.node_id, r.fs) for r in request.getter_request], [(105, 10)])
+            request = await self._server.wait_for_request(proto.Container.eEventRequest)
+            self.assertEqual([r.node_id for r in request.event_request], [107])
+            structure_requests = [list(r.structure_request) for r in self._server.requests
+                                  if r.message_type == proto.Container.eStructureRequest and r.structure_request]
+            self.assertEqual(structure_requests, [[101], [109]])
+
+            await self._server.send(fake_data.create_value_response(105, [3]))
+            self.assertEqual((await asyncio.wait_for(values.__anext__(), 5))[0], 3)
+        self.assertEqual(value._node._id(), 105)
+        stats = self._client.reconnect_stats()
+        self.assertEqual(stats.reconnects, 1)
+        self.assertLessEqual(stats.last_delay, 0.01)
+        self.assertGreaterEqual(stats.first_value_latency, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
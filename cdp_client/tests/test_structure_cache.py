@@ -0,0 +1,128 @@
+from cdp_client import cdp
+from cdp_client import cdp_pb2 as proto
+from cdp_client.tests import fake_data
+from copy import copy
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+
+
+def create_cached_system_structure():
+    comp_node = copy(fake_data.comp1_node)
+    comp_node.node.extend([fake_data.value1_node])
+    app_node = copy(fake_data.app2_node)
+    app_node.info.is_local = True
+    app_node.node.extend([comp_node])
+    system_node = copy(fake_data.system_node)
+    system_node.node.extend([app_node])
+    return system_node
+
+
+class StructureCacheTester(unittest.TestCase):
+    def __init__(self, method_name):
+        unittest.TestCase.__init__(self, method_name)
+        self._directory = None
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._cache = cdp.StructureCache(self._directory)
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def test_store_and_load(self):
+        structure = create_cached_system_structure()
+        self._cache.store('System', 'App2', '1.2.3', structure)
+        self.assertEqual(self._cache.load('System', 'App2', '1.2.3'), structure)
+        self.assertIsNone(self._cache.load('System', 'App2', '1.2.4'))
+
+    def test_load_corrupt_file(self):
+        self._cache.store('System', 'App2', '1.2.3', create_cached_system_structure())
+        for file_name in os.listdir(self._directory):
+            with open(os.path.join(self._directory, file_name), 'wb') as f:
+                f.write(b'\xff\xff\xff')
+        self.assertIsNone(self._cache.load('System', 'App2', '1.2.3'))
+
+    @staticmethod
+    def respond(connection, *structures):
+        response = proto.Container()
+        response.message_type = proto.Container.eStructureResponse
+        response.structure_response.extend(structures)
+        connection._handle_container_message(response.SerializeToString())
+
+    @staticmethod
+    def create_structure(node, node_id, children=()):
+        structure = copy(node)
+        structure.info.node_id = node_id
+        structure.node.extend(children)
+        return structure
+
+    @mock.patch.object(cdp.websocket.WebSocketApp, 'send')
+    def test_nodes_are_found_from_cache_before_structure_is_received(self, mock_send):
+        self._cache.store('foo', '', '0.0.0', create_cached_system_structure())
+        client = cdp.Client('foo', structure_cache=self._cache)
+        connection = client._connection
+        nodes = []
+        client.find_node('App2.Comp1.Value1').then(nodes.append)
+        self.assertEqual(nodes, [])
+
+        connection._handle_hello_message(fake_data.create_valid_hello_response().SerializeToString())
+
+        self.assertEqual(len(nodes), 1)
+        self.assertEqual(nodes[0]._id(), fake_data.value1_node.info.node_id)
+        structure_requests = [c for c in fake_data.sent_containers(mock_send)
+                              if c.message_type == proto.Container.eStructureRequest]
+        self.assertEqual(structure_requests, [fake_data.create_structure_request()])
+
+        # revalidation goes top-down and replaces the cached structure
+        system_structure = create_cached_system_structure()
+        del system_structure.node[0].node[:]
+        self.respond(connection, system_structure)
+        self.respond(connection, self.create_structure(fake_data.app2_node, fake_data.app2_node.info.node_id,
+                                                       [fake_data.comp1_node]))
+        self.respond(connection, self.create_structure(fake_data.comp1_node, fake_data.comp1_node.info.node_id,
+                                                       [fake_data.app3_node]))
+        comp = connection.node_tree().find_by_path('App2.Comp1')
+        self.assertFalse(comp._is_cached)
+        self.assertEqual([c.name() for c in comp._children], [fake_data.app3_node.info.name])
+
+    @mock.patch.object(cdp.websocket.WebSocketApp, 'send')
+    def test_subscriptions_made_through_cache_follow_renumbered_nodes(self, mock_send):
+        self._cache.store('foo', '', '0.0.0', create_cached_system_structure())
+        client = cdp.Client('foo', structure_cache=self._cache)
+        connection = client._connection
+        connection._handle_hello_message(fake_data.create_valid_hello_response().SerializeToString())
+        nodes = []
+        client.find_node('App2.Comp1.Value1').then(nodes.append)  # found from the cache after connecting as well
+        value = nodes[0]
+        comp = value.parent()
+        value.subscribe_to_value_changes(lambda value, timestamp: None, sample_rate=2)
+        mock_send.reset_mock()
+
+        system_structure = create_cached_system_structure()
+        del system_structure.node[0].node[:]
+        self.respond(connection, system_structure)
+        self.respond(connection, self.create_structure(fake_data.app2_node, fake_data.app2_node.info.node_id,
+                                                       [self.create_structure(fake_data.comp1_node, 300)]))
+        self.respond(connection, self.create_structure(fake_data.comp1_node, 300,
+                                                       [self.create_structure(fake_data.value1_node, 200)]))
+
+        self.assertIs(connection.node_tree().find_by_path('App2.Comp1'), comp)
+        self.assertIs(connection.node_tree().find_by_path('App2.Comp1.Value1'), value)
+        self.assertEqual((comp._id(), value._id()), (300, 200))
+        sent = [call[0][0] for call in mock_send.call_args_list]
+        self.assertIn(fake_data.create_structure_request(300).SerializeToString(), sent)
+        self.assertIn(fake_data.create_value_request(200, 5, 2).SerializeToString(), sent)
+
+    @mock.patch.object(cdp.websocket.WebSocketApp, 'close')
+    @mock.patch.object(cdp.Connection, 'send_structure_request')
+    def test_structure_is_stored_on_disconnect(self, mock_send_structure_request, mock_close):
+        system_structure = create_cached_system_structure()
+        mock_send_structure_request.side_effect = [cdp.Promise(lambda resolve, reject: resolve(system_structure)),
+                                                   cdp.Promise(lambda resolve, reject: resolve(system_structure.node[0]))]
+        client = cdp.Client('foo', structure_cache=self._cache)
+        client.root_node()
+        client.disconnect()
+        self.assertEqual(self._cache.load('', '', ''), system_structure)
@@ -0,0 +1,94 @@
+from cdp_client import cdp
+from cdp_client import cdp_pb2 as proto
+from cdp_client.tests import fake_data
+from copy import copy
+import unittest
+import mock
+
+
+def create_value_node(node_id):
+    structure = copy(fake_data.value1_node)
+    structure.info.node_id = node_id
+    structure.info.name = 'Value' + str(node_id)
+    return structure
+
+
+class SubscriptionGroupTester(unittest.TestCase):
+    def __init__(self, method_name):
+        unittest.TestCase.__init__(self, method_name)
+        self._connection = None
+
+    def setUp(self):
+        self._connection = cdp.Connection("foo", "bar", False)
+        self._nodes = [cdp.Node(None, self._connection, create_value_node(i)) for i in range(10, 20)]
+
+    def tearDown(self):
+        del self._connection
+        del self._nodes
+
+    @mock.patch.object(cdp.websocket.WebSocketApp, 'send')
+    def test_subscribing_sends_single_message(self, mock_send):
+        cdp.SubscriptionGroup(self._connection, self._nodes, lambda node, value, timestamp: None, 10, 5)
+        containers = fake_data.sent_containers(mock_send)
+        self.assertEqual(len(containers), 1)
+        self.assertEqual(containers[0].message_type, proto.Container.eGetterRequest)
+        self.assertEqual([r.node_id for r in containers[0].getter_request], [n._id() for n in self._nodes])
+        for request in containers[0].getter_request:
+            self.assertEqual(request.fs, 10)
+            self.assertEqual(request.sample_rate, 5)
+
+    @mock.patch.object(cdp.websocket.WebSocketApp, 'send')
+    def test_subscribing_splits_messages_by_size(self, mock_send):
+        self._connection._max_message_size = 40
+        cdp.SubscriptionGroup(self._connection, self._nodes, lambda node, value, timestamp: None)
+        containers = fake_data.sent_containers(mock_send)
+        self.assertTrue(len(containers) > 1)
+        node_ids = [r.node_id for c in containers for r in c.getter_request]
+        self.assertEqual(node_ids, [n._id() for n in self._nodes])
+        for container in containers:
+            self.assertTrue(container.ByteSize() <= self._connection._max_message_size)
+
+    @mock.patch.object(cdp.websocket.WebSocketApp, 'send')
+    def test_callback_receives_node(self, mock_send):
+        received = []
+        node = cdp.Node(None, self._connection, fake_data.value1_node)
+        cdp.SubscriptionGroup(self._connection, [node], lambda n, value, timestamp: received.append((n, value, timestamp)))
+        node._update_value(fake_data.value1)
+        self.assertEqual(received, [(node, fake_data.value1.d_value, fake_data.value1.timestamp)])
+
+    @mock.patch.object(cdp.websocket.WebSocketApp, 'send')
+    def test_failures_are_reported_per_node(self, mock_send):
+        failures = []
+        comp_node = cdp.Node(None, self._connection, fake_data.comp1_node)
+        nodes = {'App.Value10': self._nodes[0], 'App.Missing': cdp.NotFoundError('Missing'), 'Comp1': comp_node}
+        group = cdp.SubscriptionGroup(self._connection, nodes, lambda node, value, timestamp: None,
+                                      failure_callback=lambda path, error: failures.append(path))
+        self.assertEqual(group.nodes(), [self._nodes[0]])
+        self.assertEqual(sorted(group.failures()), ['App.Missing', 'Comp1'])
+        self.assertIsInstance(group.failures()['App.Missing'], cdp.NotFoundError)
+        self.assertIsInstance(group.failures()['Comp1'], cdp.InvalidRequestError)
+        self.assertEqual(sorted(failures), ['App.Missing', 'Comp1'])
+
+    @mock.patch.object(cdp.websocket.WebSocketApp, 'send')
+    def test_remote_error_is_reported_per_node(self, mock_send):
+        group = cdp.SubscriptionGroup(self._connection, self._nodes, lambda node, value, timestamp: None)
+        error = fake_data.create_error_response()
+        error.error.node_id = self._nodes[3]._id()
+        self._connection._handle_container_message(error.SerializeToString())
+        self.assertEqual(list(group.failures()), [self._nodes[3].path()])
+
+    @mock.patch.object(cdp.websocket.WebSocketApp, 'send')
+    def test_unsubscribing_sends_single_message(self, mock_send):
+        received = []
+        group = cdp.SubscriptionGroup(self._connection, self._nodes, lambda node, value, timestamp: None)
+        self._nodes[0].subscribe_to_value_changes(lambda value, timestamp: received.append(value), 1, 0)
+        mock_send.reset_mock()
+        group.unsubscribe()
+        containers = fake_data.sent_containers(mock_send)
+        self.assertEqual(len(containers), 2)
+        self.assertEqual([(r.node_id, r.fs, r.stop) for r in containers[0].getter_request], [(self._nodes[0]._id(), 1, False)])
+        self.assertEqual([r.node_id for r in containers[1].getter_request], [n._id() for n in self._nodes[1:]])
+        self.assertTrue(all(r.stop for r in containers[1].getter_request))
+        self.assertEqual(group.nodes(), [])
+        self._nodes[0]._update_value(fake_data.value1)
+        self.assertEqual(received, [fake_data.value1.d_value])
@@ -17,6 +17,9 @@ setup(
         'websocket-client',
         'protobuf',
         'mock'],
+    extras_require={
+        'numpy': ['numpy'],
+        'asyncio': ['websockets']},
     keywords=["cdp cdpstudio studio client cdp-client cdp_client"],
     url='https://github.com/CDPTechnologies/PythonCDPClient',
     license='MIT',